@@ -0,0 +1,104 @@
+from dataclasses import dataclass, replace
+from typing import Dict, Iterable, Optional, Tuple
+
+from google_synthesizer import GoogleSynthesizer, GoogleSynthesizerConfig
+from google_transcriber import GoogleTranscriber, GoogleTranscriberConfig
+
+
+@dataclass(frozen=True)
+class CodecProfile:
+    name: str
+    audio_encoding: str
+    sample_rate_hertz: int
+    mime_type: str
+
+
+# Agent speech sent to the client, compressed codecs first
+OUTPUT_CODECS: Dict[str, CodecProfile] = {
+    "ogg_opus": CodecProfile("ogg_opus", "OGG_OPUS", 24000, "audio/ogg; codecs=opus"),
+    "mp3": CodecProfile("mp3", "MP3", 24000, "audio/mpeg"),
+    "mulaw": CodecProfile("mulaw", "MULAW", 8000, "audio/basic"),
+    "linear16": CodecProfile("linear16", "LINEAR16", 24000, "audio/wav"),
+}
+
+# Caller audio sent to STT
+INPUT_CODECS: Dict[str, CodecProfile] = {
+    "webm_opus": CodecProfile("webm_opus", "WEBM_OPUS", 48000, "audio/webm; codecs=opus"),
+    "ogg_opus": CodecProfile("ogg_opus", "OGG_OPUS", 16000, "audio/ogg; codecs=opus"),
+    "mulaw": CodecProfile("mulaw", "MULAW", 8000, "audio/basic"),
+    "linear16": CodecProfile("linear16", "LINEAR16", 16000, "audio/l16"),
+}
+
+DEFAULT_OUTPUT_CODEC = "linear16"
+DEFAULT_INPUT_CODEC = "linear16"
+
+BASE_SYNTHESIZER_CONFIG = GoogleSynthesizerConfig(language_code="en-IN", voice_name="en-IN-Chirp-HD-F", sample_rate_hertz=24000)
+BASE_TRANSCRIBER_CONFIG = GoogleTranscriberConfig(sampling_rate=16000, audio_encoding="LINEAR16", language_code="en-IN")
+
+# Synthesizers and transcribers only hold request configs on top of the shared
+# clients, one per codec is enough for every session.
+_synthesizers: Dict[str, GoogleSynthesizer] = {}
+_transcribers: Dict[str, GoogleTranscriber] = {}
+
+
+def _pick(preferences: Optional[str], codecs: Dict[str, CodecProfile], default: str) -> CodecProfile:
+    """
+    Pick the first supported codec from a comma separated preference list.
+    """
+    names: Iterable[str] = (preferences or "").lower().replace(" ", "").split(",")
+    for name in names:
+        if name in codecs:
+            return codecs[name]
+    return codecs[default]
+
+
+def get_synthesizer(codec: CodecProfile) -> GoogleSynthesizer:
+    if codec.name not in _synthesizers:
+        _synthesizers[codec.name] = GoogleSynthesizer(replace(
+            BASE_SYNTHESIZER_CONFIG,
+            audio_encoding=codec.audio_encoding,
+            sample_rate_hertz=codec.sample_rate_hertz,
+        ))
+    return _synthesizers[codec.name]
+
+
+def get_transcriber(codec: CodecProfile) -> GoogleTranscriber:
+    if codec.name not in _transcribers:
+        _transcribers[codec.name] = GoogleTranscriber(replace(
+            BASE_TRANSCRIBER_CONFIG,
+            audio_encoding=codec.audio_encoding,
+            sampling_rate=codec.sample_rate_hertz,
+        ))
+    return _transcribers[codec.name]
+
+
+def negotiate_codecs(output_codecs: Optional[str], input_codec: Optional[str]) -> Tuple[GoogleSynthesizer, GoogleTranscriber, Dict[str, Dict]]:
+    """
+    Negotiate the audio codecs of a connection.
+
+    Args:
+        output_codecs: Comma separated codecs the client can play, most preferred first.
+        input_codec: Comma separated codecs the client can record, most preferred first.
+
+    Returns:
+        The session's synthesizer and transcriber, and the negotiated formats to announce to the client.
+    """
+    output_profile = _pick(output_codecs, OUTPUT_CODECS, DEFAULT_OUTPUT_CODEC)
+    input_profile = _pick(input_codec, INPUT_CODECS, DEFAULT_INPUT_CODEC)
+    audio_format = {
+        "output": {"codec": output_profile.name, "mime_type": output_profile.mime_type, "sample_rate": output_profile.sample_rate_hertz},
+        "input": {"codec": input_profile.name, "mime_type": input_profile.mime_type, "sample_rate": input_profile.sample_rate_hertz},
+    }
+    return get_synthesizer(output_profile), get_transcriber(input_profile), audio_format
+
+
+def audio_duration(num_bytes: int, config: GoogleTranscriberConfig) -> float:
+    """
+    Approximate seconds of caller audio in num_bytes of the transcriber's input encoding.
+    Opus is variable bitrate, it is estimated at 32 kbps.
+    """
+    if config.audio_encoding == "LINEAR16":
+        return num_bytes / (2 * config.sampling_rate)
+    if config.audio_encoding == "MULAW":
+        return num_bytes / config.sampling_rate
+    return num_bytes * 8 / 32000
@@ -0,0 +1,179 @@
+import logging
+from dataclasses import dataclass
+from math import gcd
+from typing import Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Capture rates accepted from clients, arbitrary rates would make the resampler's filter bank huge
+SAMPLE_RATES = (8000, 11025, 12000, 16000, 22050, 24000, 32000, 44100, 48000)
+CHANNELS = (1, 2)
+SAMPLE_FORMATS = ("s16le", "f32le")
+
+
+@dataclass
+class AudioFormat:
+    sample_rate: int = 16000
+    channels: int = 1
+    sample_format: str = "s16le"  # or "f32le"
+
+
+def input_format(sample_rate: Optional[str], channels: Optional[str], sample_format: Optional[str], default_rate: int) -> AudioFormat:
+    """
+    The caller's audio format from query parameters, unsupported values fall back to the defaults.
+
+    Args:
+        sample_rate: e.g. "48000", None for the default_rate.
+        channels: "1" or "2", None for mono.
+        sample_format: "s16le" or "f32le", None for s16le.
+        default_rate: The transcriber's sample rate.
+    """
+    audio_format = AudioFormat(sample_rate=default_rate)
+    if sample_rate is not None:
+        if sample_rate.strip().isdigit() and int(sample_rate) in SAMPLE_RATES:
+            audio_format.sample_rate = int(sample_rate)
+        else:
+            logger.warning(f"Unsupported input_sample_rate {sample_rate!r}, using {default_rate}")
+    if channels is not None:
+        if channels.strip().isdigit() and int(channels) in CHANNELS:
+            audio_format.channels = int(channels)
+        else:
+            logger.warning(f"Unsupported input_channels {channels!r}, using mono")
+    if sample_format is not None:
+        if sample_format in SAMPLE_FORMATS:
+            audio_format.sample_format = sample_format
+        else:
+            logger.warning(f"Unsupported input_sample_format {sample_format!r}, using s16le")
+    return audio_format
+
+
+@dataclass
+class AudioFrontendConfig:
+    target_rate: int = 16000
+    taps_per_phase: int = 32
+    normalize_gain: bool = True
+    target_rms: float = 0.1
+    max_gain: float = 8.0
+    min_gain: float = 0.5
+    gain_smoothing: float = 0.3
+    noise_floor: float = 0.003
+
+
+class PolyphaseResampler:
+    """
+    Streaming rational resampler, out_rate / in_rate = L / M.
+
+    The windowed-sinc anti-aliasing filter is split into L polyphase
+    branches of taps_per_phase taps, so each output sample costs
+    taps_per_phase multiply-adds. The last input samples and the output
+    phase are carried between chunks, so chunk boundaries are seamless.
+    """
+
+    def __init__(self, in_rate: int, out_rate: int, taps_per_phase: int = 32):
+        divisor = gcd(in_rate, out_rate)
+        self.up = out_rate // divisor
+        self.down = in_rate // divisor
+        self.taps = taps_per_phase
+
+        length = self.taps * self.up
+        # Cut off just below the lower of the two Nyquist frequencies, in cycles per upsampled sample
+        cutoff = 0.42 / max(self.up, self.down)
+        n = np.arange(length) - (length - 1) / 2
+        h = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(length, 8.0)
+        h *= self.up / h.sum()
+        # phases[p, j] = h[p + j * up]
+        self.phases = h.reshape(self.taps, self.up).T.astype(np.float32)
+
+        self._history = np.zeros(self.taps - 1, dtype=np.float32)
+        self._position = (self.taps - 1) * self.up
+        self._offsets = np.arange(self.taps)
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        """
+        Resample a chunk of mono float32 samples.
+        """
+        if self.up == self.down:
+            return samples
+        buffer = np.concatenate((self._history, samples))
+        end = len(buffer) * self.up
+        count = max(0, -(-(end - self._position) // self.down))
+        positions = self._position + self.down * np.arange(count)
+        inputs = positions // self.up
+        windows = buffer[inputs[:, None] - self._offsets[None, :]]
+        output = np.einsum("ij,ij->i", windows, self.phases[positions % self.up])
+
+        consumed = len(buffer) - (self.taps - 1)
+        self._position += count * self.down - consumed * self.up
+        self._history = buffer[consumed:]
+        return output.astype(np.float32, copy=False)
+
+
+class AudioFrontend:
+    """
+    Turns caller audio into what the transcriber expects: mono LINEAR16 at
+    target_rate with a steady level. Input is read in place from the message
+    bytes, partial frames are carried over to the next chunk.
+    """
+
+    def __init__(self, input_format: AudioFormat, config: Optional[AudioFrontendConfig] = None):
+        self.input_format = input_format
+        self.config = config or AudioFrontendConfig()
+        self._dtype = np.dtype("<f4") if input_format.sample_format == "f32le" else np.dtype("<i2")
+        self._frame_bytes = self._dtype.itemsize * input_format.channels
+        self._remainder = b""
+        self._resampler = PolyphaseResampler(input_format.sample_rate, self.config.target_rate, self.config.taps_per_phase)
+        self._gain = 1.0
+
+    @property
+    def passthrough(self) -> bool:
+        """Input that is already in the target format and needs no level correction."""
+        return (
+            not self.config.normalize_gain
+            and self.input_format.sample_rate == self.config.target_rate
+            and self.input_format.channels == 1
+            and self.input_format.sample_format == "s16le"
+        )
+
+    def process(self, data: bytes) -> bytes:
+        """
+        Process one chunk of caller audio.
+
+        Args:
+            data: Interleaved samples in the input format.
+
+        Returns:
+            bytes: Mono LINEAR16 samples at the target rate.
+        """
+        if self.passthrough:
+            return data
+        if self._remainder:
+            data = self._remainder + data
+        usable = len(data) - len(data) % self._frame_bytes
+        self._remainder = bytes(memoryview(data)[usable:])
+        samples = np.frombuffer(memoryview(data)[:usable], dtype=self._dtype)
+        if not len(samples):
+            return b""
+
+        if self._dtype.kind == "i":
+            samples = samples.astype(np.float32) * (1 / 32768)
+        if self.input_format.channels > 1:
+            samples = samples.reshape(-1, self.input_format.channels).mean(axis=1, dtype=np.float32)
+
+        samples = self._resampler.process(samples)
+        if self.config.normalize_gain:
+            samples = self._apply_gain(samples)
+        return (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+    def _apply_gain(self, samples: np.ndarray) -> np.ndarray:
+        """Move the gain towards target_rms, ramping over the chunk to avoid clicks."""
+        config = self.config
+        rms = float(np.sqrt(np.mean(np.square(samples)))) if len(samples) else 0.0
+        previous = self._gain
+        if rms > config.noise_floor:
+            desired = min(config.max_gain, max(config.min_gain, config.target_rms / rms))
+            self._gain += config.gain_smoothing * (desired - self._gain)
+        if previous == self._gain:
+            return samples * np.float32(self._gain)
+        return samples * np.linspace(previous, self._gain, len(samples), dtype=np.float32)
@@ -0,0 +1,60 @@
+"""
+Cost of the STT audio front-end per stream.
+
+Feeds 60 seconds of synthetic speech-band audio through AudioFrontend in
+20 ms chunks for common browser capture formats and reports the real-time
+factor (processing time / audio duration), lower is better.
+
+Usage: python benchmarks/bench_audio_frontend.py
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio_frontend import AudioFormat, AudioFrontend, AudioFrontendConfig
+
+DURATION = 60.0
+CHUNK = 0.02
+
+
+def _capture(input_format: AudioFormat) -> bytes:
+    rate, channels = input_format.sample_rate, input_format.channels
+    t = np.arange(int(DURATION * rate)) / rate
+    signal = 0.2 * np.sin(2 * np.pi * 220 * t) * (1 + np.sin(2 * np.pi * 3 * t)) + 0.01 * np.random.randn(len(t))
+    frames = np.repeat(signal[:, None], channels, axis=1)
+    if input_format.sample_format == "f32le":
+        return frames.astype("<f4").tobytes()
+    return (frames * 32767).astype("<i2").tobytes()
+
+
+def bench(input_format: AudioFormat) -> None:
+    data = _capture(input_format)
+    frontend = AudioFrontend(input_format, AudioFrontendConfig(target_rate=16000))
+    chunk_bytes = int(CHUNK * input_format.sample_rate) * input_format.channels * (4 if input_format.sample_format == "f32le" else 2)
+    view = memoryview(data)
+    output = 0
+    start = time.perf_counter()
+    for offset in range(0, len(data), chunk_bytes):
+        output += len(frontend.process(view[offset:offset + chunk_bytes]))
+    elapsed = time.perf_counter() - start
+    print(
+        f"{input_format.sample_rate:>6} Hz x{input_format.channels} {input_format.sample_format}: "
+        f"{elapsed * 1000:8.1f} ms for {DURATION:.0f} s of audio, real-time factor {elapsed / DURATION:.5f}, "
+        f"{elapsed / (DURATION / CHUNK) * 1e6:6.1f} us per {CHUNK * 1000:.0f} ms chunk, {output // 2} samples out"
+    )
+
+
+if __name__ == "__main__":
+    for input_format in (
+        AudioFormat(48000, 2, "s16le"),
+        AudioFormat(48000, 1, "f32le"),
+        AudioFormat(44100, 2, "s16le"),
+        AudioFormat(16000, 1, "s16le"),
+        AudioFormat(8000, 1, "s16le"),
+    ):
+        bench(input_format)
@@ -0,0 +1,156 @@
+"""
+Cost of parsing Zoozle search responses.
+
+Compares loading the whole response with json.loads against the selective
+streaming parser used by the search tools, fed in 64 KB chunks as the
+network would deliver them. Reports the mean parse time and the peak
+memory allocated while parsing, lower is better.
+
+Responses are taken from captured response bodies (.json) or from session
+traces recorded with TRACE_DIR (.jsonl, the zoozle upstream responses in
+them). Without arguments a synthetic response with fifty itineraries is used.
+
+Usage: python benchmarks/bench_search_parser.py [response.json | trace.jsonl ...] [--repeat 20]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import Callable, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flights import search_parser
+from flights.search_parser import parse_search, summarise_response
+
+CHUNK = 65536
+AIRLINES = ("6E", "AI", "UK", "SG", "QP", "IX")
+AIRPORTS = ("BLR", "DEL", "BOM", "MAA", "HYD", "CCU", "GOI", "PNQ")
+
+
+def _segment(index: int) -> dict:
+    airline = random.choice(AIRLINES)
+    return {
+        "DepartureAirportLocationCode": random.choice(AIRPORTS),
+        "ArrivalAirportLocationCode": random.choice(AIRPORTS),
+        "DepartureDateTime": f"2026-11-02T{index % 24:02d}:15:00",
+        "ArrivalDateTime": f"2026-11-02T{(index + 2) % 24:02d}:45:00",
+        "MarketingAirlineCode": airline,
+        "OperatingAirline": {"Code": airline, "Equipment": "320", "FlightNumber": str(random.randint(100, 9999))},
+        "FlightNumber": str(random.randint(100, 9999)),
+        "CabinClassCode": "Y",
+        "ResBookDesigCode": "T",
+        "SeatsRemaining": {"Number": random.randint(1, 9), "BelowMinimum": False},
+        "StopQuantityInfo": {"ArrivalDateTime": "", "DepartureDateTime": "", "Duration": 0, "LocationCode": ""},
+        "Baggage": [{"Type": "Checkin", "Allowance": "15 Kg"}, {"Type": "Cabin", "Allowance": "7 Kg"}],
+        "JourneyDuration": random.randint(60, 600),
+        "Eticket": True,
+        "MarriageGroup": "O",
+    }
+
+
+def _fare(amount: float) -> dict:
+    return {"Amount": round(amount, 2), "CurrencyCode": "INR", "DecimalPlaces": 2}
+
+
+def _itinerary(index: int) -> dict:
+    base = random.uniform(3000, 15000)
+    return {
+        "AirItineraryPricingInfo": {
+            "FareType": "Public",
+            "FareSourceCode": "".join(random.choices("ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789", k=400)),
+            "ItinTotalFare": {
+                "BaseFare": _fare(base),
+                "TotalTax": _fare(base * 0.18),
+                "TotalFare": _fare(base * 1.18),
+                "TotalPriceAfterDiscount": _fare(base * 1.1),
+            },
+            "PTC_FareBreakdowns": [
+                {"PassengerTypeQuantity": {"Code": "ADT", "Quantity": 1}, "PassengerFare": {"BaseFare": _fare(base), "Taxes": [_fare(base * 0.05) for _ in range(6)]}},
+            ],
+            "FareRules": [{"Category": f"RULE{rule}", "Text": "Cancellation permitted before departure subject to fees. " * 4} for rule in range(4)],
+        },
+        "OriginDestinationOptions": [{"FlightSegments": [_segment(index + stop) for stop in range(random.randint(1, 3))]}],
+        "IsPassportMandatory": False,
+        "ValidatingAirlineCode": random.choice(AIRLINES),
+    }
+
+
+def synthetic_response(itineraries: int = 50) -> bytes:
+    random.seed(7)
+    response = {
+        "Success": True,
+        "count": itineraries * 3,
+        "Data": {"PricedItineraries": [_itinerary(index) for index in range(itineraries)], "SessionId": "x" * 64},
+        "facets": [{"field_name": f"facet_{facet}", "counts": [{"value": f"value_{value}", "count": value} for value in range(30)]} for facet in range(8)],
+        "airline_info": {code: {"name": f"Airline {code}", "logo": f"https://zoozle.dev/logos/{code}.png"} for code in AIRLINES},
+        "airport_info": {code: {"name": f"{code} International Airport", "city": code, "country": "IN"} for code in AIRPORTS},
+    }
+    return json.dumps(response).encode()
+
+
+def load_responses(paths: List[str]) -> List[Tuple[str, bytes]]:
+    responses = []
+    for path in paths:
+        with open(path, "rb") as file:
+            data = file.read()
+        if not path.endswith(".jsonl"):
+            responses.append((os.path.basename(path), data))
+            continue
+        for number, line in enumerate(data.splitlines()):
+            record = json.loads(line) if line.strip() else {}
+            if record.get("kind") == "upstream" and record.get("upstream") == "zoozle" and "response" in record:
+                responses.append((f"{os.path.basename(path)}:{number}", json.dumps(record["response"]).encode()))
+    return responses
+
+
+def _full_load(body: bytes):
+    return summarise_response(json.loads(body))
+
+
+def _streamed(body: bytes):
+    return parse_search(body[offset:offset + CHUNK] for offset in range(0, len(body), CHUNK))
+
+
+def measure(parse: Callable[[bytes], object], body: bytes, repeat: int) -> Tuple[float, int]:
+    """Mean seconds per parse, and the peak bytes allocated by one parse."""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        parse(body)
+    elapsed = (time.perf_counter() - started) / repeat
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    parse(body)
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare full JSON loading with the streaming search parser.")
+    parser.add_argument("responses", nargs="*", help="Captured response bodies (.json) or session traces (.jsonl)")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    responses = load_responses(args.responses) if args.responses else [("synthetic", synthetic_response())]
+    if search_parser.ijson is None:
+        print("ijson is not installed, the streaming parser falls back to json.loads")
+    else:
+        print(f"ijson backend: {search_parser.ijson.backend}")
+    print(f"{'response':<32} {'size KB':>8} {'json.loads ms':>14} {'peak KB':>9} {'streamed ms':>12} {'peak KB':>9}")
+    for name, body in responses:
+        full_time, full_peak = measure(_full_load, body, args.repeat)
+        streamed_time, streamed_peak = measure(_streamed, body, args.repeat)
+        print(
+            f"{name[-32:]:<32} {len(body) / 1024:8.0f} {full_time * 1000:14.2f} {full_peak / 1024:9.0f} "
+            f"{streamed_time * 1000:12.2f} {streamed_peak / 1024:9.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
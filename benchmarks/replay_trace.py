@@ -0,0 +1,242 @@
+"""
+Replay a session trace recorded with TRACE_DIR against the current code.
+
+Re-runs the local stages of a recorded session, slot prefill, the audio
+front-end and every tool call the agent made, in the recorded order and
+with the recorded state. Upstream HTTP requests are answered with the
+responses in the trace after the recorded latency, searches answered by
+the route pre-warmer are answered from it again. The live model, STT and
+TTS are not re-run, their recorded latencies are listed for reference.
+
+Reports the recorded and replayed latency of each stage, and the tool calls
+whose status or response differs from the recorded one. With --fail-over
+the exit status is 1 when any replayed stage is slower than recorded by
+more than the given percentage, for use in regression checks.
+
+Usage: python benchmarks/replay_trace.py traces/<session>.jsonl [--speed 1] [--fail-over 20] [--json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import uuid
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, List
+
+import httpx
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.tools import FunctionTool, ToolContext
+
+from audio_frontend import AudioFormat, AudioFrontend, AudioFrontendConfig
+from flights import search_flight_tools
+from flights.agent import root_agent
+from flights.custom_session import CustomSessionService
+from flights.route_prewarm import Search
+from flights.search_parser import summarise_response
+from flights.slot_extractor import prefill_slots
+
+# State the replay produces itself rather than taking from the trace
+REPLAY_OWNED_KEYS = ("last_search_id",)
+
+
+def load_trace(path: str) -> List[Dict[str, Any]]:
+    with open(path, "r") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def _key(url: str, payload: Any) -> str:
+    return url + " " + json.dumps(payload, sort_keys=True, separators=(",", ":"))
+
+
+async def _chunks(body: bytes, size: int = 16384):
+    for offset in range(0, len(body), size):
+        yield body[offset:offset + size]
+
+
+class RecordedUpstreams:
+    """
+    Stand-in for search_flight_tools._http_post answering from the trace.
+
+    Responses to the same request are returned in recorded order, the last
+    one is repeated if the replay makes more requests than were recorded.
+    """
+
+    def __init__(self, records: List[Dict[str, Any]], speed: float):
+        self.speed = speed
+        self.missing = 0
+        self._responses: Dict[str, Deque[Dict[str, Any]]] = defaultdict(deque)
+        for record in records:
+            self._responses[_key(record["url"], record["payload"])].append(record)
+
+    async def post(self, url: str, payload: Dict[str, Any], headers: Dict[str, str], timeout: float, parse=None) -> Any:
+        queue = self._responses.get(_key(url, payload))
+        if not queue:
+            self.missing += 1
+            raise httpx.ConnectError(f"No recorded response for {url}")
+        record = queue.popleft() if len(queue) > 1 else queue[0]
+        if self.speed:
+            await asyncio.sleep(record["latency"] / self.speed)
+        if "error" in record:
+            raise httpx.ConnectError(record["error"])
+        if parse is not None:
+            # Streamed responses go through the parser again, its cost is part of the tool call
+            return await parse(_chunks(json.dumps(record["response"]).encode()))
+        return record["response"]
+
+
+async def replay(records: List[Dict[str, Any]], speed: float) -> Dict[str, Any]:
+    """
+    Replay the records of one trace.
+
+    Args:
+        records: The trace records, the first is the "session" record.
+        speed: 1 keeps the recorded pacing and upstream latency, 10 is ten times faster, 0 does not wait.
+
+    Returns:
+        Dict[str, Any]: Recorded and replayed latencies per stage, plus replay counters.
+    """
+    header = records[0] if records and records[0]["kind"] == "session" else {}
+    upstreams = RecordedUpstreams([record for record in records if record["kind"] == "upstream"], speed)
+    search_flight_tools._http_post = upstreams.post
+    # Replays run far faster than users search, they are not rate limited
+    search_flight_tools.search_rate_limiter.config.enabled = False
+
+    service = CustomSessionService()
+    session = service.create_session(app_name="replay", user_id="replay", session_id=f"replay-{uuid.uuid4().hex}")
+    if header.get("today_datetime"):
+        session.state["today_datetime"] = header["today_datetime"]
+    context = InvocationContext(session_service=service, invocation_id="replay", agent=root_agent, session=session)
+    tools = {tool.__name__: FunctionTool(tool) for tool in root_agent.tools if callable(tool)}
+
+    frontend = None
+    if header.get("input_audio"):
+        frontend = AudioFrontend(
+            AudioFormat(**header["input_audio"]),
+            AudioFrontendConfig(target_rate=header.get("stt_sample_rate", 16000)),
+        )
+
+    stages: Dict[str, Dict[str, List[float]]] = defaultdict(lambda: {"recorded": [], "replayed": []})
+    status_changed = 0
+    response_changed = 0
+    started = time.monotonic()
+    for record in records:
+        if speed:
+            await asyncio.sleep(max(0.0, started + record["t"] / speed - time.monotonic()))
+        kind = record["kind"]
+
+        if kind == "tool_call":
+            tool = tools.get(record["tool"])
+            if tool is None:
+                continue
+            session.state.update({key: value for key, value in record["state"].items() if key not in REPLAY_OWNED_KEYS})
+            call_started = time.monotonic()
+            response = await tool.run_async(
+                args=record["args"],
+                tool_context=ToolContext(context, function_call_id=f"replay-{uuid.uuid4().hex}"),
+            )
+            stage = stages[f"tool:{record['tool']}"]
+            stage["recorded"].append(record["latency"])
+            stage["replayed"].append(time.monotonic() - call_started)
+            status = response.get("status") if isinstance(response, dict) else None
+            status_changed += status != record.get("status")
+            if "response" in record:
+                # Compared as it was recorded, through JSON
+                response_changed += json.loads(json.dumps(response, default=str)) != record["response"]
+
+        elif kind == "prewarm":
+            # The search was answered by the route pre-warmer, answer it the same way
+            search_flight_tools.route_prewarmer.preload(Search(*record["search"]), summarise_response(record["response"]))
+
+        elif kind == "stage" and record["stage"] == "prefill":
+            call_started = time.monotonic()
+            prefill_slots(session, record["text"])
+            stages["prefill"]["recorded"].append(record["latency"])
+            stages["prefill"]["replayed"].append(time.monotonic() - call_started)
+
+        elif kind == "stage" and record["stage"] == "audio_frontend" and frontend is not None:
+            # The audio itself is not recorded, the front-end's cost does not depend on the signal
+            samples = (np.random.randn(record["bytes_in"] // 2) * 3000).astype("<i2").tobytes()
+            call_started = time.monotonic()
+            frontend.process(samples)
+            stages["audio_frontend"]["recorded"].append(record["latency"])
+            stages["audio_frontend"]["replayed"].append(time.monotonic() - call_started)
+
+        elif kind == "stage":
+            stages[record["stage"]]["recorded"].append(record["latency"])
+
+        elif kind == "upstream":
+            stages[f"upstream:{record['upstream']}"]["recorded"].append(record["latency"])
+
+    return {
+        "stages": {name: dict(values) for name, values in stages.items()},
+        "status_changed": status_changed,
+        "response_changed": response_changed,
+        "missing_upstream_responses": upstreams.missing,
+    }
+
+
+def _summary(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    return {
+        "count": len(values),
+        "mean_ms": float(np.mean(values)) * 1000,
+        "p95_ms": float(np.percentile(values, 95)) * 1000,
+    }
+
+
+def report(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Summarise replay() results, with the relative change of each replayed stage."""
+    stages = {}
+    for name, values in sorted(result["stages"].items()):
+        recorded, replayed = _summary(values["recorded"]), _summary(values["replayed"])
+        summary = {"recorded": recorded, "replayed": replayed}
+        if recorded and replayed and recorded["mean_ms"] > 0:
+            summary["delta_pct"] = (replayed["mean_ms"] - recorded["mean_ms"]) / recorded["mean_ms"] * 100
+        stages[name] = summary
+    return {**result, "stages": stages}
+
+
+def _print(summary: Dict[str, Any]) -> None:
+    print(f"{'stage':<40} {'n':>4} {'recorded mean/p95 ms':>22} {'replayed mean/p95 ms':>22} {'delta':>8}")
+    for name, stage in summary["stages"].items():
+        recorded, replayed = stage["recorded"], stage["replayed"]
+        count = recorded.get("count") or replayed.get("count", 0)
+        recorded_text = f"{recorded['mean_ms']:.1f}/{recorded['p95_ms']:.1f}" if recorded else "-"
+        replayed_text = f"{replayed['mean_ms']:.1f}/{replayed['p95_ms']:.1f}" if replayed else "recorded only"
+        delta = f"{stage['delta_pct']:+.0f}%" if "delta_pct" in stage else ""
+        print(f"{name:<40} {count:>4} {recorded_text:>22} {replayed_text:>22} {delta:>8}")
+    print(f"tool status changed: {summary['status_changed']}, tool response changed: {summary['response_changed']}, missing upstream responses: {summary['missing_upstream_responses']}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Replay a recorded session trace against the current code.")
+    parser.add_argument("trace", help="JSONL trace written under TRACE_DIR")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 keeps recorded timing, 0 runs without waiting")
+    parser.add_argument("--fail-over", type=float, default=None, help="Exit 1 if a replayed stage is this many percent slower")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    summary = report(asyncio.run(replay(load_trace(args.trace), args.speed)))
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        _print(summary)
+
+    if args.fail_over is not None:
+        regressed = [name for name, stage in summary["stages"].items() if stage.get("delta_pct", 0) > args.fail_over]
+        if regressed:
+            print(f"Regressed by more than {args.fail_over:.0f}%: {', '.join(regressed)}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
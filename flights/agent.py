@@ -8,8 +8,9 @@ from pydantic import BaseModel, Field
 import requests
 
 from flights.constants import GEMINI_MODEL, GEMINI_MODEL_2
-from flights.memory import _load_precreated_itinerary, memorize
-from flights.search_flight_tools import apply_filters_on_search_results, get_cities, get_filters, search_flights_tool
+from flights.memory import _load_precreated_itinerary, memorize, memorize_many
+from flights.search_flight_tools import apply_filters_on_search_results, get_cities, get_filters, resolve_cities, search_flights_tool
+from session_trace import trace_after_tool, trace_before_tool
 
 
 
@@ -116,8 +117,10 @@ root_agent = Agent(
 
         Tools Available:
             - get_cities: to get the iata code of the city
+            - resolve_cities: to get the iata codes of several cities in one call
             - search_flights_tool: to search for flights
             - memorize: to store the state
+            - memorize_many: to store several details of the state in one call
             - get_filters: to get the filters available for the search results
             - apply_filters_on_search_results: to apply the filters on the search results
 
@@ -179,9 +182,13 @@ root_agent = Agent(
 
         Note:
             - return date is optional
-            - if user provide all the input in one go, do not follow the steps in the order, got to relevant step and ask the user the question. In this case use memorize tool to store the input in state with multiple calls
+            - if user provide all the input in one go, do not follow the steps in the order, got to relevant step and ask the user the question. In this case use a single memorize_many call to store all the input in state
               (for example if user says from bengaluru to delhi on 21 may for one adult, do not ask for number of children, infants, return date, etc just take confirmation and call the search_flights_tool)
+            - if user gives more than one city at once (for example both the source and destination city), call resolve_cities once with all of them instead of calling get_cities for each
             - take confirmation from the user before moving to next step
+            - a user message may end with a <prefilled_slots> block, those values were already recognised from the user's words and stored in state.
+              do not call get_cities or memorize for them, a <missing_slots> block lists what is still needed.
+              ask only for the missing values, or if nothing is missing take confirmation and call the search_flights_tool
 
         <source_city_code>
         {source_city_code}
@@ -211,5 +218,7 @@ root_agent = Agent(
         {number_of_infants}
         </number_of_infants>
     """,
-    tools=[get_cities,  search_flights_tool, memorize, get_filters, apply_filters_on_search_results],
+    tools=[get_cities, resolve_cities, search_flights_tool, memorize, memorize_many, get_filters, apply_filters_on_search_results],
+    before_tool_callback=trace_before_tool,
+    after_tool_callback=trace_after_tool,
 )
@@ -1,12 +1,36 @@
+from dataclasses import dataclass
 from datetime import datetime
+from google.adk.events import Event
 from google.adk.sessions import InMemorySessionService, Session
+from google.genai.types import Content, Part
 from typing import List, Optional, Dict, Any, TypedDict
 import asyncio
+import json
+import os
 import pytz
 
 
 IST = pytz.timezone("Asia/Kolkata")
 
+SUMMARY_EVENT_ID = "history-summary"
+
+
+@dataclass
+class HistoryCompactionConfig:
+    recent_turns: int = int(os.getenv("HISTORY_RECENT_TURNS", "6"))
+    max_bytes: int = int(os.getenv("HISTORY_MAX_BYTES", str(256 * 1024)))
+    max_tool_result_bytes: int = int(os.getenv("HISTORY_MAX_TOOL_RESULT_BYTES", "1024"))
+    max_text_chars: int = int(os.getenv("HISTORY_MAX_TEXT_CHARS", "500"))
+
+
+@dataclass
+class HistoryStats:
+    compacted_upto: int = 0
+    bytes: int = 0
+    bytes_saved: int = 0
+    events_compacted: int = 0
+    events_dropped: int = 0
+
 class UserPreferences(TypedDict):
     source_city_code: Optional[str]
     destination_city_code: Optional[str]
@@ -26,6 +50,8 @@ class CustomSession(Session):
             state=state or {}
         )
         self._preference_changed = asyncio.Event()
+        self._search_results_ready = asyncio.Event()
+        self._last_search_id: Optional[str] = None
 
         self._last_preferences: UserPreferences = {
             "source_city_code": None,
@@ -66,6 +92,27 @@ class CustomSession(Session):
         self._preference_changed.clear()
         return self.get_preferences()
 
+    def notify_search_results(self, search_id: str) -> None:
+        """
+        Signal that a new result set is ready to be shown to the user.
+
+        Args:
+            search_id: The id of the cached result set.
+        """
+        self._last_search_id = search_id
+        self._search_results_ready.set()
+
+    async def wait_for_search_results(self) -> str:
+        """
+        Wait for a new search result set.
+
+        Returns:
+            str: The id of the cached result set.
+        """
+        await self._search_results_ready.wait()
+        self._search_results_ready.clear()
+        return self._last_search_id
+
     async def wait_for_end_call(self) -> bool:
         """
         Wait for end call signal.
@@ -95,7 +142,51 @@ class CustomSession(Session):
             self._preference_changed.set()
             self._last_preferences = new_preferences
             
+def _event_size(event: Event) -> int:
+    return len(event.model_dump_json(exclude_none=True))
+
+
+def _summarise_response(name: str, response: Dict[str, Any], max_bytes: int) -> Dict[str, Any]:
+    """
+    Compact summary of a bulky tool result: scalar fields are kept, the rest is named.
+    """
+    summary: Dict[str, Any] = {"compacted": True}
+    omitted = []
+    for key, value in response.items():
+        if isinstance(value, (str, int, float, bool)) or value is None:
+            summary[key] = value[:200] if isinstance(value, str) else value
+        else:
+            omitted.append(key)
+    if omitted:
+        summary["omitted"] = omitted
+    if name in ("search_flights_tool", "apply_filters_on_search_results"):
+        # The full result set stays reachable through session state
+        summary["state_ref"] = "facets_ref"
+    if len(json.dumps(summary, default=str)) > max_bytes:
+        summary = {"compacted": True, "status": response.get("status")}
+    return summary
+
+
+def _turn_starts(events: List[Event]) -> List[int]:
+    """
+    Index of the first event of each turn. A turn starts with a user event or
+    after the model completed its previous turn.
+    """
+    starts = []
+    new_turn = True
+    for index, event in enumerate(events):
+        if event.author == "user" or new_turn:
+            starts.append(index)
+        new_turn = bool(event.turn_complete)
+    return starts
+
+
 class CustomSessionService(InMemorySessionService):
+    def __init__(self, compaction: Optional[HistoryCompactionConfig] = None):
+        super().__init__()
+        self.compaction = compaction or HistoryCompactionConfig()
+        self._history: Dict[str, HistoryStats] = {}
+
     def create_session(
         self, app_name: str, user_id: str, session_id: str, state: Optional[Dict[str, Any]] = None
     ) -> Session:
@@ -117,8 +208,146 @@ class CustomSessionService(InMemorySessionService):
         from flights.memory import _set_initial_states
         session.state["today_datetime"] = datetime.now(IST).strftime("%Y-%m-%d %H:%M:%S")
         _set_initial_states(session.state, session.state)
+        self._history[session_id] = HistoryStats()
         
         return session
 
+    def rebind_session(self, session: Session, session_id: str, user_id: str) -> None:
+        """
+        Give a session created ahead of time, e.g. for a warm live stream, the id and user of the connection it now serves.
+        """
+        self._history[session_id] = self._history.pop(session.id, None) or HistoryStats()
+        session.id = session_id
+        session.user_id = user_id
+
+    def restore_session(
+        self, app_name: str, user_id: str, session_id: str, state: Dict[str, Any], events: List[Dict[str, Any]]
+    ) -> Session:
+        """
+        Recreate a session handed over by another process, with its state and compacted history.
+
+        Args:
+            app_name: The name of the application
+            user_id: The ID of the user
+            session_id: The ID of the session
+            state: The state of the session
+            events: The history as Event JSON, sent to the model as history when the live stream opens
+        """
+        session = CustomSession(
+            app_name=app_name,
+            user_id=user_id,
+            session_id=session_id,
+            state=state
+        )
+        for data in events:
+            try:
+                session.events.append(Event.model_validate(data))
+            except ValueError as e:
+                print(f"[RESTORE] skipped an event of session {session_id}: {e}")
+        session.state["today_datetime"] = datetime.now(IST).strftime("%Y-%m-%d %H:%M:%S")
+        self._history[session_id] = HistoryStats(bytes=sum(_event_size(event) for event in session.events))
+        # Show the collected booking details again
+        session.update_state()
+        return session
+
+    def forget_session(self, session: Session) -> None:
+        """Drop the bookkeeping of a session that was never bound to a connection."""
+        self._history.pop(session.id, None)
+
+    async def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
+        self._history.pop(session_id, None)
+        await super().delete_session(app_name=app_name, user_id=user_id, session_id=session_id)
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        """
+        Append an event, then compact the history of the session.
+        """
+        event = await super().append_event(session=session, event=event)
+        if not event.partial:
+            self._compact(session)
+        return event
+
+    def _compact(self, session: Session) -> None:
+        """
+        Keep the last recent_turns turns verbatim. Older events get their bulky
+        tool results and long texts replaced by compact summaries, and if the
+        history is still over max_bytes the oldest events are folded into a
+        single summary event.
+        """
+        config = self.compaction
+        stats = self._history.setdefault(session.id, HistoryStats())
+        events = session.events
+        starts = _turn_starts(events)
+        window_start = starts[-config.recent_turns] if len(starts) > config.recent_turns else 0
+
+        stats.bytes += _event_size(events[-1])
+        for index in range(stats.compacted_upto, window_start):
+            compacted = self._compact_event(events[index])
+            if compacted is not None:
+                before, after = _event_size(events[index]), _event_size(compacted)
+                events[index] = compacted
+                stats.bytes -= before - after
+                stats.bytes_saved += before - after
+                stats.events_compacted += 1
+        stats.compacted_upto = max(stats.compacted_upto, window_start)
+
+        if stats.bytes <= config.max_bytes:
+            return
+        first = 1 if events and events[0].id == SUMMARY_EVENT_ID else 0
+        drop_until = first
+        while drop_until < window_start and stats.bytes > config.max_bytes:
+            size = _event_size(events[drop_until])
+            stats.bytes -= size
+            stats.bytes_saved += size
+            drop_until += 1
+        if drop_until == first:
+            return
+        dropped = drop_until - first
+        stats.events_dropped += dropped
+        summary = self._summary_event(session, stats.events_dropped)
+        if first:
+            stats.bytes -= _event_size(events[0])
+        del events[:drop_until]
+        events.insert(0, summary)
+        stats.bytes += _event_size(summary)
+        stats.compacted_upto = max(1, stats.compacted_upto - drop_until + 1)
+
+    def _compact_event(self, event: Event) -> Optional[Event]:
+        if event.id == SUMMARY_EVENT_ID or not event.content or not event.content.parts:
+            return None
+        config = self.compaction
+        compacted = event.model_copy(deep=True)
+        changed = False
+        for part in compacted.content.parts:
+            response = part.function_response
+            if response and response.response and len(json.dumps(response.response, default=str)) > config.max_tool_result_bytes:
+                response.response = _summarise_response(response.name, response.response, config.max_tool_result_bytes)
+                changed = True
+            call = part.function_call
+            if call and call.args and len(json.dumps(call.args, default=str)) > config.max_tool_result_bytes:
+                call.args = {"compacted": True}
+                changed = True
+            if part.text and len(part.text) > config.max_text_chars:
+                part.text = part.text[:config.max_text_chars] + "..."
+                changed = True
+        return compacted if changed else None
+
+    def _summary_event(self, session: Session, events_dropped: int) -> Event:
+        """
+        Stand-in for the dropped part of the history, the booking details live in state.
+        """
+        preferences = session.get_preferences() if isinstance(session, CustomSession) else {}
+        slots = ", ".join(f"{key}={value}" for key, value in preferences.items() if value)
+        text = f"[{events_dropped} earlier events omitted] collected so far: {slots or 'nothing'}"
+        return Event(
+            id=SUMMARY_EVENT_ID,
+            author="user",
+            invocation_id=session.events[0].invocation_id if session.events else "",
+            content=Content(role="user", parts=[Part.from_text(text=text)]),
+        )
+
+    def compaction_stats(self) -> Dict[str, Dict[str, int]]:
+        return {session_id: vars(stats) for session_id, stats in self._history.items()}
+
 
     
\ No newline at end of file
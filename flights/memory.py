@@ -18,14 +18,16 @@ from datetime import datetime
 import json
 import os
 import time
-from typing import Dict, Any, Tuple
+from typing import Dict, Any, Optional, Tuple
 
 from google.adk.agents.callback_context import CallbackContext
 from google.adk.sessions.state import State
 from google.adk.tools import ToolContext
+from pydantic import BaseModel
 
 from flights import constants
 from flights.custom_session import CustomSession
+from flights.slot_extractor import apply_slots, normalise_slots, today_from_state
 
 SAMPLE_SCENARIO_PATH = os.getenv(
     "PREFERENCES", "flights/preferences.json"
@@ -53,6 +55,58 @@ def memorize(key: str, value: str, tool_context: ToolContext):
 
     return {"status": f'Stored "{key}": "{value}"'}
 
+class BookingSlots(BaseModel):
+    # Details the model leaves out stay None and are not stored
+    source_city_code: Optional[str] = None
+    destination_city_code: Optional[str] = None
+    departure_date: Optional[str] = None
+    return_date: Optional[str] = None
+    number_of_adults: Optional[int] = None
+    number_of_children: Optional[int] = None
+    number_of_infants: Optional[int] = None
+
+
+# return_date value that clears a stored return date
+ONE_WAY = "one_way"
+
+
+def memorize_many(slots: BookingSlots, tool_context: ToolContext):
+    """
+    Memorize several booking details in one call, use this whenever the user gives more than one detail.
+    Only include the details the user actually gave, leave out the others.
+
+    Args:
+        slots: the booking details to store.
+            - source_city_code, destination_city_code: iata codes, e.g. BLR
+            - departure_date, return_date: dates in ISO format, e.g. 2025-05-21. return_date "one_way" when the user wants no return
+            - number_of_adults, number_of_children, number_of_infants: whole numbers
+        tool_context: The ADK tool context.
+
+    Returns:
+        A status message, with the errors by detail if nothing was stored.
+    """
+    if isinstance(slots, BaseModel):
+        slots = slots.model_dump(exclude_unset=True)
+    # Dict-form calls may carry null or empty values for details not given, and 0 adults, those are skipped
+    slots = {key: value for key, value in (slots or {}).items() if not _not_provided(key, value)}
+    if str(slots.get("return_date", "")).strip().lower() == ONE_WAY:
+        slots["return_date"] = ""
+
+    state = tool_context.state
+    normalised, errors = normalise_slots(slots, today_from_state(state))
+    if errors:
+        # Nothing is stored unless every detail is valid
+        return {"status": "error", "errors": errors}
+
+    session = tool_context._invocation_context.session
+    apply_slots(session, state, normalised)
+    return {"status": "success", "stored": normalised}
+
+
+def _not_provided(key: str, value: Any) -> bool:
+    text = "" if value is None else str(value).strip()
+    return not text or (key == "number_of_adults" and text == "0")
+
 def get_state(key: str, tool_context: ToolContext):
     return tool_context.state[key]
 
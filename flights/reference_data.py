@@ -0,0 +1,139 @@
+"""Process-wide store of interned reference data shared by all sessions."""
+
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+REFERENCE_DATA_MAX_BYTES = int(os.getenv("REFERENCE_DATA_MAX_BYTES", str(32 * 1024 * 1024)))
+REFERENCE_SNAPSHOT = os.getenv("REFERENCE_SNAPSHOT", "")
+
+
+@dataclass
+class _Entry:
+    value: Dict[str, Any]
+    size: int
+    refcount: int = 0
+
+
+class ReferenceDataStore:
+    """
+    Content-hashed, refcounted store of reference maps such as airline_info,
+    airport_info and facets.
+
+    Identical maps returned to different sessions are stored once, sessions
+    keep only the hash in their state. Unreferenced maps are evicted least
+    recently used first once the store is over max_bytes.
+    """
+
+    def __init__(self, max_bytes: int = REFERENCE_DATA_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._session_refs: Dict[str, Dict[str, str]] = {}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def intern(self, value: Dict[str, Any]) -> str:
+        """
+        Store a map, or find the identical map already stored, and take a reference to it.
+
+        Returns:
+            str: The content hash referencing the map.
+        """
+        canonical = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+        ref = hashlib.sha1(canonical.encode()).hexdigest()
+        entry = self._entries.get(ref)
+        if entry is None:
+            self.misses += 1
+            entry = _Entry(value=value, size=len(canonical))
+            self._entries[ref] = entry
+            self._bytes += entry.size
+        else:
+            self.hits += 1
+            self._entries.move_to_end(ref)
+        entry.refcount += 1
+        self._evict()
+        return ref
+
+    def get(self, ref: Optional[str]) -> Dict[str, Any]:
+        """The map referenced by ref, shared and not copied. Do not modify it."""
+        entry = self._entries.get(ref) if ref else None
+        return entry.value if entry else {}
+
+    def release(self, ref: Optional[str]) -> None:
+        entry = self._entries.get(ref) if ref else None
+        if entry and entry.refcount > 0:
+            entry.refcount -= 1
+            self._evict()
+
+    def assign(self, session_id: str, key: str, value: Dict[str, Any]) -> str:
+        """
+        Point a session's key at the interned value, releasing what it pointed to before.
+
+        Args:
+            session_id: The session holding the reference.
+            key: The name of the map in the session, e.g. "facets".
+            value: The map.
+
+        Returns:
+            str: The content hash referencing the map.
+        """
+        ref = self.intern(value)
+        refs = self._session_refs.setdefault(session_id, {})
+        self.release(refs.get(key))
+        refs[key] = ref
+        return ref
+
+    def lookup(self, session_id: str, key: str) -> Dict[str, Any]:
+        return self.get(self._session_refs.get(session_id, {}).get(key))
+
+    def release_session(self, session_id: str) -> None:
+        for ref in self._session_refs.pop(session_id, {}).values():
+            self.release(ref)
+
+    def _evict(self) -> None:
+        if self._bytes <= self.max_bytes:
+            return
+        for ref in [ref for ref, entry in self._entries.items() if entry.refcount == 0]:
+            if self._bytes <= self.max_bytes:
+                break
+            self._bytes -= self._entries.pop(ref).size
+
+    def load_snapshot(self, path: str) -> int:
+        """
+        Preload maps from a snapshot written by save_snapshot.
+
+        Returns:
+            int: The number of maps loaded.
+        """
+        with open(path, "r") as file:
+            maps = json.load(file)
+        for value in maps:
+            self.release(self.intern(value))
+        logger.info(f"Loaded {len(maps)} reference maps from {path}")
+        return len(maps)
+
+    def save_snapshot(self, path: str) -> None:
+        with open(path, "w") as file:
+            json.dump([entry.value for entry in self._entries.values()], file)
+
+    def stats(self) -> Dict[str, Any]:
+        refs = sum(entry.refcount for entry in self._entries.values())
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "references": refs,
+            "sessions": len(self._session_refs),
+            "bytes_saved": sum(entry.size * (entry.refcount - 1) for entry in self._entries.values() if entry.refcount > 1),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+reference_data = ReferenceDataStore()
@@ -0,0 +1,302 @@
+"""Background pre-warming of popular flight searches."""
+
+import asyncio
+import logging
+import math
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from flights.custom_session import IST
+from flights.search_parser import SearchSummary
+from rate_limits import TokenBucket
+from upstream_limits import UpstreamLimiter
+
+logger = logging.getLogger(__name__)
+
+
+def _windows(spec: str) -> List[Tuple[int, int]]:
+    """Parse "HH:MM-HH:MM,..." into (start, end) minutes of the day, a window may wrap past midnight."""
+    windows = []
+    for window in filter(None, (part.strip() for part in spec.split(","))):
+        start, end = (datetime.strptime(value.strip(), "%H:%M") for value in window.split("-"))
+        windows.append((start.hour * 60 + start.minute, end.hour * 60 + end.minute))
+    return windows
+
+
+@dataclass
+class RoutePrewarmConfig:
+    enabled: bool = os.getenv("ROUTE_PREWARM_ENABLED", "true").lower() == "true"
+    # Number of popular routes kept warm
+    top_routes: int = int(os.getenv("ROUTE_PREWARM_TOP_ROUTES", "20"))
+    # Searches a route needs, decayed, before it is kept warm
+    min_score: float = float(os.getenv("ROUTE_PREWARM_MIN_SCORE", "3"))
+    # Only searches departing within this many days are learnt
+    max_days_ahead: int = int(os.getenv("ROUTE_PREWARM_MAX_DAYS_AHEAD", "7"))
+    # Time constant of the route popularity average
+    popularity_window: float = float(os.getenv("ROUTE_PREWARM_POPULARITY_WINDOW", str(6 * 3600)))
+    # Pre-warmed results are served for this long, fares move
+    ttl: float = float(os.getenv("ROUTE_PREWARM_TTL", "600"))
+    # Results are refreshed this long before they expire
+    refresh_ahead: float = float(os.getenv("ROUTE_PREWARM_REFRESH_AHEAD", "120"))
+    # Upstream searches per hour the pre-warmer may make
+    budget: float = float(os.getenv("ROUTE_PREWARM_BUDGET", "120"))
+    burst: float = float(os.getenv("ROUTE_PREWARM_BURST", "10"))
+    # Refreshes only run in these local times, e.g. "00:00-07:00,14:00-17:00", empty is any time
+    off_peak: List[Tuple[int, int]] = field(default_factory=lambda: _windows(os.getenv("ROUTE_PREWARM_OFF_PEAK", "")))
+    # Refreshes are skipped while the search upstream has more than this share of its concurrency in use
+    max_busy: float = float(os.getenv("ROUTE_PREWARM_MAX_BUSY", "0.5"))
+    interval: float = float(os.getenv("ROUTE_PREWARM_INTERVAL", "30"))
+    max_tracked: int = 1000
+
+
+class Route(NamedTuple):
+    """A search with its dates relative to the day it is made."""
+    origin: str
+    destination: str
+    departure_offset: int
+    return_offset: Optional[int]
+    adults: int
+    children: int
+    infants: int
+
+    def search(self, today: date) -> "Search":
+        return Search(
+            self.origin,
+            self.destination,
+            (today + timedelta(days=self.departure_offset)).isoformat(),
+            (today + timedelta(days=self.return_offset)).isoformat() if self.return_offset is not None else None,
+            self.adults,
+            self.children,
+            self.infants,
+        )
+
+
+class Search(NamedTuple):
+    """The slots of a search, what a pre-warmed result answers."""
+    origin: str
+    destination: str
+    departure_date: str
+    return_date: Optional[str]
+    adults: int
+    children: int
+    infants: int
+
+    def route(self, today: date) -> Optional[Route]:
+        try:
+            departure = date.fromisoformat(self.departure_date)
+            returning = date.fromisoformat(self.return_date) if self.return_date else None
+        except ValueError:
+            return None
+        return Route(
+            self.origin,
+            self.destination,
+            (departure - today).days,
+            (returning - today).days if returning else None,
+            self.adults,
+            self.children,
+            self.infants,
+        )
+
+
+@dataclass
+class _Warm:
+    summary: SearchSummary
+    fetched_at: float = field(default_factory=time.monotonic)
+
+
+class RoutePrewarmer:
+    """
+    Keeps the results of the most searched routes fresh.
+
+    Every search teaches the pre-warmer its route, origin, destination,
+    departure and return as days from today and passengers, with an
+    exponentially decayed count. In the background the top routes are
+    searched again before their results expire, within an hourly upstream
+    budget, inside the off-peak windows and only while the upstream is not
+    busy with callers. Searches for a warm route are answered from here.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[Search], Awaitable[SearchSummary]],
+        limiter: UpstreamLimiter,
+        config: Optional[RoutePrewarmConfig] = None,
+    ):
+        self.fetch = fetch
+        self.limiter = limiter
+        self.config = config or RoutePrewarmConfig()
+        self._scores: Dict[Route, Tuple[float, float]] = {}
+        self._warm: Dict[Search, _Warm] = {}
+        self._refreshing: set = set()
+        self._budget = TokenBucket(self.config.budget / 3600, self.config.burst)
+        self._task: Optional[asyncio.Task] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.skipped_budget = 0
+        self.skipped_peak = 0
+        self.skipped_busy = 0
+
+    @staticmethod
+    def today() -> date:
+        return datetime.now(IST).date()
+
+    def _score(self, route: Route, now: float) -> float:
+        score, updated = self._scores.get(route, (0.0, now))
+        return score * math.exp(-(now - updated) / self.config.popularity_window)
+
+    def observe(self, search: Search) -> None:
+        """Count a search towards its route's popularity."""
+        if not self.config.enabled:
+            return
+        route = search.route(self.today())
+        if route is None or not 0 <= route.departure_offset <= self.config.max_days_ahead:
+            return
+        now = time.monotonic()
+        self._scores[route] = (self._score(route, now) + 1, now)
+        if len(self._scores) > self.config.max_tracked:
+            least = min(self._scores, key=lambda other: self._score(other, now))
+            del self._scores[least]
+
+    def popular(self) -> List[Tuple[Route, float]]:
+        """The routes kept warm and their scores, most popular first."""
+        now = time.monotonic()
+        scored = [(route, self._score(route, now)) for route in self._scores]
+        scored = [(route, score) for route, score in scored if score >= self.config.min_score]
+        return sorted(scored, key=lambda item: item[1], reverse=True)[:self.config.top_routes]
+
+    def lookup(self, search: Search) -> Optional[SearchSummary]:
+        """
+        The pre-warmed result of a search, if there is a fresh one.
+
+        Args:
+            search: The slots of the search.
+
+        Returns:
+            The result, shared with other callers and not to be modified, or None.
+        """
+        warm = self._warm.get(search)
+        if warm is not None and time.monotonic() - warm.fetched_at <= self.config.ttl:
+            self.hits += 1
+            return warm.summary
+        self.misses += 1
+        return None
+
+    def store(self, search: Search, summary: SearchSummary) -> None:
+        """Keep a successful result of a popular route, e.g. of a caller's own search."""
+        route = search.route(self.today())
+        if not summary.success or route is None:
+            return
+        if route in dict(self.popular()):
+            self.preload(search, summary)
+
+    def preload(self, search: Search, summary: SearchSummary) -> None:
+        """Serve a result for a search regardless of popularity, e.g. when replaying a trace."""
+        self._warm[search] = _Warm(summary)
+
+    def start(self) -> None:
+        if self.config.enabled and self._task is None:
+            self._task = asyncio.create_task(self._maintain())
+
+    def _off_peak(self) -> bool:
+        if not self.config.off_peak:
+            return True
+        now = datetime.now(IST)
+        minute = now.hour * 60 + now.minute
+        return any(start <= minute < end if start <= end else minute >= start or minute < end for start, end in self.config.off_peak)
+
+    def _busy(self) -> bool:
+        return self.limiter.stats()["in_flight"] >= self.limiter.config.max_concurrency * self.config.max_busy
+
+    async def _refresh(self, search: Search) -> None:
+        self._refreshing.add(search)
+        try:
+            summary = await self.fetch(search)
+        except Exception as e:
+            self.refresh_failures += 1
+            logger.warning(f"Pre-warming {search.origin}-{search.destination} {search.departure_date} failed: {e}")
+            return
+        finally:
+            self._refreshing.discard(search)
+        self.refreshes += 1
+        if summary.success:
+            self.preload(search, summary)
+
+    async def refresh_due(self) -> None:
+        """Refresh the popular routes whose results are missing or about to expire."""
+        today = self.today()
+        wanted = {route.search(today) for route, _ in self.popular()}
+        # Results of routes that fell out of the top ones, or of past days, are dropped
+        for search in [search for search in self._warm if search not in wanted]:
+            del self._warm[search]
+
+        now = time.monotonic()
+        due = [
+            search for search in (route.search(today) for route, _ in self.popular())
+            if search not in self._refreshing
+            and (search not in self._warm or now - self._warm[search].fetched_at > self.config.ttl - self.config.refresh_ahead)
+        ]
+        if not due:
+            return
+        if not self._off_peak():
+            self.skipped_peak += len(due)
+            return
+        for search in due:
+            if self._busy():
+                self.skipped_busy += 1
+                continue
+            self._budget.refill(time.monotonic())
+            if self._budget.wait_time(1) > 0:
+                self.skipped_budget += 1
+                continue
+            self._budget.tokens -= 1
+            await self._refresh(search)
+
+    async def _maintain(self) -> None:
+        while True:
+            try:
+                await self.refresh_due()
+            except Exception as e:
+                logger.error(f"Route pre-warming failed: {e}")
+            await asyncio.sleep(self.config.interval)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._warm.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        today = self.today()
+        routes = []
+        for route, score in self.popular():
+            warm = self._warm.get(route.search(today))
+            routes.append({
+                "route": f"{route.origin}-{route.destination}",
+                "departure_offset": route.departure_offset,
+                "return_offset": route.return_offset,
+                "passengers": [route.adults, route.children, route.infants],
+                "score": round(score, 2),
+                "age_seconds": round(now - warm.fetched_at, 1) if warm else None,
+            })
+        return {
+            "enabled": self.config.enabled,
+            "tracked_routes": len(self._scores),
+            "warm": len(self._warm),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / (self.hits + self.misses), 3) if self.hits + self.misses else 0.0,
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+            "skipped_budget": self.skipped_budget,
+            "skipped_peak": self.skipped_peak,
+            "skipped_busy": self.skipped_busy,
+            "budget_tokens": round(self._budget.tokens, 2),
+            "routes": routes,
+        }
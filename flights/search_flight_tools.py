@@ -1,54 +1,272 @@
 import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
 from dotenv import load_dotenv
-import requests
+import httpx
 from google.adk.tools import ToolContext
+
+from flights.custom_session import CustomSession
+from flights.reference_data import reference_data
+from flights.route_prewarm import RoutePrewarmer, Search
+from flights.search_parser import SearchSummary, parse_search_stream
+from flights.search_results import RESULTS_FETCH_LIMIT, search_results
+from hedging import Hedger, get_hedger
+from rate_limits import RateLimited, get_rate_limiter, session_keys
+from session_trace import record
+from upstream_limits import UpstreamLimiter, UpstreamUnavailable, get_limiter, turn_deadline
 load_dotenv() 
 
 typesense_key = os.getenv("TYPESENSE_KEY")
 
-def get_cities(city: str): 
+typesense_limiter = get_limiter("typesense", max_concurrency=16, timeout=5.0)
+TYPESENSE_URL = "https://search.zoozle.dev/multi_search/"
+SEARCH_URL = f"https://zoozle.dev/api/v5/booking/flight/search/?page=1&limit={RESULTS_FETCH_LIMIT}"
+
+zoozle_limiter = get_limiter(
+    "zoozle",
+    max_concurrency=8,
+    timeout=60.0,
+    fallback_message="Flight search is temporarily unavailable, please try again in a few minutes.",
+)
+
+# Upstream searches per user and IP, a burst of searches then one every 20 seconds
+search_rate_limiter = get_rate_limiter("searches", rate=0.05, burst=6)
+
+cities_hedger = get_hedger("typesense_cities", min_delay=0.2, max_delay=2.0)
+search_hedger = get_hedger("zoozle_search", min_delay=3.0, max_delay=30.0)
+
+
+def _session_id(tool_context: Optional[ToolContext]) -> Optional[str]:
+    return tool_context._invocation_context.session.id if tool_context else None
+
+
+# One connection pool for every upstream request of the process
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def _get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(limits=httpx.Limits(max_connections=100, max_keepalive_connections=20))
+    return _http_client
+
+
+async def close_http_client() -> None:
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+async def _http_post(
+    url: str,
+    payload: Dict[str, Any],
+    headers: Dict[str, str],
+    timeout: float,
+    parse: Optional[Callable[[Any], Awaitable[Any]]] = None,
+) -> Union[Dict[str, Any], Any]:
+    """
+    The HTTP request itself, replay_trace.py swaps this for recorded responses.
+    With parse the response body is streamed into it rather than loaded whole.
+    Cancelling the awaiting task aborts the request.
+    """
+    client = _get_http_client()
+    if parse is None:
+        response = await client.post(url, json=payload, headers=headers, timeout=timeout)
+        return response.json()
+    async with client.stream("POST", url, json=payload, headers=headers, timeout=timeout) as response:
+        return await parse(response.aiter_bytes())
+
+
+async def _post_json(limiter: UpstreamLimiter, url: str, payload: Dict[str, Any], headers: Dict[str, str], tool_context: Optional[ToolContext] = None, hedger: Optional[Hedger] = None, parse=None):
+    """
+    POST to an upstream under its limiter, bounded by the current turn's deadline.
+    With a hedger, slow calls are raced against a duplicate request.
+    With parse, e.g. parse_search_stream, the body is parsed as it downloads.
+    """
+    session_id = _session_id(tool_context)
+
+    async def post():
+        started = time.monotonic()
+        try:
+            data = await _http_post(url, payload, headers, limiter.config.timeout, parse=parse)
+        except Exception as e:
+            record(session_id, "upstream", upstream=limiter.name, url=url, payload=payload, latency=round(time.monotonic() - started, 4), error=repr(e))
+            raise
+        response = data.to_response() if isinstance(data, SearchSummary) else data
+        record(session_id, "upstream", upstream=limiter.name, url=url, payload=payload, latency=round(time.monotonic() - started, 4), response=response)
+        return data
+
+    def attempt():
+        return limiter.call(post, session_key=session_id, deadline=turn_deadline(session_id))
+
+    if hedger is None:
+        return await attempt()
+    return await hedger.run(attempt)
+
+
+def _search_result(summary: SearchSummary, tool_context: ToolContext):
+    """
+    Cache the result set of a search, push it to the user's screen and summarise it for the agent.
+    """
+    if not summary.success:
+        return {
+            "status": "error",
+            "message": summary.message if summary.message is not None else "Something went wrong Please try again later"
+        }
+
+    session = tool_context._invocation_context.session
+    cached = search_results.put(session.id, summary)
+    tool_context.state["last_search_id"] = cached.search_id
+    if isinstance(session, CustomSession):
+        session.notify_search_results(cached.search_id)
+
+    return {
+        "status": "success",
+        "no_of_flights": summary.count if summary.count is not None else 0,
+        "lowest_price_trip": summary.lowest_price_trip,
+        "options_on_screen": len(cached.cards),
+    }
+
+
+def _rate_limited(tool_context: ToolContext) -> Optional[Dict[str, Any]]:
+    """
+    Take a search from the user's search rate limit, the error response if it is used up.
+    """
+    try:
+        search_rate_limiter.check(session_keys(_session_id(tool_context)))
+    except RateLimited as e:
+        print(f"[RATE LIMITED] {e}")
+        return {
+            "status": "error",
+            "message": f"Too many searches in a short time, please wait {int(e.retry_after) + 1} seconds before searching again."
+        }
+    return None
+
+
+def _unavailable(error: Exception, limiter: UpstreamLimiter):
+    """
+    Error response the agent can speak when an upstream call fails.
+    """
+    message = error.message if isinstance(error, UpstreamUnavailable) else limiter.config.fallback_message
+    print(f"[UPSTREAM ERROR] {limiter.name}: {error}")
+    return {
+        "status": "error",
+        "message": message
+    }
+
+
+def _city_search(city: str) -> Dict[str, Any]:
+    """
+    One airport lookup of a Typesense multi_search request.
+    """
+    return {
+        "query_by": "search_terms",
+        "num_typos": 1,
+        "collection": "airports",
+        "q": city,
+        "page": 1,
+        "per_page": 3,
+    }
+
+
+async def _search_cities(cities: List[str], tool_context: Optional[ToolContext]) -> Dict[str, Any]:
+    """
+    Look up any number of cities in a single multi_search round trip.
+    """
+    return await _post_json(
+        typesense_limiter,
+        TYPESENSE_URL,
+        {"searches": [_city_search(city) for city in cities]},
+        headers={
+            "x-typesense-api-key":  typesense_key,
+            "Content-Type": "application/json"
+        },
+        tool_context=tool_context,
+        hedger=cities_hedger,
+    )
+
+
+async def get_cities(city: str, tool_context: ToolContext = None): 
     """
     This tool is used to get the cities from the typesense database.
     Args:
         city: The city to search for.
+        tool_context: Automatically provided by ADK. do not specify when calling.
     Returns:
         A list of cities.
     """
 
-    response = requests.post("https://search.zoozle.dev/multi_search/", json= {
-    "searches": [
-          {
-            "query_by": "search_terms",
-            "num_typos": 1,
-            "collection": "airports",
-            "q": city,
-            "page": 1,
-            "per_page": 3,
-        }
-            ]
-        },  headers={
-        "x-typesense-api-key":  typesense_key,
-        "Content-Type": "application/json"
-    })
+    try:
+        data = await _search_cities([city], tool_context)
+    except (UpstreamUnavailable, httpx.HTTPError, ValueError) as e:
+        return _unavailable(e, typesense_limiter)
 
-    data = response.json()
     return data
 
+
+async def resolve_cities(cities: list[str], tool_context: ToolContext = None):
+    """
+    This tool is used to get several cities from the typesense database in one request,
+    e.g. the source and destination cities when the user gives both at once.
+    Args:
+        cities: The cities to search for.
+        tool_context: Automatically provided by ADK. do not specify when calling.
+    Returns:
+        Dict[str, Any]:
+            -status: A status message.
+            -cities: The matching airports of each city, keyed by the city as given.
+    """
+
+    cities = [city for city in dict.fromkeys(cities or []) if city]
+    if not cities:
+        return {
+            "status": "error",
+            "message": "Please provide at least one city"
+        }
+
+    try:
+        data = await _search_cities(cities, tool_context)
+    except (UpstreamUnavailable, httpx.HTTPError, ValueError) as e:
+        return _unavailable(e, typesense_limiter)
+
+    results = data.get("results", []) if isinstance(data, dict) else []
+    return {
+        "status": "success",
+        "cities": {city: result for city, result in zip(cities, results)},
+    }
+
+def _search_slots(tool_context: ToolContext) -> Search:
+    """
+    The slots of the search from the session state.
+    """
+    state = tool_context.state
+    return Search(
+        origin=state.get("source_city_code"),
+        destination=state.get("destination_city_code"),
+        departure_date=state.get("departure_date"),
+        return_date=state.get("return_date") or None,
+        adults=int(state.get("number_of_adults")),
+        children=int(state.get("number_of_children") or 0),
+        infants=int(state.get("number_of_infants") or 0),
+    )
+
+
 def _build_payload(tool_context: ToolContext):
     """
     Build the payload for the search flights tool.
     """
+    search = _search_slots(tool_context)
+    print(*search, "--------------------------------------------------")
+    return _search_payload(search)
 
-    origin = tool_context.state.get("source_city_code")
-    destination = tool_context.state.get("destination_city_code")
-    departure_date = tool_context.state.get("departure_date")
-    return_date = tool_context.state.get("return_date")
-    return_date = return_date if return_date else None
-    adults = int(tool_context.state.get("number_of_adults"))
-    children = int(tool_context.state.get("number_of_children") or 0)
-    infants = int(tool_context.state.get("number_of_infants") or 0)
 
-    print(origin, destination, departure_date, return_date, adults, children, infants, "--------------------------------------------------")
+def _search_payload(search: Search):
+    """
+    Build the search request payload of a search.
+    """
+
+    origin, destination, departure_date, return_date, adults, children, infants = search
 
     # Construct the search request payload
     payload = {
@@ -113,7 +331,25 @@ def _build_payload(tool_context: ToolContext):
     return payload
 
 
-def search_flights_tool(tool_context: ToolContext = None):
+async def _prewarm_search(search: Search) -> SearchSummary:
+    """
+    Search a popular route in the background, without hedging, it would double the upstream cost.
+    """
+    return await _post_json(
+        zoozle_limiter,
+        SEARCH_URL,
+        _search_payload(search),
+        headers={
+            'Content-Type': 'application/json',
+        },
+        parse=parse_search_stream,
+    )
+
+
+route_prewarmer = RoutePrewarmer(_prewarm_search, zoozle_limiter)
+
+
+async def search_flights_tool(tool_context: ToolContext = None):
     """
     Search for flights between the given origin and destination on the given departure and return dates. this will take upto 1minute to complete.
 
@@ -126,6 +362,7 @@ def search_flights_tool(tool_context: ToolContext = None):
             -no_of_flights: The number of flights found.
             -lowest_price_trip: The lowest price trip. 
                 -here for price you have to check AirItineraryPricingInfo.ItinTotalFare.TotalPriceAfterDiscount.Amount (in INR)
+            -options_on_screen: The number of options shown to the user on screen, they can scroll through them.
 
     """
 
@@ -135,38 +372,48 @@ def search_flights_tool(tool_context: ToolContext = None):
             "message": "Please provide atleast the source city code, destination city code, departure date and number of adults"
         }
 
-    payload = _build_payload(tool_context)
-
-    # Make the API request
-    response = requests.post(
-        'https://zoozle.dev/api/v5/booking/flight/search/?page=1&limit=1',
-        headers={
-            'Content-Type': 'application/json',
-        },
-        json=payload
-    )
-
-    response_json = response.json()
-
-    print(response_json, "=========================================================")
+    search = _search_slots(tool_context)
+    route_prewarmer.observe(search)
+    summary = route_prewarmer.lookup(search)
+    if summary is not None:
+        # Popular routes are searched ahead of time, no upstream request and no rate limit
+        print(f"[PREWARMED SEARCH] {search.origin}-{search.destination} {search.departure_date}")
+        record(_session_id(tool_context), "prewarm", search=list(search), response=summary.to_response())
+    else:
+        limited = _rate_limited(tool_context)
+        if limited:
+            return limited
+
+        payload = _build_payload(tool_context)
+
+        # Make the API request
+        try:
+            summary = await _post_json(
+                zoozle_limiter,
+                SEARCH_URL,
+                payload,
+                headers={
+                    'Content-Type': 'application/json',
+                },
+                tool_context=tool_context,
+                hedger=search_hedger,
+                parse=parse_search_stream,
+            )
+        except (UpstreamUnavailable, httpx.HTTPError, ValueError) as e:
+            return _unavailable(e, zoozle_limiter)
+        route_prewarmer.store(search, summary)
+
+    print(f"[SEARCH] success={summary.success} count={summary.count} itineraries={len(summary.itineraries)}")
 
     state = tool_context.state
-    
-    state["facets"] = response_json.get("facets", {})
-    state["airline_code_map"] = response_json.get("airline_info", {})
-    state["airport_code_map"] = response_json.get("airport_info", {})
+    session_id = _session_id(tool_context)
 
-    if response_json.get("Success") == True:
-        return {
-            "status": "success",
-            "no_of_flights": response_json.get("count", 0),
-            "lowest_price_trip": response_json.get("Data", {}).get("PricedItineraries", [])[0]
-        }
-    else:
-        return {
-            "status": "error",
-            "message": response_json.get("message", "Something went wrong Please try again later")
-        }
+    # The maps are near-identical across sessions, state only keeps a reference
+    state["facets_ref"] = reference_data.assign(session_id, "facets", summary.facets)
+    state["airline_code_map_ref"] = reference_data.assign(session_id, "airline_code_map", summary.airline_info)
+    state["airport_code_map_ref"] = reference_data.assign(session_id, "airport_code_map", summary.airport_info)
+
+    return _search_result(summary, tool_context)
     
 def get_filters(tool_context: ToolContext):
     """
@@ -185,15 +432,15 @@ def get_filters(tool_context: ToolContext):
     state = tool_context.state
 
     data = {
-        "facets": state.get("facets", {}),
-        "airline_code_map": state.get("airline_code_map", {}),
-        "airport_code_map": state.get("airport_code_map", {})
+        "facets": reference_data.get(state.get("facets_ref")),
+        "airline_code_map": reference_data.get(state.get("airline_code_map_ref")),
+        "airport_code_map": reference_data.get(state.get("airport_code_map_ref"))
     }
 
     return data
     
 
-def apply_filters_on_search_results(filters: dict, tool_context: ToolContext):
+async def apply_filters_on_search_results(filters: dict, tool_context: ToolContext):
     """
     Apply filters on the search results.
     Args:
@@ -212,33 +459,32 @@ def apply_filters_on_search_results(filters: dict, tool_context: ToolContext):
 
     print(filters, "\n\n\n--------------------------------------------------\n\n\n")
 
-    url = f'https://zoozle.dev/api/v5/booking/flight/search/?page=1&limit=1'
+    url = SEARCH_URL
 
     for key, value in filters.items():
         url+=f'&{key}={",".join(value)}' if isinstance(value, list) else f'&{key}={value}'
 
     print(url, "--------------------------------------------------")
     
-    payload = _build_payload(tool_context)
-
-    response = requests.post(
-        url,
-        headers={
-            'Content-Type': 'application/json',
-        },
-        json=payload
-    )
+    limited = _rate_limited(tool_context)
+    if limited:
+        return limited
 
-    response_json = response.json()
+    payload = _build_payload(tool_context)
 
-    if response_json.get("Success") == True:
-        return {
-            "status": "success",
-            "no_of_flights": response_json.get("count", 0),
-            "lowest_price_trip": response_json.get("Data", {}).get("PricedItineraries", [])[0]
-        }
-    else:
-        return {
-            "status": "error",
-            "message": response_json.get("message", "Something went wrong Please try again later")
-        }
+    try:
+        summary = await _post_json(
+            zoozle_limiter,
+            url,
+            payload,
+            headers={
+                'Content-Type': 'application/json',
+            },
+            tool_context=tool_context,
+            hedger=search_hedger,
+            parse=parse_search_stream,
+        )
+    except (UpstreamUnavailable, httpx.HTTPError, ValueError) as e:
+        return _unavailable(e, zoozle_limiter)
+
+    return _search_result(summary, tool_context)
@@ -0,0 +1,352 @@
+"""Selective, incremental parsing of Zoozle flight search responses."""
+
+import asyncio
+import functools
+import json
+import re
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import ijson
+except ImportError:  # ijson is optional, without it responses are loaded whole
+    ijson = None
+
+ITINERARY_PREFIX = "Data.PricedItineraries.item"
+TOP_LEVEL_KEYS = ("Success", "count", "message", "facets", "airline_info", "airport_info")
+MAP_KEYS = ("facets", "airline_info", "airport_info")
+# ijson turns a whole buffer into events at once, a small buffer keeps the peak low
+PARSE_BUFFER = 16384
+
+# Paths within an itinerary that itinerary_record reads, everything else is skipped while parsing
+_SEGMENT_FIELDS = r"(MarketingAirlineCode|FlightNumber|DepartureAirportLocationCode|ArrivalAirportLocationCode|DepartureDateTime|ArrivalDateTime|OperatingAirline(\.Code)?)"
+_ITINERARY_FIELDS = re.compile(
+    r"AirItineraryPricingInfo(\.ItinTotalFare(\.(TotalPriceAfterDiscount|TotalFare)(\..*)?)?)?"
+    r"|AirItinerary"
+    r"|(AirItinerary\.)?OriginDestinationOptions(\.item(\.(FlightSegments(\.item)?|FlightSegment)(\." + _SEGMENT_FIELDS + r")?)?)?"
+)
+
+
+def _first(value: Any) -> Dict[str, Any]:
+    if isinstance(value, list):
+        return value[0] if value and isinstance(value[0], dict) else {}
+    return value if isinstance(value, dict) else {}
+
+
+def _segments(itinerary: Dict[str, Any]) -> List[List[Dict[str, Any]]]:
+    """Flight segments of each leg of a priced itinerary."""
+    options = itinerary.get("OriginDestinationOptions") or itinerary.get("AirItinerary", {}).get("OriginDestinationOptions") or []
+    legs = []
+    for option in options:
+        segments = option.get("FlightSegments") or option.get("FlightSegment") or []
+        if isinstance(segments, dict):
+            segments = [segments]
+        legs.append(segments)
+    return legs
+
+
+@dataclass
+class LegRecord:
+    airline: Optional[str]
+    # Marketing airline code and flight number of each segment
+    segments: List[Tuple[Any, Any]]
+    origin: Optional[str]
+    destination: Optional[str]
+    departure: Optional[str]
+    arrival: Optional[str]
+
+    @property
+    def flight_numbers(self) -> List[str]:
+        return [f"{code}{number}" for code, number in self.segments]
+
+    def card(self, airline_map: Dict[str, Any]) -> Dict[str, Any]:
+        info = airline_map.get(self.airline)
+        return {
+            "airline": info.get("name", self.airline) if isinstance(info, dict) else (info or self.airline),
+            "flight_numbers": self.flight_numbers,
+            "from": self.origin,
+            "to": self.destination,
+            "departure": self.departure,
+            "arrival": self.arrival,
+            "stops": len(self.segments) - 1,
+        }
+
+    def to_option(self) -> Dict[str, Any]:
+        """The leg in the response's own shape, with only the fields it was read from."""
+        segments = [{"MarketingAirlineCode": code, "FlightNumber": number} for code, number in self.segments]
+        first, last = segments[0], segments[-1]
+        if not first["MarketingAirlineCode"] and self.airline:
+            first["OperatingAirline"] = {"Code": self.airline}
+        first.update(DepartureAirportLocationCode=self.origin, DepartureDateTime=self.departure)
+        last.update(ArrivalAirportLocationCode=self.destination, ArrivalDateTime=self.arrival)
+        return {"FlightSegments": segments}
+
+
+@dataclass
+class ItineraryRecord:
+    index: int
+    price: Any
+    currency: str
+    legs: List[LegRecord]
+
+    def card(self, airline_map: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Compact card of the itinerary for the UI.
+
+        Args:
+            airline_map: airline_info of the search response.
+        """
+        return {
+            "index": self.index,
+            "price": self.price,
+            "currency": self.currency,
+            "legs": [leg.card(airline_map) for leg in self.legs],
+        }
+
+    def to_itinerary(self) -> Dict[str, Any]:
+        return {
+            "AirItineraryPricingInfo": {"ItinTotalFare": {"TotalPriceAfterDiscount": {"Amount": self.price, "CurrencyCode": self.currency}}},
+            "OriginDestinationOptions": [leg.to_option() for leg in self.legs],
+        }
+
+
+def itinerary_record(index: int, itinerary: Dict[str, Any]) -> ItineraryRecord:
+    """
+    The fields of a priced itinerary the app uses.
+
+    Args:
+        index: Position of the itinerary in the result set.
+        itinerary: A PricedItineraries entry of the Zoozle search response.
+    """
+    fare = itinerary.get("AirItineraryPricingInfo", {}).get("ItinTotalFare", {})
+    price = _first(fare.get("TotalPriceAfterDiscount") or fare.get("TotalFare"))
+    legs = []
+    for segments in _segments(itinerary):
+        if not segments:
+            continue
+        first, last = segments[0], segments[-1]
+        legs.append(LegRecord(
+            airline=first.get("MarketingAirlineCode") or first.get("OperatingAirline", {}).get("Code"),
+            segments=[(segment.get("MarketingAirlineCode", ""), segment.get("FlightNumber", "")) for segment in segments],
+            origin=first.get("DepartureAirportLocationCode"),
+            destination=last.get("ArrivalAirportLocationCode"),
+            departure=first.get("DepartureDateTime"),
+            arrival=last.get("ArrivalDateTime"),
+        ))
+    return ItineraryRecord(index=index, price=price.get("Amount"), currency=price.get("CurrencyCode", "INR"), legs=legs)
+
+
+@dataclass
+class SearchSummary:
+    """What the search tools use of a search response."""
+    success: bool = False
+    message: Optional[str] = None
+    count: Optional[int] = None
+    # The first itinerary is passed to the agent as is
+    lowest_price_trip: Optional[Dict[str, Any]] = None
+    itineraries: List[ItineraryRecord] = field(default_factory=list)
+    facets: Any = field(default_factory=dict)
+    airline_info: Dict[str, Any] = field(default_factory=dict)
+    airport_info: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def total(self) -> int:
+        return self.count if self.count is not None else len(self.itineraries)
+
+    def cards(self) -> List[Dict[str, Any]]:
+        airline_map = self.airline_info if isinstance(self.airline_info, dict) else {}
+        return [itinerary.card(airline_map) for itinerary in self.itineraries]
+
+    def to_response(self) -> Dict[str, Any]:
+        """
+        A compact response that parses back to this summary, what session
+        traces record and replay_trace.py answers with.
+        """
+        response: Dict[str, Any] = {"Success": self.success}
+        if self.count is not None:
+            response["count"] = self.count
+        if self.message is not None:
+            response["message"] = self.message
+        itineraries = [itinerary.to_itinerary() for itinerary in self.itineraries]
+        if self.lowest_price_trip is not None:
+            itineraries[0] = self.lowest_price_trip
+        response["Data"] = {"PricedItineraries": itineraries}
+        for key in MAP_KEYS:
+            response[key] = getattr(self, key)
+        return response
+
+
+class _SummaryBuilder:
+    def __init__(self):
+        self.summary = SearchSummary()
+
+    def add(self, key: str, value: Any) -> None:
+        summary = self.summary
+        if key == ITINERARY_PREFIX:
+            if not isinstance(value, dict):
+                return
+            if not summary.itineraries:
+                summary.lowest_price_trip = value
+            summary.itineraries.append(itinerary_record(len(summary.itineraries), value))
+        elif key == "Success":
+            summary.success = value is True
+        elif key == "count":
+            summary.count = value
+        elif key == "message":
+            summary.message = value
+        elif key in MAP_KEYS:
+            # facets is a list of fields, the code maps are objects, both are kept as they are
+            setattr(summary, key, value if value is not None else {})
+
+
+def summarise_response(response: Any) -> SearchSummary:
+    """Summarise a search response that is already loaded."""
+    if not isinstance(response, dict):
+        raise ValueError("Search response is not a JSON object")
+    builder = _SummaryBuilder()
+    for key in TOP_LEVEL_KEYS:
+        if key in response:
+            builder.add(key, response[key])
+    data = response.get("Data")
+    itineraries = data.get("PricedItineraries") if isinstance(data, dict) else None
+    for itinerary in itineraries or []:
+        builder.add(ITINERARY_PREFIX, itinerary)
+    return builder.summary
+
+
+@functools.lru_cache(maxsize=1024)
+def _itinerary_field(path: str) -> bool:
+    return _ITINERARY_FIELDS.fullmatch(path[len(ITINERARY_PREFIX) + 1:]) is not None
+
+
+class _EventSummariser:
+    """
+    Builds the summary from ijson parse events, fed in batches as they are
+    parsed. Only the maps and the itineraries are built into objects, one
+    itinerary at a time. Itineraries after the first, which goes to the
+    agent whole, are built with only the fields their cards need,
+    everything else is skipped as it streams past.
+    """
+
+    def __init__(self):
+        self._builder = _SummaryBuilder()
+        self._target: Optional[str] = None
+        self._objects = None
+        # Path of a value being skipped
+        self._skipping: Optional[str] = None
+
+    @property
+    def summary(self) -> SearchSummary:
+        return self._builder.summary
+
+    def feed(self, events: Iterable[Tuple[str, str, Any]]) -> None:
+        builder = self._builder
+        for prefix, event, value in events:
+            if self._skipping is not None:
+                # Keys of a skipped map carry the map's own path, only its end or a scalar ends the value
+                if prefix == self._skipping and event not in ("start_map", "start_array", "map_key"):
+                    self._skipping = None
+                continue
+            if self._objects is not None:
+                if event == "map_key" and self._target == ITINERARY_PREFIX and builder.summary.itineraries and not _itinerary_field(f"{prefix}.{value}"):
+                    self._skipping = f"{prefix}.{value}"
+                    continue
+                self._objects.event(event, value)
+                if prefix == self._target and event in ("end_map", "end_array"):
+                    builder.add(self._target, self._objects.value)
+                    self._objects = None
+                continue
+            if prefix != ITINERARY_PREFIX and prefix not in TOP_LEVEL_KEYS:
+                continue
+            if event in ("start_map", "start_array"):
+                self._target, self._objects = prefix, ijson.ObjectBuilder()
+                self._objects.event(event, value)
+            elif event != "map_key":
+                builder.add(prefix, value)
+
+
+class _ChunkReader:
+    """File-like view of an iterable of byte chunks, for ijson."""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks: Iterator[bytes] = iter(chunks)
+        self._pending = b""
+
+    def read(self, size: int = -1) -> bytes:
+        if not self._pending:
+            self._pending = next((chunk for chunk in self._chunks if chunk), b"")
+        if size < 0 or size >= len(self._pending):
+            data, self._pending = self._pending, b""
+        else:
+            # The C backend reads into a fixed buffer, never return more than asked for
+            data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+
+def parse_search(chunks: Iterable[bytes]) -> SearchSummary:
+    """
+    Parse a search response body, blocking.
+
+    Args:
+        chunks: The response body in chunks as they arrive.
+
+    Returns:
+        SearchSummary: The fields the search tools use.
+
+    Raises:
+        ValueError: The body is not valid JSON or not a JSON object.
+    """
+    if ijson is None:
+        return summarise_response(json.loads(b"".join(chunks)))
+    summariser = _EventSummariser()
+    try:
+        summariser.feed(ijson.parse(_ChunkReader(chunks), buf_size=PARSE_BUFFER, use_float=True))
+    except ijson.JSONError as e:
+        raise ValueError(f"Invalid search response: {e}") from e
+    return summariser.summary
+
+
+async def parse_search_stream(chunks: AsyncIterator[bytes]) -> SearchSummary:
+    """
+    Parse a search response body while it downloads.
+
+    Each chunk is pushed through ijson's push parser as it arrives, in a
+    short worker thread call, so parsing overlaps the download and the
+    event loop only hands over bytes. No thread is held while waiting for
+    the network, in-flight searches do not crowd out other blocking work.
+
+    Args:
+        chunks: The response body, e.g. httpx's response.aiter_bytes().
+
+    Raises:
+        ValueError: The body is not valid JSON or not a JSON object.
+    """
+    if ijson is None:
+        body = [chunk async for chunk in chunks]
+        return await asyncio.to_thread(parse_search, body)
+
+    events = ijson.sendable_list()
+    parser = ijson.parse_coro(events, use_float=True)
+    summariser = _EventSummariser()
+
+    def push(chunk: Optional[bytes]) -> None:
+        try:
+            if chunk is None:
+                # Flushes the last events, a truncated body fails here
+                parser.close()
+                summariser.feed(events)
+                return
+            # ijson turns what it is sent into events at once, small pieces keep the peak low
+            for offset in range(0, len(chunk), PARSE_BUFFER):
+                parser.send(chunk[offset:offset + PARSE_BUFFER])
+                summariser.feed(events)
+                del events[:]
+        except ijson.JSONError as e:
+            raise ValueError(f"Invalid search response: {e}") from e
+
+    async for chunk in chunks:
+        if chunk:
+            # Invalid JSON raises here, the rest is not downloaded
+            await asyncio.to_thread(push, chunk)
+    await asyncio.to_thread(push, None)
+    return summariser.summary
@@ -0,0 +1,127 @@
+"""Upstream search result sets cached per search, browsed page by page."""
+
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from flights.search_parser import SearchSummary
+
+SEARCH_RESULTS_TTL = float(os.getenv("SEARCH_RESULTS_TTL", "900"))
+SEARCH_RESULTS_MAX = int(os.getenv("SEARCH_RESULTS_MAX", "500"))
+RESULTS_FETCH_LIMIT = int(os.getenv("RESULTS_FETCH_LIMIT", "50"))
+RESULTS_FIRST_PAGE = int(os.getenv("RESULTS_FIRST_PAGE", "5"))
+RESULTS_PAGE_SIZE = int(os.getenv("RESULTS_PAGE_SIZE", "10"))
+
+
+@dataclass
+class CachedSearch:
+    search_id: str
+    session_id: Optional[str]
+    total: int
+    cards: List[Dict[str, Any]]
+    bytes: int = 0
+    created_at: float = field(default_factory=time.monotonic)
+
+
+class SearchResultCache:
+    """
+    Result sets of recent searches, bounded by count and age.
+
+    Each upstream search is fetched once with up to RESULTS_FETCH_LIMIT
+    itineraries and kept as compact cards, pages are served from here.
+    """
+
+    def __init__(self, ttl: float = SEARCH_RESULTS_TTL, max_entries: int = SEARCH_RESULTS_MAX):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, CachedSearch]" = OrderedDict()
+
+    def put(self, session_id: Optional[str], summary: SearchSummary) -> CachedSearch:
+        """
+        Cache the itineraries of a search response.
+
+        Returns:
+            CachedSearch: The cached result set.
+        """
+        cached = CachedSearch(
+            search_id=uuid.uuid4().hex,
+            session_id=session_id,
+            total=summary.total,
+            cards=summary.cards(),
+        )
+        cached.bytes = len(json.dumps(cached.cards, default=str))
+        self._entries[cached.search_id] = cached
+        self._evict()
+        return cached
+
+    def restore(self, search_id: str, session_id: Optional[str], total: int, cards: List[Dict[str, Any]]) -> CachedSearch:
+        """Cache a result set handed over by another process under its own id."""
+        cached = CachedSearch(search_id=search_id, session_id=session_id, total=total, cards=cards)
+        cached.bytes = len(json.dumps(cached.cards, default=str))
+        self._entries[search_id] = cached
+        self._evict()
+        return cached
+
+    def get(self, search_id: str, session_id: Optional[str] = None) -> Optional[CachedSearch]:
+        cached = self._entries.get(search_id)
+        if cached is None:
+            return None
+        if time.monotonic() - cached.created_at > self.ttl:
+            del self._entries[search_id]
+            return None
+        if session_id is not None and cached.session_id != session_id:
+            return None
+        self._entries.move_to_end(search_id)
+        return cached
+
+    def page(self, search_id: str, cursor: Optional[str] = None, limit: int = RESULTS_PAGE_SIZE, session_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        A page of cards.
+
+        Args:
+            search_id: The search to browse.
+            cursor: Cursor returned with the previous page, None for the first page.
+            limit: Number of cards in the page.
+            session_id: Only return searches of this session.
+
+        Returns:
+            The page message, or None if the search expired.
+        """
+        cached = self.get(search_id, session_id)
+        if cached is None:
+            return None
+        offset = int(cursor) if cursor and cursor.isdigit() else 0
+        end = offset + limit
+        return {
+            "type": "itineraries",
+            "search_id": search_id,
+            "total": cached.total,
+            "cards": cached.cards[offset:end],
+            "next_cursor": str(end) if end < len(cached.cards) else None,
+        }
+
+    def session_bytes(self, session_id: str) -> int:
+        """Approximate size of the result sets cached for a session."""
+        return sum(cached.bytes for cached in self._entries.values() if cached.session_id == session_id)
+
+    def drop_session(self, session_id: str) -> None:
+        for search_id in [key for key, cached in self._entries.items() if cached.session_id == session_id]:
+            del self._entries[search_id]
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        while self._entries:
+            search_id, cached = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_entries and now - cached.created_at <= self.ttl:
+                break
+            del self._entries[search_id]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+search_results = SearchResultCache()
@@ -0,0 +1,340 @@
+"""Rule-based extraction of booking slots from a user utterance."""
+
+import calendar
+import json
+import os
+import re
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+AIRPORTS_PATH = os.getenv("AIRPORTS", os.path.join(os.path.dirname(__file__), "airports.json"))
+
+SLOT_KEYS = [
+    "source_city_code",
+    "destination_city_code",
+    "departure_date",
+    "return_date",
+    "number_of_adults",
+    "number_of_children",
+    "number_of_infants",
+]
+
+NUMBER_WORDS = {
+    "a": 1, "an": 1, "single": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+    "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10, "no": 0, "zero": 0, "none": 0,
+}
+
+MONTHS = {name.lower(): index for index, name in enumerate(calendar.month_name) if name}
+MONTHS.update({name.lower(): index for index, name in enumerate(calendar.month_abbr) if name})
+MONTHS["sept"] = 9
+
+WEEKDAYS = {name.lower(): index for index, name in enumerate(calendar.day_name)}
+
+
+def _load_airports() -> Tuple[Dict[str, str], set]:
+    with open(AIRPORTS_PATH, "r") as file:
+        airports = json.load(file)
+    names = {}
+    for code, cities in airports.items():
+        for city in cities:
+            names[city.lower()] = code
+    return names, set(airports)
+
+
+CITY_CODES, IATA_CODES = _load_airports()
+
+_number = r"(\d+|" + "|".join(NUMBER_WORDS) + r")"
+_ordinal = r"(\d{1,2})(?:st|nd|rd|th)?"
+_month = r"(" + "|".join(sorted(MONTHS, key=len, reverse=True)) + r")\.?"
+
+# Longest names first so "new delhi" wins over "delhi"
+_CITY_RE = re.compile(
+    r"\b(" + "|".join(re.escape(name) for name in sorted(CITY_CODES, key=len, reverse=True)) + r"|[A-Z]{3})\b",
+    re.IGNORECASE,
+)
+_SOURCE_CUE = re.compile(r"\b(from|leaving|departing|out of|flying out of)\s+$", re.IGNORECASE)
+_DESTINATION_CUE = re.compile(r"\b(to|into|towards|reach|visit|arriving in|arriving at|going to|fly to)\s+$", re.IGNORECASE)
+_RETURN_CUE = re.compile(r"\b(return|returning|back|coming back|round trip)\b[^.,;]*$", re.IGNORECASE)
+
+_DATE_PATTERNS = [
+    ("iso", re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b")),
+    ("day_month", re.compile(r"\b" + _ordinal + r"\s+(?:of\s+)?" + _month + r"(?:,?\s+(\d{4}))?\b", re.IGNORECASE)),
+    ("month_day", re.compile(r"\b" + _month + r"\s+" + _ordinal + r"(?:,?\s+(\d{4}))?\b", re.IGNORECASE)),
+    ("numeric", re.compile(r"\b(\d{1,2})/(\d{1,2})(?:/(\d{2,4}))?\b")),
+    ("day_after_tomorrow", re.compile(r"\bday after tomorrow\b", re.IGNORECASE)),
+    ("tomorrow", re.compile(r"\btomorrow\b", re.IGNORECASE)),
+    ("today", re.compile(r"\b(today|tonight)\b", re.IGNORECASE)),
+    ("in_days", re.compile(r"\bin\s+" + _number + r"\s+days?\b", re.IGNORECASE)),
+    ("next_week", re.compile(r"\bnext week\b", re.IGNORECASE)),
+    ("weekday", re.compile(r"\b(next|this|on|coming)?\s*(" + "|".join(WEEKDAYS) + r")\b", re.IGNORECASE)),
+]
+
+_PAX_RE = re.compile(
+    r"\b" + _number + r"\s+(adults?|persons?|people|passengers?|travell?ers?|children|child|kids?|infants?|bab(?:y|ies))\b",
+    re.IGNORECASE,
+)
+_SOLO_RE = re.compile(r"\b(just me|only me|myself|by myself|alone|solo)\b", re.IGNORECASE)
+
+
+def _to_int(token: str) -> int:
+    token = token.lower()
+    return int(token) if token.isdigit() else NUMBER_WORDS[token]
+
+
+def _resolve_year(month: int, day: int, year: Optional[str], today: date) -> Optional[date]:
+    try:
+        if year:
+            year_value = int(year)
+            return date(year_value + 2000 if year_value < 100 else year_value, month, day)
+        resolved = date(today.year, month, day)
+        # A date without a year that already passed means next year
+        return resolved if resolved >= today else date(today.year + 1, month, day)
+    except ValueError:
+        return None
+
+
+def _match_date(kind: str, match: re.Match, today: date) -> Optional[date]:
+    groups = match.groups()
+    if kind == "iso":
+        try:
+            return date(int(groups[0]), int(groups[1]), int(groups[2]))
+        except ValueError:
+            return None
+    if kind == "day_month":
+        return _resolve_year(MONTHS[groups[1].lower()], int(groups[0]), groups[2], today)
+    if kind == "month_day":
+        return _resolve_year(MONTHS[groups[0].lower()], int(groups[1]), groups[2], today)
+    if kind == "numeric":
+        # Day first, as written in India
+        return _resolve_year(int(groups[1]), int(groups[0]), groups[2], today)
+    if kind == "day_after_tomorrow":
+        return today + timedelta(days=2)
+    if kind == "tomorrow":
+        return today + timedelta(days=1)
+    if kind == "today":
+        return today
+    if kind == "in_days":
+        return today + timedelta(days=_to_int(groups[0]))
+    if kind == "next_week":
+        return today + timedelta(days=7)
+    if kind == "weekday":
+        # The next such weekday, a week ahead if it is today
+        ahead = (WEEKDAYS[groups[1].lower()] - today.weekday()) % 7
+        return today + timedelta(days=ahead or 7)
+    return None
+
+
+def parse_date(text: str, today: date) -> Optional[date]:
+    """
+    Parse a single absolute or relative date.
+
+    Args:
+        text: The date as written, e.g. "21 May", "2025-05-21" or "next friday".
+        today: The date relative dates are resolved against.
+    """
+    for kind, pattern in _DATE_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            return _match_date(kind, match, today)
+    return None
+
+
+def _extract_dates(text: str, today: date) -> List[Tuple[int, date]]:
+    found: List[Tuple[int, int, date]] = []
+    for kind, pattern in _DATE_PATTERNS:
+        for match in pattern.finditer(text):
+            # Skip matches inside a more specific date already found
+            if any(start <= match.start() < end for start, end, _ in found):
+                continue
+            resolved = _match_date(kind, match, today)
+            if resolved:
+                found.append((match.start(), match.end(), resolved))
+    return [(start, resolved) for start, _, resolved in sorted(found)]
+
+
+def _extract_cities(text: str) -> Tuple[Dict[str, str], List[str]]:
+    slots: Dict[str, str] = {}
+    unassigned: List[str] = []
+    matches = _CITY_RE.finditer(text)
+    for match in matches:
+        token = match.group(1)
+        if len(token) == 3 and token.isupper():
+            if token not in IATA_CODES:
+                continue
+            code = token
+        elif token.lower() in CITY_CODES:
+            code = CITY_CODES[token.lower()]
+        else:
+            continue
+        before = text[:match.start()]
+        if _SOURCE_CUE.search(before):
+            slots.setdefault("source_city_code", code)
+        elif _DESTINATION_CUE.search(before):
+            slots.setdefault("destination_city_code", code)
+        else:
+            unassigned.append(code)
+    # "Bengaluru to Delhi": an uncued city directly followed by a destination
+    if unassigned and "destination_city_code" in slots and "source_city_code" not in slots:
+        slots["source_city_code"] = unassigned.pop(0)
+    return slots, unassigned
+
+
+def _extract_passengers(text: str) -> Dict[str, int]:
+    slots: Dict[str, int] = {}
+    for match in _PAX_RE.finditer(text):
+        count = _to_int(match.group(1))
+        kind = match.group(2).lower()
+        if kind.startswith(("child", "kid")):
+            slots["number_of_children"] = count
+        elif kind.startswith(("infant", "bab")):
+            slots["number_of_infants"] = count
+        else:
+            slots["number_of_adults"] = count
+    if "number_of_adults" not in slots and _SOLO_RE.search(text):
+        slots["number_of_adults"] = 1
+    return slots
+
+
+def extract_slots(text: str, today: date, current: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Extract booking slots from a user utterance.
+
+    Args:
+        text: The user utterance.
+        today: The date relative dates are resolved against.
+        current: The slots already in state, used to place a city or date given without a cue.
+
+    Returns:
+        Dict[str, Any]: The recognised slots, with ISO dates, IATA codes and integer passenger counts.
+    """
+    current = current or {}
+    slots: Dict[str, Any] = {}
+
+    cities, unassigned = _extract_cities(text)
+    slots.update(cities)
+    if unassigned and not cities:
+        # A bare city answers whichever city the agent is asking for
+        key = "source_city_code" if not current.get("source_city_code") else "destination_city_code"
+        if not current.get(key):
+            slots[key] = unassigned[0]
+
+    # Answering "when do you return?" with just a date
+    awaiting_return = bool(current.get("departure_date")) and not current.get("return_date") and bool(_RETURN_CUE.search(text))
+    for position, resolved in _extract_dates(text, today):
+        if _RETURN_CUE.search(text[:position]) or "departure_date" in slots or awaiting_return:
+            slots.setdefault("return_date", resolved.isoformat())
+        else:
+            slots["departure_date"] = resolved.isoformat()
+
+    slots.update(_extract_passengers(text))
+    return slots
+
+
+def normalise_slots(slots: Dict[str, Any], today: date) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    """
+    Validate and normalise booking slots in one pass.
+
+    Args:
+        slots: Slot values as given, e.g. {"source_city_code": "blr", "departure_date": "21 May", "number_of_adults": "one"}.
+        today: The date relative dates are resolved against.
+
+    Returns:
+        The normalised slots (uppercase IATA codes, ISO dates, integer passenger counts) and the errors by slot.
+    """
+    normalised: Dict[str, Any] = {}
+    errors: Dict[str, str] = {}
+    for key, value in slots.items():
+        if key not in SLOT_KEYS:
+            errors[key] = "unknown slot"
+            continue
+        text = str(value).strip()
+        if key.endswith("_city_code"):
+            code = CITY_CODES.get(text.lower(), text.upper())
+            if not re.fullmatch(r"[A-Z]{3}", code):
+                errors[key] = "expected a 3 letter IATA code"
+                continue
+            normalised[key] = code
+        elif key.endswith("_date"):
+            if key == "return_date" and not text:
+                normalised[key] = ""
+                continue
+            resolved = parse_date(text, today)
+            if resolved is None:
+                errors[key] = "expected a date such as 2025-05-21"
+            elif resolved < today:
+                errors[key] = "date is in the past"
+            else:
+                normalised[key] = resolved.isoformat()
+        else:
+            try:
+                count = _to_int(text) if text else 0
+            except (KeyError, ValueError):
+                errors[key] = "expected a whole number"
+                continue
+            if count < 0 or count > 9:
+                errors[key] = "expected a number between 0 and 9"
+            elif key == "number_of_adults" and count < 1:
+                errors[key] = "at least one adult must travel"
+            else:
+                normalised[key] = count
+    departure = normalised.get("departure_date")
+    if departure and normalised.get("return_date") and normalised["return_date"] < departure:
+        errors["return_date"] = "return date is before the departure date"
+    return normalised, errors
+
+
+def apply_slots(session, state, slots: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Store slots in state at once and send a single change notification.
+
+    Args:
+        session: The session, a CustomSession gets one preference change notification.
+        state: The state to write, the ADK State of a tool context or the session state.
+        slots: Normalised slots.
+
+    Returns:
+        Dict[str, Any]: The slots whose value changed.
+    """
+    changed = {key: value for key, value in slots.items() if state.get(key) != value}
+    if not changed:
+        return {}
+    state.update(changed)
+    if hasattr(session, "update_state"):
+        session.update_state()
+    return changed
+
+
+def today_from_state(state: Dict[str, Any]) -> date:
+    try:
+        return datetime.strptime(state.get("today_datetime", ""), "%Y-%m-%d %H:%M:%S").date()
+    except ValueError:
+        return date.today()
+
+
+def prefill_slots(session, text: str) -> Dict[str, Any]:
+    """
+    Extract slots from a user utterance and store them in the session state in one step.
+
+    Args:
+        session: The session, a CustomSession gets a single preference change notification.
+        text: The user utterance.
+
+    Returns:
+        Dict[str, Any]: The slots that were stored.
+    """
+    state = session.state
+    today = today_from_state(state)
+    slots, _ = normalise_slots(extract_slots(text, today, state), today)
+    return apply_slots(session, state, slots)
+
+
+def describe_prefill(applied: Dict[str, Any], state: Dict[str, Any]) -> str:
+    """
+    Describe prefilled slots to the model, it cannot see state changes made outside its tools.
+    """
+    stored = "; ".join(f"{key}={value}" for key, value in applied.items())
+    missing = [key for key in SLOT_KEYS if key != "return_date" and not state.get(key)]
+    description = f"<prefilled_slots>{stored}</prefilled_slots>"
+    if missing:
+        description += f"<missing_slots>{', '.join(missing)}</missing_slots>"
+    return description
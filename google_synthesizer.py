@@ -1,7 +1,17 @@
-from dataclasses import dataclass
-from typing import Optional
+from dataclasses import dataclass, field
+from typing import List, Optional
 from google.cloud import texttospeech
 
+_client: Optional[texttospeech.TextToSpeechClient] = None
+
+
+def _get_client() -> texttospeech.TextToSpeechClient:
+    """The TTS client is shared by every synthesizer in the process."""
+    global _client
+    if _client is None:
+        _client = texttospeech.TextToSpeechClient()
+    return _client
+
 @dataclass
 class GoogleSynthesizerConfig:
     language_code: str = "en-US"
@@ -9,21 +19,23 @@ class GoogleSynthesizerConfig:
     pitch: float = 0.0
     speaking_rate: float = 0.8
     sample_rate_hertz: int = 24000
+    audio_encoding: str = "LINEAR16"  # or "MP3", "OGG_OPUS", "MULAW"
+    effects_profile_id: List[str] = field(default_factory=lambda: ["telephony-class-application"])
 
 class GoogleSynthesizer:
     def __init__(self, config: GoogleSynthesizerConfig):
         self.config = config
-        self.client = texttospeech.TextToSpeechClient()
+        self.client = _get_client()
         self.voice = texttospeech.VoiceSelectionParams(
             language_code=config.language_code,
             name=config.voice_name,
         )
         self.audio_config = texttospeech.AudioConfig(
-            audio_encoding=texttospeech.AudioEncoding.LINEAR16,
+            audio_encoding=getattr(texttospeech.AudioEncoding, config.audio_encoding),
             sample_rate_hertz=config.sample_rate_hertz,
             speaking_rate=config.speaking_rate,
             pitch=config.pitch,
-            effects_profile_id=["telephony-class-application"],
+            effects_profile_id=config.effects_profile_id,
         )
 
     def synthesize(self, text: str) -> bytes:
@@ -33,4 +45,4 @@ class GoogleSynthesizer:
             voice=self.voice,
             audio_config=self.audio_config,
         )
-        return response.audio_content 
\ No newline at end of file
+        return response.audio_content 
@@ -4,11 +4,21 @@ from typing import Optional, Generator
 
 from google.cloud import speech
 
+_client: Optional[speech.SpeechClient] = None
+
+
+def _get_client() -> speech.SpeechClient:
+    """The STT client is shared by every transcriber in the process."""
+    global _client
+    if _client is None:
+        _client = speech.SpeechClient()
+    return _client
+
 @dataclass
 class GoogleTranscriberConfig:
     sampling_rate: int = 16000
     language_code: str = "en-US"
-    audio_encoding: str = "MULAW"  # or "MULAW"
+    audio_encoding: str = "MULAW"  # or "LINEAR16", "OGG_OPUS", "WEBM_OPUS"
     model: Optional[str] = None
 
 @dataclass
@@ -16,11 +26,18 @@ class Transcription:
     message: str
     confidence: float
     is_final: bool
+    stability: float = 0.0
+    # Where the result ends in the audio, in seconds
+    end_time: Optional[float] = None
+
+
+def _seconds(duration) -> Optional[float]:
+    return duration.total_seconds() if hasattr(duration, "total_seconds") else None
 
 class GoogleTranscriber:
     def __init__(self, config: GoogleTranscriberConfig):
         self.config = config
-        self.client = speech.SpeechClient()
+        self.client = _get_client()
         self.streaming_config = speech.StreamingRecognitionConfig(
             config=speech.RecognitionConfig(
                 encoding=getattr(speech.RecognitionConfig.AudioEncoding, config.audio_encoding),
@@ -32,29 +49,20 @@ class GoogleTranscriber:
             interim_results=True,
         )
 
-    def stream_transcribe(self, audio_generator: Generator[bytes, None, None]):
-
-        client = speech.SpeechClient()
-
+    def _responses(self, audio_generator: Generator[bytes, None, None]):
         requests = (
             speech.StreamingRecognizeRequest(audio_content=chunk) for chunk in audio_generator
         )
 
-        config = speech.RecognitionConfig(
-            encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
-            sample_rate_hertz=16000,
-            language_code="en-IN",
-        )
-
-        streaming_config = speech.StreamingRecognitionConfig(config=config)
-
         # streaming_recognize returns a generator.
-        responses = client.streaming_recognize(
-            config=streaming_config,
+        return self.client.streaming_recognize(
+            config=self.streaming_config,
             requests=requests,
         )
 
-        for response in responses:
+    def stream_transcribe(self, audio_generator: Generator[bytes, None, None]):
+
+        for response in self._responses(audio_generator):
             # Once the transcription has settled, the first result will contain the
             # is_final result. The other results will be for subsequent portions of
             # the audio.
@@ -70,7 +78,39 @@ class GoogleTranscriber:
                         message=alternative.transcript,
                         confidence=alternative.confidence,
                         is_final=result.is_final,
+                        stability=result.stability,
+                        end_time=_seconds(result.result_end_time),
                     )
+
+    def stream_hypotheses(self, audio_generator: Generator[bytes, None, None]):
+        """
+        Like stream_transcribe, but one Transcription per response holding the whole current hypothesis.
+
+        The interim results of a response are consecutive portions of the
+        utterance, their top alternatives are joined and the least stable
+        portion sets the stability.
+        """
+        for response in self._responses(audio_generator):
+            results = [result for result in response.results if result.alternatives]
+            if not results:
+                continue
+            if results[0].is_final:
+                top = results[0].alternatives[0]
+                yield Transcription(
+                    message=top.transcript,
+                    confidence=top.confidence,
+                    is_final=True,
+                    stability=1.0,
+                    end_time=_seconds(results[0].result_end_time),
+                )
+                continue
+            yield Transcription(
+                message="".join(result.alternatives[0].transcript for result in results),
+                confidence=min(result.alternatives[0].confidence for result in results),
+                is_final=False,
+                stability=min(result.stability for result in results),
+                end_time=_seconds(results[-1].result_end_time),
+            )
         # print("Streaming transcribe")
         # requests = (speech.StreamingRecognizeRequest(audio_content=chunk) for chunk in audio_generator)
         # try:
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+from upstream_limits import UpstreamUnavailable
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class HedgeConfig:
+    enabled: bool = False
+    percentile: float = 0.95
+    min_delay: float = 0.5
+    max_delay: float = 30.0
+    budget_ratio: float = 0.1
+    max_budget: float = 10.0
+    window: int = 200
+    min_samples: int = 20
+
+    @classmethod
+    def from_env(cls, name: str, **defaults) -> "HedgeConfig":
+        """
+        Build a config from HEDGE_<NAME>_* environment variables, HEDGE_ENABLED turns hedging on globally.
+
+        Args:
+            name: The hedged call name, e.g. "zoozle_search".
+            defaults: Per-call defaults overriding the class defaults.
+        """
+        config = cls(**defaults)
+        prefix = f"HEDGE_{name.upper()}_"
+        enabled = os.getenv(prefix + "ENABLED", os.getenv("HEDGE_ENABLED", str(config.enabled)))
+        config.enabled = enabled.lower() in ("1", "true", "yes")
+        config.percentile = float(os.getenv(prefix + "PERCENTILE", config.percentile))
+        config.min_delay = float(os.getenv(prefix + "MIN_DELAY", config.min_delay))
+        config.max_delay = float(os.getenv(prefix + "MAX_DELAY", config.max_delay))
+        config.budget_ratio = float(os.getenv(prefix + "BUDGET_RATIO", config.budget_ratio))
+        return config
+
+
+class Hedger:
+    """
+    Hedged requests for one kind of upstream call.
+
+    If the first attempt has not finished after the configured percentile of
+    recently observed latencies, a second attempt is started; the first to
+    succeed wins and the other is cancelled. Every call earns budget_ratio of
+    a hedge token, so hedges add at most that fraction of extra upstream load.
+    Calls that time out count as max_delay, leaving them out would pull the
+    percentile below the latencies callers actually see.
+    """
+
+    def __init__(self, name: str, config: HedgeConfig):
+        self.name = name
+        self.config = config
+        self._latencies: Deque[float] = deque(maxlen=config.window)
+        self._budget = config.max_budget
+
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.primary_wins = 0
+        self.budget_exhausted = 0
+
+    def hedge_delay(self) -> Optional[float]:
+        """Delay before hedging, None until enough latencies have been observed."""
+        if len(self._latencies) < self.config.min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(self.config.percentile * len(ordered)))
+        return min(self.config.max_delay, max(self.config.min_delay, ordered[index]))
+
+    def _take_budget(self) -> bool:
+        if self._budget >= 1:
+            self._budget -= 1
+            return True
+        self.budget_exhausted += 1
+        return False
+
+    async def run(self, attempt: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run attempt, hedging it with a duplicate when it is slow.
+
+        Args:
+            attempt: Zero-argument callable returning a new awaitable for each attempt.
+        """
+        self.calls += 1
+        self._budget = min(self.config.max_budget, self._budget + self.config.budget_ratio)
+        start = time.monotonic()
+        delay = self.hedge_delay() if self.config.enabled else None
+
+        primary = asyncio.ensure_future(attempt())
+        tasks = {primary: "primary"}
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait({primary}, timeout=delay)
+                if not done and self._take_budget():
+                    self.hedged += 1
+                    tasks[asyncio.ensure_future(attempt())] = "hedge"
+
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            timed_out = False
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        if _is_timeout(error) and not timed_out:
+                            timed_out = True
+                            self._latencies.append(self.config.max_delay)
+                        continue
+                    self._latencies.append(time.monotonic() - start)
+                    if len(tasks) > 1:
+                        if tasks[task] == "hedge":
+                            self.hedge_wins += 1
+                        else:
+                            self.primary_wins += 1
+                    return task.result()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.config.enabled,
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "primary_wins": self.primary_wins,
+            "hedge_win_rate": self.hedge_wins / self.hedged if self.hedged else 0.0,
+            "budget_exhausted": self.budget_exhausted,
+            "hedge_delay": self.hedge_delay(),
+        }
+
+
+def _is_timeout(error: BaseException) -> bool:
+    if isinstance(error, UpstreamUnavailable):
+        return error.reason == "timeout"
+    return isinstance(error, asyncio.TimeoutError)
+
+
+_hedgers: Dict[str, Hedger] = {}
+
+
+def get_hedger(name: str, **defaults) -> Hedger:
+    """
+    Get the process-wide hedger for a kind of call, creating it on first use.
+
+    Args:
+        name: The hedged call name.
+        defaults: Config defaults used when the hedger is created.
+    """
+    if name not in _hedgers:
+        _hedgers[name] = Hedger(name, HedgeConfig.from_env(name, **defaults))
+    return _hedgers[name]
+
+
+def hedger_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: hedger.stats() for name, hedger in _hedgers.items()}
@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import math
+import os
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+from google.adk.agents import LiveRequestQueue
+from google.adk.agents.run_config import RunConfig
+from google.adk.events import Event
+from google.adk.runners import Runner
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class LivePoolConfig:
+    enabled: bool = os.getenv("LIVE_POOL_ENABLED", "true").lower() == "true"
+    # Every warm stream is a billed model connection, an idle instance keeps none by default
+    min_size: int = int(os.getenv("LIVE_POOL_MIN_SIZE", "0"))
+    max_size: int = int(os.getenv("LIVE_POOL_MAX_SIZE", "8"))
+    # Warm streams kept per expected arrival over this many seconds
+    lead_time: float = float(os.getenv("LIVE_POOL_LEAD_TIME", "15"))
+    # Arrivals expected within lead_time before any stream is kept warm
+    min_expected: float = float(os.getenv("LIVE_POOL_MIN_EXPECTED", "0.5"))
+    # Time constant of the arrival rate average
+    rate_window: float = float(os.getenv("LIVE_POOL_RATE_WINDOW", "120"))
+    # Idle streams are replaced after this, the instruction they were opened with carries today_datetime
+    ttl: float = float(os.getenv("LIVE_POOL_TTL", "120"))
+    max_backoff: float = 60.0
+
+
+class WarmStream:
+    """
+    A run_live stream opened ahead of a connection for a placeholder session.
+
+    Reading the first event is started straight away, which makes ADK build
+    the request and open the model connection. The stream then idles until
+    a caller is bound and sends input.
+    """
+
+    def __init__(self, runner: Runner, session, run_config: RunConfig):
+        self.session = session
+        self.live_request_queue = LiveRequestQueue()
+        self.created_at = time.monotonic()
+        self._events = runner.run_live(session=session, live_request_queue=self.live_request_queue, run_config=run_config)
+        self._first = asyncio.ensure_future(self._events.__anext__())
+
+    @property
+    def failed(self) -> bool:
+        """The stream ended or failed before anyone used it."""
+        return self._first.done() and (self._first.cancelled() or self._first.exception() is not None)
+
+    async def live_events(self) -> AsyncGenerator[Event, None]:
+        try:
+            first = await self._first
+        except StopAsyncIteration:
+            return
+        yield first
+        async for event in self._events:
+            yield event
+
+    def close(self) -> None:
+        self._first.cancel()
+        self.live_request_queue.close()
+
+
+class LiveStreamPool:
+    """
+    Pool of warm live-model streams, so a caller is greeted without waiting
+    for the model connection to be set up.
+
+    The pool holds about as many streams as connections are expected within
+    lead_time, from an exponentially weighted arrival rate, clamped to
+    min_size and max_size. Below min_expected arrivals no stream is kept,
+    so a quiet instance holds no model connections. The pool is refilled in
+    the background and streams idle for longer than ttl are replaced.
+    """
+
+    def __init__(self, runner: Runner, session_service, app_name: str, run_config: RunConfig, config: Optional[LivePoolConfig] = None):
+        self.runner = runner
+        self.session_service = session_service
+        self.app_name = app_name
+        self.run_config = run_config
+        self.config = config or LivePoolConfig()
+        self._streams: List[WarmStream] = []
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._rate = 0.0
+        self._rate_updated = time.monotonic()
+        self._failures = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.opened = 0
+        self.expired = 0
+        self.failed = 0
+
+    def arrival_rate(self) -> float:
+        """Connections per second, exponentially weighted over rate_window."""
+        return self._rate * math.exp(-(time.monotonic() - self._rate_updated) / self.config.rate_window)
+
+    def target_size(self) -> int:
+        expected = self.arrival_rate() * self.config.lead_time
+        # The decayed rate never reaches zero, without the threshold one stream would be kept forever
+        size = math.ceil(expected) if expected >= self.config.min_expected else 0
+        return min(self.config.max_size, max(self.config.min_size, size))
+
+    def _record_arrival(self) -> None:
+        self._rate = self.arrival_rate() + 1 / self.config.rate_window
+        self._rate_updated = time.monotonic()
+
+    def start(self) -> None:
+        if self.config.enabled and self._task is None:
+            self._task = asyncio.create_task(self._maintain())
+
+    def acquire(self, session_id: str, user_id: str) -> Optional[WarmStream]:
+        """
+        Take a warm stream for a new connection and bind it to the session.
+
+        Returns:
+            The stream, or None if none is ready and the caller has to start one.
+        """
+        self._record_arrival()
+        self._wake.set()
+        while self._streams:
+            stream = self._streams.pop(0)
+            if stream.failed or time.monotonic() - stream.created_at > self.config.ttl:
+                self._discard(stream)
+                continue
+            self.session_service.rebind_session(stream.session, session_id=session_id, user_id=user_id)
+            self.hits += 1
+            return stream
+        self.misses += 1
+        return None
+
+    def _open(self) -> WarmStream:
+        session = self.session_service.create_session(
+            app_name=self.app_name,
+            user_id="warm",
+            session_id=f"warm-{uuid.uuid4().hex}",
+        )
+        self.opened += 1
+        return WarmStream(self.runner, session, self.run_config)
+
+    def _discard(self, stream: WarmStream) -> None:
+        if stream.failed:
+            self.failed += 1
+            self._failures += 1
+        else:
+            self.expired += 1
+        stream.close()
+        self.session_service.forget_session(stream.session)
+
+    async def _maintain(self) -> None:
+        while True:
+            now = time.monotonic()
+            for stream in [stream for stream in self._streams if stream.failed or now - stream.created_at > self.config.ttl]:
+                self._streams.remove(stream)
+                self._discard(stream)
+            # A stream that has stayed open for a while means the model API is back
+            if any(not stream.failed and now - stream.created_at > 30 for stream in self._streams):
+                self._failures = 0
+            try:
+                while len(self._streams) < self.target_size():
+                    self._streams.append(self._open())
+            except Exception as e:
+                logger.error(f"Opening a warm live stream failed: {e}")
+                self._failures += 1
+
+            # Back off while streams keep failing, e.g. the model API is down
+            delay = min(self.config.max_backoff, 2 ** self._failures) if self._failures else 5.0
+            self._wake.clear()
+            # asyncio.wait rather than wait_for, which can swallow a cancel that races the wake up
+            waiter = asyncio.ensure_future(self._wake.wait())
+            try:
+                await asyncio.wait({waiter}, timeout=delay)
+            finally:
+                waiter.cancel()
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for stream in self._streams:
+            stream.close()
+            self.session_service.forget_session(stream.session)
+        self._streams.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.config.enabled,
+            "idle": len(self._streams),
+            "target_size": self.target_size(),
+            "arrival_rate_per_min": round(self.arrival_rate() * 60, 2),
+            "hits": self.hits,
+            "misses": self.misses,
+            "opened": self.opened,
+            "expired": self.expired,
+            "failed": self.failed,
+        }
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+APP_ROOT = os.path.dirname(os.path.abspath(__file__))
+# Upper bounds in seconds, the last bucket takes the rest
+STALL_BUCKETS = (0.25, 0.5, 1.0, 2.0, 5.0, 10.0)
+LAG_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 1.0)
+
+
+@dataclass
+class WatchdogConfig:
+    enabled: bool = os.getenv("LOOP_WATCHDOG_ENABLED", "true").lower() == "true"
+    interval: float = float(os.getenv("LOOP_WATCHDOG_INTERVAL", "0.1"))
+    threshold: float = float(os.getenv("LOOP_STALL_THRESHOLD", "0.2"))
+    max_sites: int = 200
+    stack_depth: int = 30
+
+
+def _bucket(value: float, bounds: Tuple[float, ...]) -> int:
+    for index, bound in enumerate(bounds):
+        if value <= bound:
+            return index
+    return len(bounds)
+
+
+@dataclass
+class StallSite:
+    site: str
+    count: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+    histogram: List[int] = field(default_factory=lambda: [0] * (len(STALL_BUCKETS) + 1))
+    blocking_frame: str = ""
+    last_stack: List[str] = field(default_factory=list)
+    last_seen: float = 0.0
+
+    def to_dict(self, with_stack: bool = True) -> Dict[str, Any]:
+        data = {
+            "site": self.site,
+            "count": self.count,
+            "total_seconds": round(self.total_seconds, 3),
+            "max_seconds": round(self.max_seconds, 3),
+            "histogram": dict(zip([f"le_{bound}" for bound in STALL_BUCKETS] + ["inf"], self.histogram)),
+            "blocking_frame": self.blocking_frame,
+            "last_seen": self.last_seen,
+        }
+        if with_stack:
+            data["last_stack"] = self.last_stack
+        return data
+
+
+def _attribute(stack: traceback.StackSummary) -> Tuple[str, str]:
+    """
+    The innermost frame of the app's own code in a stack, and the innermost
+    frame overall, which is usually the library call that blocked.
+    """
+    def describe(frame: traceback.FrameSummary) -> str:
+        filename = os.path.relpath(frame.filename, APP_ROOT) if frame.filename.startswith(APP_ROOT) else frame.filename
+        return f"{filename}:{frame.lineno} in {frame.name}"
+
+    innermost = describe(stack[-1]) if stack else "unknown"
+    for frame in reversed(stack):
+        if frame.filename.startswith(APP_ROOT) and "site-packages" not in frame.filename and frame.filename != __file__:
+            return describe(frame), innermost
+    return innermost, innermost
+
+
+class LoopWatchdog:
+    """
+    Measures event loop lag and attributes stalls to the code that caused them.
+
+    A heartbeat task sleeps for interval and records how late it wakes up.
+    A watchdog thread checks the heartbeat, when it is late by more than
+    threshold the loop is stuck in a callback, and the thread captures the
+    loop thread's stack. Stalls are aggregated by the innermost frame of the
+    app's own code, e.g. the tool or handler that made a blocking call.
+    """
+
+    def __init__(self, config: Optional[WatchdogConfig] = None):
+        self.config = config or WatchdogConfig()
+        self._sites: Dict[str, StallSite] = {}
+        self._lock = threading.Lock()
+        self._loop_thread: Optional[int] = None
+        self._expected_wake = 0.0
+        self._pending: Optional[Tuple[float, str, str, List[str]]] = None
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+        self.stalls = 0
+        self.unattributed = 0
+        self.max_lag = 0.0
+        self.lag_histogram = [0] * (len(LAG_BUCKETS) + 1)
+
+    def start(self) -> None:
+        """Start watching the running loop."""
+        if not self.config.enabled or self._heartbeat is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._expected_wake = time.monotonic() + self.config.interval
+        self._stopped.clear()
+        self._heartbeat = asyncio.create_task(self._beat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+
+    async def _beat(self) -> None:
+        while True:
+            self._expected_wake = time.monotonic() + self.config.interval
+            await asyncio.sleep(self.config.interval)
+            lag = max(0.0, time.monotonic() - self._expected_wake)
+            self.lag_histogram[_bucket(lag, LAG_BUCKETS)] += 1
+            self.max_lag = max(self.max_lag, lag)
+            if lag > self.config.threshold:
+                self._record(lag, self._expected_wake)
+
+    def _watch(self) -> None:
+        poll = min(self.config.interval, self.config.threshold) / 4
+        captured_for = 0.0
+        while not self._stopped.wait(poll):
+            expected = self._expected_wake
+            if time.monotonic() - expected <= self.config.threshold or captured_for == expected:
+                continue
+            # The loop is stuck, whatever it is running now is the culprit
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame, limit=self.config.stack_depth)
+            del frame
+            site, blocking_frame = _attribute(stack)
+            self._pending = (expected, site, blocking_frame, stack.format())
+            captured_for = expected
+
+    def _record(self, seconds: float, expected_wake: float) -> None:
+        pending, self._pending = self._pending, None
+        if pending is None or pending[0] != expected_wake:
+            # The thread did not sample this stall in time, e.g. it was only just over threshold
+            self.unattributed += 1
+            pending = (expected_wake, "unattributed", "", [])
+        _, site_name, blocking_frame, stack = pending
+        with self._lock:
+            self.stalls += 1
+            site = self._sites.get(site_name)
+            if site is None:
+                if len(self._sites) >= self.config.max_sites:
+                    return
+                site = self._sites[site_name] = StallSite(site_name)
+            site.count += 1
+            site.total_seconds += seconds
+            site.max_seconds = max(site.max_seconds, seconds)
+            site.histogram[_bucket(seconds, STALL_BUCKETS)] += 1
+            site.blocking_frame = blocking_frame
+            site.last_stack = stack
+            site.last_seen = time.time()
+        logger.warning(f"[LOOP STALL] {seconds * 1000:.0f} ms in {site_name} ({blocking_frame})")
+
+    def reset(self) -> None:
+        with self._lock:
+            self._sites.clear()
+        self.stalls = 0
+        self.unattributed = 0
+        self.max_lag = 0.0
+        self.lag_histogram = [0] * (len(LAG_BUCKETS) + 1)
+
+    def stats(self, top: int = 20, with_stacks: bool = True) -> Dict[str, Any]:
+        with self._lock:
+            sites = sorted(self._sites.values(), key=lambda site: site.total_seconds, reverse=True)[:top]
+            return {
+                "enabled": self.config.enabled,
+                "threshold_seconds": self.config.threshold,
+                "stalls": self.stalls,
+                "unattributed": self.unattributed,
+                "max_lag_seconds": round(self.max_lag, 3),
+                "lag_histogram": dict(zip([f"le_{bound}" for bound in LAG_BUCKETS] + ["inf"], self.lag_histogram)),
+                "sites": [site.to_dict(with_stacks) for site in sites],
+            }
+
+
+loop_watchdog = LoopWatchdog()
@@ -4,7 +4,6 @@ import os
 from fastapi.logger import logger
 
 from flights.custom_session import CustomSessionService
-from google_transcriber import GoogleTranscriber, GoogleTranscriberConfig
 
 # Force stdout to be unbuffered
 sys.stdout.reconfigure(line_buffering=True)
@@ -33,10 +32,11 @@ import json
 import asyncio
 import base64
 from pathlib import Path
+import time
 import traceback
 import uuid
 
-from fastapi import Depends, FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import Depends, FastAPI, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 
 from dotenv import load_dotenv
@@ -52,25 +52,65 @@ from fastapi import FastAPI, WebSocket
 from fastapi.responses import FileResponse, Response
 from dotenv import load_dotenv
 from flights.agent import root_agent
+from flights.reference_data import REFERENCE_SNAPSHOT, reference_data
+from flights.search_flight_tools import close_http_client, route_prewarmer
+from flights.search_results import RESULTS_FIRST_PAGE, RESULTS_PAGE_SIZE, search_results
+from flights.slot_extractor import describe_prefill, prefill_slots
 
 # Load environment variables
 load_dotenv()
 
-from google_synthesizer import GoogleSynthesizer, GoogleSynthesizerConfig
+from audio_frontend import AudioFrontend, AudioFrontendConfig, input_format
+from audio_codecs import DEFAULT_INPUT_CODEC, audio_duration, DEFAULT_OUTPUT_CODEC, INPUT_CODECS, OUTPUT_CODECS, get_synthesizer, get_transcriber, negotiate_codecs
+from live_pool import LiveStreamPool
+from loop_watchdog import loop_watchdog
+from memory_accounting import MEMORY_TOP_N, admin_allowed, estimate_session, heap_profiler, process_rss, summarise
+from outbound_queue import MessagePriority, OutboundQueue
+from rate_limits import RateLimited, bind_session, client_keys, get_rate_limiter, rate_limit_stats, rate_limited_message, session_keys, unbind_session
+from session_snapshots import Drain, new_handover_token, snapshot_session, snapshot_store
+from session_trace import end_trace, is_tracing, record, start_trace, trace_stats
+from static_assets import StaticAssets
+from stt_early_commit import early_commit_stats, transcribe_turn
+from hedging import hedger_stats
+from upstream_limits import UpstreamUnavailable, end_session, get_limiter, limiter_stats, set_fair_key, start_turn
 
 
 APP_NAME = "Flights Booking Agent"
+SLOT_PREFILL_ENABLED = os.getenv("SLOT_PREFILL_ENABLED", "true").lower() == "true"
 session_service = CustomSessionService()
 
 load_dotenv(dotenv_path='.env', override=True)
 
-google_transcriber = GoogleTranscriber(GoogleTranscriberConfig(sampling_rate=16000, audio_encoding="LINEAR16", language_code="en-US"))
-google_synthesizer = GoogleSynthesizer(GoogleSynthesizerConfig(language_code="en-IN", voice_name="en-IN-Chirp-HD-F", sample_rate_hertz=24000))
+# Defaults, connections get their own codecs from negotiate_codecs
+google_transcriber = get_transcriber(INPUT_CODECS[DEFAULT_INPUT_CODEC])
+google_synthesizer = get_synthesizer(OUTPUT_CODECS[DEFAULT_OUTPUT_CODEC])
+
+tts_limiter = get_limiter("tts", max_concurrency=16, timeout=10.0)
+stt_limiter = get_limiter(
+    "stt",
+    max_concurrency=16,
+    timeout=15.0,
+    fallback_message="Sorry, I'm having trouble hearing you right now. Could you type your message instead?",
+)
+
+# Per user and per IP limits, searches are limited in the search tools
+connection_rate_limiter = get_rate_limiter("connections", rate=0.2, burst=10)
+message_rate_limiter = get_rate_limiter("messages", rate=2.0, burst=20)
+audio_rate_limiter = get_rate_limiter("audio_seconds", rate=1.5, burst=60)
+
+# Outbound queues of the connected clients, keyed by session id
+outbound_queues: dict[str, OutboundQueue] = {}
+# Per-connection objects and tasks, keyed by session id, for memory accounting
+active_sessions: dict = {}
+text_histories: dict = {}
+connection_tasks: dict[str, list[asyncio.Task]] = {}
 
 class TextHistory:
-    def __init__(self, websocket):
+    def __init__(self, outbound: OutboundQueue, session_id: str, synthesizer=google_synthesizer):
         self.text_history = ""
-        self.websocket = websocket
+        self.outbound = outbound
+        self.session_id = session_id
+        self.synthesizer = synthesizer
         print("TextHistory initialized")  # Debug print
 
     def add_text(self, text, prefix="", suffix="", is_complete=False, next_text=None):
@@ -100,33 +140,63 @@ class TextHistory:
         print(f"[SYNTHESIZING AUDIO]: {text}")  # Debug print
         logger.info(f"[SYNTHESIZING AUDIO]: {text}")
         print(f"[SYNTHESIZING AUDIO]: {datetime.now().isoformat()}")  # Debug print
-        audio_content = google_synthesizer.synthesize(text)
+        started = time.monotonic()
+        try:
+            audio_content = await tts_limiter.call(self.synthesizer.synthesize, text, session_key=self.session_id)
+        except Exception as e:
+            # Fall back to text only, the client still shows what the agent said
+            logger.error(f"[SYNTHESIZING AUDIO] failed: {e}")
+            record(self.session_id, "stage", stage="tts", latency=round(time.monotonic() - started, 4), chars=len(text), error=repr(e))
+            self.outbound.send({"audio_text": text}, MessagePriority.TEXT)
+            return
+        record(self.session_id, "stage", stage="tts", latency=round(time.monotonic() - started, 4), chars=len(text))
         audio_base64 = base64.b64encode(audio_content).decode("utf-8")
-        await self.websocket.send_text(json.dumps({
-            "audio": audio_base64, 
-            "audio_text": text
-        }))
+        self.outbound.send(
+            {"audio": audio_base64, "audio_text": text},
+            MessagePriority.AUDIO,
+            fallback={"audio_text": text},
+        )
         print(f"[SYNTHESIZING AUDIO]: {text} {datetime.now().isoformat()}")  # Debug print
 
-def start_agent_session(session_id: str, user_id: str):
-    """Starts an agent session"""
+# One Runner for every session, it only holds the agent and the services
+runner = Runner(
+    app_name=APP_NAME,
+    agent=root_agent,
+    session_service=session_service,
+)
+
+# Set response modality = TEXT
+run_config = RunConfig(response_modalities=["TEXT"], streaming_mode=StreamingMode.SSE)
 
-    # Create a Session
-    session = session_service.create_session(
-        app_name=APP_NAME,
-        user_id=user_id,
-        session_id=session_id,
-    )
+# Live-model streams opened ahead of connections
+live_pool = LiveStreamPool(runner, session_service, APP_NAME, run_config)
 
-    # Create a Runner
-    runner = Runner(
-        app_name=APP_NAME,
-        agent=root_agent,
-        session_service=session_service,
-    )
+# Drain mode, sessions are handed over to the next process on SIGTERM
+drain = Drain()
+
+def start_agent_session(session_id: str, user_id: str, snapshot=None):
+    """Starts an agent session, on a warm live stream if one is ready, or restored from a snapshot"""
+
+    if snapshot is not None:
+        # A session handed over by a draining process, its history goes to the model in one go
+        session = session_service.restore_session(
+            app_name=APP_NAME,
+            user_id=user_id,
+            session_id=session_id,
+            state=snapshot.state,
+            events=snapshot.events,
+        )
+    else:
+        warm = live_pool.acquire(session_id=session_id, user_id=user_id)
+        if warm is not None:
+            return warm.live_events(), warm.live_request_queue, warm.session
 
-    # Set response modality = TEXT
-    run_config = RunConfig(response_modalities=["TEXT"], streaming_mode=StreamingMode.SSE)
+        # Create a Session
+        session = session_service.create_session(
+            app_name=APP_NAME,
+            user_id=user_id,
+            session_id=session_id,
+        )
 
     # Create a LiveRequestQueue for this session
     live_request_queue = LiveRequestQueue()
@@ -165,16 +235,29 @@ def handle_text_and_audio(text, event, websocket):
     audio_base64 = base64.b64encode(audio_content).decode("utf-8")
     return audio_base64
 
-async def agent_to_client_messaging(websocket, live_events):
+async def agent_to_client_messaging(outbound, live_events, session_id, text_history):
     """Agent to client communication"""
-    text_history = TextHistory(websocket)
     while True:
         async for event in live_events:
+            if is_tracing(session_id):
+                record(
+                    session_id,
+                    "agent_event",
+                    partial=bool(event.partial),
+                    turn_complete=bool(event.turn_complete),
+                    interrupted=bool(event.interrupted),
+                    text="".join(part.text or "" for part in event.content.parts) if event.content and event.content.parts else None,
+                    function_calls=[call.name for call in event.get_function_calls()],
+                )
+            if event.turn_complete or event.interrupted:
+                drain.turn_finished(session_id)
             if event.turn_complete:
-                await websocket.send_text(json.dumps({"turn_complete": True}))
+                outbound.send({"turn_complete": True}, MessagePriority.CONTROL)
                 logger.info("[TURN COMPLETE]")
             if event.interrupted:
-                await websocket.send_text(json.dumps({"interrupted": True}))
+                # Speech queued for the interrupted turn is no longer relevant
+                outbound.drop_audio()
+                outbound.send({"interrupted": True}, MessagePriority.CONTROL)
                 logger.info("[INTERRUPTED]")
             part: Part = (
                 event.content and event.content.parts and event.content.parts[0]
@@ -185,7 +268,7 @@ async def agent_to_client_messaging(websocket, live_events):
             if not text:
                 continue
             
-            await websocket.send_text(json.dumps({"message": text}))
+            outbound.send({"message": text}, MessagePriority.TEXT)
             logger.info(f"[AGENT TO CLIENT]: {text} {datetime.now().isoformat()}")
             if event.turn_complete:
                 text_history.add_final_text(text)
@@ -218,72 +301,168 @@ async def agent_to_client_messaging(websocket, live_events):
             
 
 
-async def client_to_agent_messaging(websocket, live_request_queue):
+def submit_user_text(live_request_queue, session, text, note=None):
+    """Start an agent turn with the user's words"""
+    session_id = session.id
+    logger.info(f"[CLIENT TO AGENT]: {text} {datetime.now().isoformat()}")
+    start_turn(session_id)
+    drain.turn_started(session_id)
+    parts = [Part.from_text(text=text)]
+    if SLOT_PREFILL_ENABLED:
+        # Fill the slots we can recognise locally, saving the model memorize round trips
+        started = time.monotonic()
+        prefilled = prefill_slots(session, text)
+        record(session_id, "stage", stage="prefill", latency=round(time.monotonic() - started, 4), text=text, slots=prefilled)
+        if prefilled:
+            logger.info(f"[PREFILLED SLOTS]: {prefilled}")
+            parts.append(Part.from_text(text=describe_prefill(prefilled, session.state)))
+    if note:
+        parts.append(Part.from_text(text=note))
+    content = Content(role="user", parts=parts)
+    live_request_queue.send_content(content=content)
+    logger.info(f"[CLIENT TO AGENT]: {text} {datetime.now().isoformat()}")
+
+
+async def client_to_agent_messaging(websocket, outbound, live_request_queue, session, transcriber, audio_frontend=None):
     """Client to agent communication"""
+    session_id = session.id
+    keys = session_keys(session_id)
     while True:
 
         logger.info("Waiting for client to send message")
 
         data = await websocket.receive_text()
+        try:
+            message_rate_limiter.check(keys)
+        except RateLimited as e:
+            outbound.send(rate_limited_message(e), MessagePriority.CONTROL)
+            continue
             
         try:
             data_json = json.loads(data)
         except Exception:
             data_json = None
+        if data_json and data_json.get("type") == "more_results":
+            # Next page of a result set the client is scrolling through, served from the cache
+            page = search_results.page(data_json.get("search_id"), data_json.get("cursor"), RESULTS_PAGE_SIZE, session_id=session_id)
+            outbound.send(page or {"type": "itineraries_expired", "search_id": data_json.get("search_id")}, MessagePriority.PREFERENCES)
+            continue
+        if drain.draining:
+            # No new turns while the session is handed over, the client sends this again after reconnecting
+            outbound.send({"reconnect": True, "resend": True, "session_id": session_id, "data": data}, MessagePriority.CONTROL)
+            continue
         if data_json and "audio" in data_json.keys():
             logger.info("Received audio from client")
             # Received audio from client, decode and transcribe
             audio_bytes = base64.b64decode(data_json["audio"])
-            def audio_gen():
-                logger.info("Sending audio to transcriber")
-                yield audio_bytes
-            # google_transcriber.stream_transcribe(audio_gen())
-            for transcription in google_transcriber.stream_transcribe(audio_gen()):
-                logger.info(f"[TRANSCRIPTION]: {transcription}")
-                if transcription.is_final:
-                    text = transcription.message
-                    logger.info(f"[TRANSCRIPTION]: {text}")
-                    break
-            else:
+            if audio_frontend is not None:
+                # Downmix, resample and level the raw PCM to what the transcriber is configured for
+                started = time.monotonic()
+                bytes_in = len(audio_bytes)
+                audio_bytes = audio_frontend.process(audio_bytes)
+                record(session_id, "stage", stage="audio_frontend", latency=round(time.monotonic() - started, 4), bytes_in=bytes_in, bytes_out=len(audio_bytes))
+            try:
+                audio_rate_limiter.check(keys, audio_duration(len(audio_bytes), transcriber.config))
+            except RateLimited as e:
+                outbound.send(rate_limited_message(e), MessagePriority.CONTROL)
+                continue
+            started = time.monotonic()
+            transcript = None
+            committed_early = None
+
+            def commit_early(text):
+                nonlocal committed_early
+                # Start the agent turn on a stable interim transcript, the final one is checked below
+                committed_early = text
+                submit_user_text(live_request_queue, session, text)
+
+            try:
+                transcript = await stt_limiter.call(
+                    transcribe_turn,
+                    audio_bytes,
+                    transcriber,
+                    on_early_commit=commit_early,
+                    audio_seconds=audio_duration(len(audio_bytes), transcriber.config),
+                    session_key=session_id,
+                )
+                text = transcript.final
+            except UpstreamUnavailable as e:
+                logger.error(f"[TRANSCRIPTION] failed: {e}")
+                if committed_early is None:
+                    outbound.send({"message": e.message}, MessagePriority.TEXT)
                 text = ""
+            except Exception as e:
+                logger.error(f"[TRANSCRIPTION] failed: {e}")
+                if committed_early is None:
+                    outbound.send({"message": stt_limiter.config.fallback_message}, MessagePriority.TEXT)
+                text = ""
+            record(session_id, "stage", stage="stt", latency=round(time.monotonic() - started, 4), bytes=len(audio_bytes), ok=bool(text) and not (transcript and transcript.failed))
+            record(session_id, "inbound", source="audio", text=text, committed=committed_early)
+            if committed_early is not None:
+                # The agent is already answering the committed text, also when the final transcript failed
+                if transcript is not None and transcript.retracted:
+                    # The early transcript was misheard, drop the speech answering it and resubmit
+                    outbound.drop_audio()
+                    outbound.send({"transcript_correction": text, "retracted": transcript.committed}, MessagePriority.CONTROL)
+                    submit_user_text(
+                        live_request_queue,
+                        session,
+                        text,
+                        note=f"<correction>The previous user message \"{transcript.committed}\" was misheard, this is what the user said. Answer this message instead.</correction>",
+                    )
+                await asyncio.sleep(0)
+                continue
         else:
             # Fallback: treat as plain text
             text = data if isinstance(data, str) else ""
+            record(session_id, "inbound", source="text", text=text)
         if text:
-            logger.info(f"[CLIENT TO AGENT]: {text} {datetime.now().isoformat()}")
-            content = Content(role="user", parts=[Part.from_text(text=text)])
-            live_request_queue.send_content(content=content)
-            logger.info(f"[CLIENT TO AGENT]: {text} {datetime.now().isoformat()}")
+            submit_user_text(live_request_queue, session, text)
         await asyncio.sleep(0)
 
 
-async def disconnect_agent(websocket, session, session_id, user_id):
+async def disconnect_agent(websocket, outbound, session, session_id, user_id):
     """Disconnect agent"""
     try:
         # Wait for end call signal
         await session.wait_for_end_call()
-        await websocket.send_text(json.dumps({"end_call": True}))
-        session_service.delete_session(app_name=APP_NAME, user_id=user_id, session_id=session_id)
+        outbound.send({"end_call": True}, MessagePriority.CONTROL)
+        await outbound.drain()
+        await session_service.delete_session(app_name=APP_NAME, user_id=user_id, session_id=session_id)
         await websocket.close()
         logger.info("---------------------Agent disconnected----------------------")
     except Exception as e:
         logger.error(f"Error in disconnect_agent: {e}")
         return
 
-async def show_user_preffered_details(websocket, session):
+async def show_user_preffered_details(outbound, session):
     """Show user preffered details"""
     try:
         while True:
             # Wait for preference changes
             preferences = await session.wait_for_preference_change()
             print(f"---------------------------------Preferences: {preferences}---------------------------------")
-            await websocket.send_text(json.dumps(preferences))
+            outbound.send(preferences, MessagePriority.PREFERENCES)
     except Exception as e:
         logger.error(f"Error in show_user_preffered_details: {e}")
         return
 
+async def stream_search_results(outbound, session):
+    """Push the first page of every new search result set to the client"""
+    try:
+        while True:
+            search_id = await session.wait_for_search_results()
+            page = search_results.page(search_id, None, RESULTS_FIRST_PAGE, session_id=session.id)
+            if page:
+                outbound.send(page, MessagePriority.PREFERENCES)
+    except Exception as e:
+        logger.error(f"Error in stream_search_results: {e}")
+        return
+
 app = FastAPI()
 
+static_assets = StaticAssets()
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -292,42 +471,349 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.get("/")
-async def read_root():
-    return FileResponse('index.html')
-
-@app.get("/config.js")
-async def get_config():
+@app.on_event("startup")
+async def preload_reference_data():
+    """Preload the shared airline, airport and facet maps"""
+    if REFERENCE_SNAPSHOT and os.path.exists(REFERENCE_SNAPSHOT):
+        reference_data.load_snapshot(REFERENCE_SNAPSHOT)
+
+@app.on_event("shutdown")
+async def save_reference_data():
+    """Snapshot the shared maps for the next process to preload"""
+    if REFERENCE_SNAPSHOT:
+        reference_data.save_snapshot(REFERENCE_SNAPSHOT)
+
+@app.on_event("shutdown")
+async def close_upstream_connections():
+    """Close the pooled upstream HTTP connections"""
+    await close_http_client()
+
+@app.on_event("startup")
+async def start_loop_watchdog():
+    """Watch for callbacks blocking the event loop"""
+    loop_watchdog.start()
+
+@app.on_event("shutdown")
+async def stop_loop_watchdog():
+    loop_watchdog.stop()
+
+@app.on_event("startup")
+async def start_live_pool():
+    """Start keeping warm live-model streams"""
+    live_pool.start()
+
+@app.on_event("shutdown")
+async def close_live_pool():
+    await live_pool.close()
+
+@app.on_event("startup")
+async def start_route_prewarmer():
+    """Start keeping popular route searches warm"""
+    route_prewarmer.start()
+
+@app.on_event("shutdown")
+async def close_route_prewarmer():
+    await route_prewarmer.close()
+
+@app.on_event("startup")
+async def start_drain_mode():
+    """Hand sessions over to the next process on SIGTERM, and drop snapshots nobody came back for"""
+    drain.install(handoff_sessions)
+    await asyncio.to_thread(snapshot_store.prune)
+
+@app.on_event("startup")
+async def load_static_assets():
+    """Load and precompress the page and its config once"""
+    static_assets.add_file("/", "index.html", "text/html; charset=utf-8")
     config = {
         "HOST_URL": os.getenv("HOST_URL", "http://127.0.0.1:8000/")
     }
-    return Response(
-        content=f"const config = {json.dumps(config, indent=2)};",
-        media_type="application/javascript"
+    static_assets.add(
+        "/config.js",
+        f"const config = {json.dumps(config, indent=2)};".encode(),
+        "application/javascript",
     )
 
+@app.get("/")
+async def read_root(request: Request):
+    return static_assets.response("/", request)
+
+@app.get("/config.js")
+async def get_config(request: Request):
+    return static_assets.response("/config.js", request)
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness check, no I/O"""
+    return Response(content="ok", media_type="text/plain")
+
+@app.get("/metrics/outbound")
+async def get_outbound_metrics(request: Request):
+    """Per-connection outbound queue metrics, needs ADMIN_DEBUG_ENABLED, they list session ids"""
+    if not admin_allowed(request.headers):
+        return Response(status_code=403)
+    return {session_id: outbound.stats() for session_id, outbound in outbound_queues.items()}
+
+@app.get("/metrics/upstreams")
+async def get_upstream_metrics():
+    """Admission control and circuit breaker counters per upstream"""
+    return limiter_stats()
+
+@app.get("/metrics/history")
+async def get_history_metrics(request: Request):
+    """Conversation history size and compaction savings per session, needs ADMIN_DEBUG_ENABLED"""
+    if not admin_allowed(request.headers):
+        return Response(status_code=403)
+    return session_service.compaction_stats()
+
+@app.get("/metrics/reference-data")
+async def get_reference_data_metrics():
+    """Size of the shared reference data and memory saved by sharing it"""
+    return reference_data.stats()
+
+@app.get("/metrics/traces")
+async def get_trace_metrics(request: Request):
+    """Sessions being traced, see TRACE_DIR, needs ADMIN_DEBUG_ENABLED"""
+    if not admin_allowed(request.headers):
+        return Response(status_code=403)
+    return trace_stats()
+
+@app.get("/metrics/rate-limits")
+async def get_rate_limit_metrics():
+    """Allowed and limited counts per rate limit"""
+    return rate_limit_stats()
+
+@app.get("/metrics/memory")
+async def get_memory_metrics(request: Request, top: int = MEMORY_TOP_N):
+    """Estimated memory per session, the heaviest sessions first, needs ADMIN_DEBUG_ENABLED"""
+    if not admin_allowed(request.headers):
+        return Response(status_code=403)
+    sessions = [
+        (session, search_results.session_bytes(session_id), outbound_queues.get(session_id), text_histories.get(session_id), list(connection_tasks.get(session_id, ())))
+        for session_id, session in list(active_sessions.items())
+    ]
+
+    def estimate():
+        return [
+            estimate_session(session, search_results_bytes=search_bytes, outbound=outbound, text_history=text_history, tasks=tasks)
+            for session, search_bytes, outbound, text_history, tasks in sessions
+        ]
+
+    # Serialising every history would stall the event loop with many sessions
+    footprints = await asyncio.to_thread(estimate)
+    return {
+        "rss_bytes": process_rss(),
+        "asyncio_tasks": len(asyncio.all_tasks()),
+        # More entries than sessions means sessions are not being cleaned up
+        "history_entries": len(session_service.compaction_stats()),
+        "cached_searches": len(search_results),
+        "reference_data_bytes": reference_data.stats()["bytes"],
+        **summarise(footprints, top),
+    }
+
+@app.get("/debug/heap")
+async def get_heap_diff(request: Request, top: int = 25, group_by: str = "lineno"):
+    """tracemalloc allocation growth since the previous call, needs ADMIN_DEBUG_ENABLED"""
+    if not admin_allowed(request.headers):
+        return Response(status_code=404)
+    if group_by not in heap_profiler.GROUP_BY:
+        return Response(content=f"group_by must be one of {', '.join(heap_profiler.GROUP_BY)}", status_code=400)
+    return await asyncio.to_thread(heap_profiler.diff, top, group_by)
+
+@app.delete("/debug/heap")
+async def stop_heap_profiling(request: Request):
+    """Stop tracemalloc, it slows down every allocation while running"""
+    if not admin_allowed(request.headers):
+        return Response(status_code=404)
+    heap_profiler.stop()
+    return {"status": "stopped"}
+
+@app.get("/metrics/drain")
+async def get_drain_metrics():
+    """Drain state and session snapshot counts"""
+    return {**drain.stats(), "snapshots": snapshot_store.stats()}
+
+@app.get("/metrics/route-prewarm")
+async def get_route_prewarm_metrics():
+    """Popular routes, their pre-warmed results and how often searches are answered by them"""
+    return route_prewarmer.stats()
+
+@app.get("/metrics/live-pool")
+async def get_live_pool_metrics():
+    """Warm live stream pool size, hit rate and arrival rate"""
+    return live_pool.stats()
+
+@app.get("/metrics/loop-stalls")
+async def get_loop_stall_metrics(request: Request, top: int = 20):
+    """Event loop lag and stalls by call site, with stacks for admins"""
+    return loop_watchdog.stats(top, with_stacks=admin_allowed(request.headers))
+
+@app.delete("/metrics/loop-stalls")
+async def reset_loop_stall_metrics(request: Request):
+    if not admin_allowed(request.headers):
+        return Response(status_code=404)
+    loop_watchdog.reset()
+    return {"status": "reset"}
+
+@app.get("/metrics/stt-early-commit")
+async def get_stt_early_commit_metrics():
+    """Early committed transcripts, how many were retracted and the time saved"""
+    return early_commit_stats.to_dict()
+
+@app.get("/metrics/hedging")
+async def get_hedging_metrics():
+    """Hedged request counts and win rates"""
+    return hedger_stats()
+
+def restore_session_data(session, snapshot):
+    """Put back the shared maps and the result set on screen of a restored session"""
+    for key, value in snapshot.references.items():
+        session.state[key] = reference_data.assign(session.id, key[:-len("_ref")], value)
+    if snapshot.search:
+        search_results.restore(snapshot.search["search_id"], session.id, snapshot.search["total"], snapshot.search["cards"])
+        session.notify_search_results(snapshot.search["search_id"])
+
+
+def take_snapshot(session_id, session, token):
+    """Snapshot a session with its result set on screen and the shared maps its state points at"""
+    state = session.state
+    references = {key: reference_data.get(ref) for key, ref in state.items() if key.endswith("_ref") and ref}
+    cached = search_results.get(state.get("last_search_id"), session_id) if state.get("last_search_id") else None
+    search = {"search_id": cached.search_id, "total": cached.total, "cards": cached.cards} if cached else None
+    return snapshot_session(session, owner=session_keys(session_id)[0], token=token, search=search, references=references)
+
+
+async def handoff_sessions():
+    """Snapshot every session and tell its client to reconnect, the next process restores it"""
+    async def handoff(session_id, session):
+        token = new_handover_token()
+        saved = await asyncio.to_thread(snapshot_store.save, take_snapshot(session_id, session, token))
+        outbound = outbound_queues.get(session_id)
+        if outbound is None:
+            return
+        # The client reconnects with ?handover_token=, the session id alone does not restore the session
+        message = {"reconnect": True, "session_id": session_id, "restorable": saved}
+        if saved:
+            message["handover_token"] = token
+        outbound.send(message, MessagePriority.CONTROL)
+        await outbound.drain(timeout=2.0)
+        await outbound.websocket.close(code=1012)
+
+    sessions = list(active_sessions.items())
+    results = await asyncio.gather(*(handoff(session_id, session) for session_id, session in sessions), return_exceptions=True)
+    for (session_id, _), result in zip(sessions, results):
+        if isinstance(result, Exception):
+            logger.error(f"Handing over session {session_id} failed: {result}")
+    logger.info(f"Handed over {len(sessions)} sessions")
+
+
 @app.websocket("/ws/{session_id}")
 async def websocket_endpoint(websocket: WebSocket, session_id: str):
     """Client websocket endpoint"""
     # Wait for client connection
     await websocket.accept()
     logger.info(f"Client #{session_id} connected")
+    session_id = str(session_id)
+
+    if drain.draining:
+        # This process is shutting down, the client connects to the next one
+        await websocket.send_text(json.dumps({"reconnect": True, "session_id": session_id, "error": "draining", "status": 503}))
+        await websocket.close(code=1012)
+        return
+
+    keys = client_keys(websocket, session_id)
+    try:
+        connection_rate_limiter.check(keys)
+    except RateLimited as e:
+        logger.warning(f"Client #{session_id} rejected: {e}")
+        await websocket.send_text(json.dumps(rate_limited_message(e)))
+        await websocket.close(code=1013)
+        return
+    bind_session(session_id, keys)
+    # Upstream work is queued fairly per user rather than per session
+    set_fair_key(session_id, keys[0])
+
+    # A session handed over by the previous process is picked up where it was left
+    snapshot = await asyncio.to_thread(snapshot_store.take, session_id, keys[0], websocket.query_params.get("handover_token"))
 
     # Start agent session
-    session_id = str(session_id)
-    live_events, live_request_queue, session = start_agent_session(session_id=session_id, user_id=session_id)
+    live_events, live_request_queue, session = start_agent_session(session_id=session_id, user_id=session_id, snapshot=snapshot)
+    if snapshot is not None:
+        restore_session_data(session, snapshot)
+        logger.info(f"Client #{session_id} restored from a snapshot with {len(snapshot.events)} events")
+
+    # All messages to the client go through a single writer
+    outbound = OutboundQueue(websocket)
+    outbound_queues[session_id] = outbound
+
+    # Audio codecs requested by the client, e.g. ?output_codecs=ogg_opus,mp3&input_codec=mulaw
+    synthesizer, transcriber, audio_format = negotiate_codecs(
+        websocket.query_params.get("output_codecs"),
+        websocket.query_params.get("input_codec"),
+    )
+    outbound.send({"audio_format": audio_format}, MessagePriority.CONTROL)
+
+    # Raw PCM may be sent as captured, e.g. ?input_sample_rate=48000&input_channels=2
+    audio_frontend = None
+    if transcriber.config.audio_encoding == "LINEAR16":
+        audio_frontend = AudioFrontend(
+            input_format(
+                websocket.query_params.get("input_sample_rate"),
+                websocket.query_params.get("input_channels"),
+                websocket.query_params.get("input_sample_format"),
+                transcriber.config.sampling_rate,
+            ),
+            AudioFrontendConfig(target_rate=transcriber.config.sampling_rate),
+        )
+
+    start_trace(
+        session_id,
+        audio_format=audio_format,
+        input_codec=websocket.query_params.get("input_codec"),
+        input_audio=audio_frontend.input_format.__dict__ if audio_frontend else None,
+        stt_sample_rate=transcriber.config.sampling_rate,
+        today_datetime=session.state.get("today_datetime"),
+        restored=snapshot is not None,
+    )
+
+    text_history = TextHistory(outbound, session_id, synthesizer)
+    active_sessions[session_id] = session
+    text_histories[session_id] = text_history
 
     # Start tasks
-    agent_to_client_task = asyncio.create_task(agent_to_client_messaging(websocket, live_events))
+    outbound_task = asyncio.create_task(outbound.run())
+
+    agent_to_client_task = asyncio.create_task(agent_to_client_messaging(outbound, live_events, session_id, text_history))
     
-    client_to_agent_task = asyncio.create_task(client_to_agent_messaging(websocket, live_request_queue))
+    client_to_agent_task = asyncio.create_task(client_to_agent_messaging(websocket, outbound, live_request_queue, session, transcriber, audio_frontend))
 
-    disconnect_agent_task = asyncio.create_task(disconnect_agent(websocket, session, session_id, session_id))
+    disconnect_agent_task = asyncio.create_task(disconnect_agent(websocket, outbound, session, session_id, session_id))
 
-    show_user_preffered_details_task = asyncio.create_task(show_user_preffered_details(websocket, session))
+    show_user_preffered_details_task = asyncio.create_task(show_user_preffered_details(outbound, session))
 
+    stream_search_results_task = asyncio.create_task(stream_search_results(outbound, session))
 
-    await asyncio.gather(agent_to_client_task, client_to_agent_task, disconnect_agent_task, show_user_preffered_details_task)
+    tasks = [agent_to_client_task, client_to_agent_task, disconnect_agent_task, show_user_preffered_details_task, stream_search_results_task, outbound_task]
+    connection_tasks[session_id] = tasks
+
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        # gather returns on the first failure, e.g. the client disconnecting, the other tasks would wait forever
+        for task in tasks:
+            task.cancel()
+        outbound.close()
+        active_sessions.pop(session_id, None)
+        text_histories.pop(session_id, None)
+        connection_tasks.pop(session_id, None)
+        drain.turn_finished(session_id)
+        await session_service.delete_session(app_name=APP_NAME, user_id=session_id, session_id=session_id)
+        outbound_queues.pop(session_id, None)
+        end_session(session_id)
+        search_results.drop_session(session_id)
+        reference_data.release_session(session_id)
+        end_trace(session_id)
+        unbind_session(session_id)
 
     # Disconnected
     logger.info(f"Client #{session_id} disconnected")
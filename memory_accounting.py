@@ -0,0 +1,191 @@
+import json
+import logging
+import os
+import resource
+import tracemalloc
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+MEMORY_TOP_N = int(os.getenv("MEMORY_TOP_N", "10"))
+# The heap profiling endpoint is only served when this is set
+ADMIN_DEBUG_ENABLED = os.getenv("ADMIN_DEBUG_ENABLED", "false").lower() == "true"
+ADMIN_DEBUG_TOKEN = os.getenv("ADMIN_DEBUG_TOKEN", "")
+TRACEMALLOC_FRAMES = int(os.getenv("TRACEMALLOC_FRAMES", "10"))
+# Events serialised per session, the size of longer histories is extrapolated from these
+MEMORY_EVENT_SAMPLE = int(os.getenv("MEMORY_EVENT_SAMPLE", "50"))
+
+
+@dataclass
+class SessionFootprint:
+    session_id: str
+    state_bytes: int = 0
+    events: int = 0
+    event_bytes: int = 0
+    search_results_bytes: int = 0
+    outbound_bytes: int = 0
+    text_history_bytes: int = 0
+    tasks: int = 0
+
+    @property
+    def total_bytes(self) -> int:
+        return self.state_bytes + self.event_bytes + self.search_results_bytes + self.outbound_bytes + self.text_history_bytes
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {**asdict(self), "total_bytes": self.total_bytes}
+
+
+def _json_size(value: Any) -> int:
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError, RuntimeError):
+        # RuntimeError: the dict changed size, the estimate runs in a worker thread
+        return 0
+
+
+def _event_bytes(events: List[Any], sample: int) -> int:
+    """Serialised size of an event history, from an evenly spaced sample of at most sample events."""
+    if not events:
+        return 0
+    step = max(1, len(events) // sample)
+    sampled = events[::step]
+    size = sum(len(event.model_dump_json(exclude_none=True)) for event in sampled)
+    return size * len(events) // len(sampled)
+
+
+def estimate_session(
+    session,
+    search_results_bytes: int = 0,
+    outbound=None,
+    text_history=None,
+    tasks: Iterable = (),
+) -> SessionFootprint:
+    """
+    Estimate the memory held for one session, as serialised sizes.
+
+    Serialised sizes undercount Python object overhead but rank sessions the
+    same way, which is what finding the heavy ones needs. Long histories are
+    sized from a sample of their events. Shared reference data is not
+    attributed to sessions. Blocking, run it in a worker thread.
+
+    Args:
+        session: The ADK session, its state and event history.
+        search_results_bytes: Size of the session's cached result sets.
+        outbound: The session's OutboundQueue.
+        text_history: The session's TextHistory buffer.
+        tasks: The per-connection tasks, only those still running are counted.
+    """
+    events = list(session.events)
+    return SessionFootprint(
+        session_id=session.id,
+        state_bytes=_json_size(session.state),
+        events=len(events),
+        event_bytes=_event_bytes(events, MEMORY_EVENT_SAMPLE),
+        search_results_bytes=search_results_bytes,
+        outbound_bytes=outbound.stats()["queued_bytes"] if outbound is not None else 0,
+        text_history_bytes=len(text_history.get_text().encode()) if text_history is not None else 0,
+        tasks=sum(1 for task in tasks if not task.done()),
+    )
+
+
+def summarise(footprints: List[SessionFootprint], top: int = MEMORY_TOP_N) -> Dict[str, Any]:
+    """
+    Totals over all sessions and the top sessions by estimated footprint.
+    """
+    totals: Dict[str, int] = {}
+    for footprint in footprints:
+        for key, value in footprint.to_dict().items():
+            if key != "session_id":
+                totals[key] = totals.get(key, 0) + value
+    heaviest = sorted(footprints, key=lambda footprint: footprint.total_bytes, reverse=True)[:top]
+    return {
+        "sessions": len(footprints),
+        "totals": totals,
+        "top": [footprint.to_dict() for footprint in heaviest],
+    }
+
+
+def process_rss() -> int:
+    """Resident set size of the process in bytes, the peak where the current one is unavailable."""
+    try:
+        with open("/proc/self/statm", "r") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def admin_allowed(headers) -> bool:
+    """Whether a request may use the debug endpoints, see ADMIN_DEBUG_ENABLED and ADMIN_DEBUG_TOKEN."""
+    if not ADMIN_DEBUG_ENABLED:
+        return False
+    return not ADMIN_DEBUG_TOKEN or headers.get("x-admin-token") == ADMIN_DEBUG_TOKEN
+
+
+class HeapProfiler:
+    """
+    On-demand tracemalloc snapshot diffs.
+
+    The first diff() starts tracing and takes the baseline, each later call
+    reports allocations grown since the previous call. Tracing slows every
+    allocation down, stop() it once done.
+    """
+
+    GROUP_BY = ("lineno", "filename", "traceback")
+
+    def __init__(self, frames: int = TRACEMALLOC_FRAMES):
+        self.frames = frames
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+
+    def _snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+
+    def diff(self, top: int = 25, group_by: str = "lineno") -> Dict[str, Any]:
+        """
+        Allocation growth since the previous call.
+
+        Args:
+            top: Number of locations to report.
+            group_by: "lineno", "filename" or "traceback".
+        """
+        if group_by not in self.GROUP_BY:
+            raise ValueError(f"group_by must be one of {', '.join(self.GROUP_BY)}")
+        if not tracemalloc.is_tracing() or self._baseline is None:
+            tracemalloc.start(self.frames)
+            self._baseline = self._snapshot()
+            logger.info("tracemalloc started")
+            return {"status": "started", "frames": self.frames}
+
+        snapshot = self._snapshot()
+        stats = snapshot.compare_to(self._baseline, group_by)
+        self._baseline = snapshot
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            "status": "diff",
+            "traced_bytes": current,
+            "traced_peak_bytes": peak,
+            "top": [
+                {
+                    "location": stat.traceback.format() if group_by == "traceback" else str(stat.traceback[0]),
+                    "size_diff": stat.size_diff,
+                    "size": stat.size,
+                    "count_diff": stat.count_diff,
+                    "count": stat.count,
+                }
+                for stat in stats[:top]
+            ],
+        }
+
+    def stop(self) -> None:
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+            logger.info("tracemalloc stopped")
+        self._baseline = None
+
+
+heap_profiler = HeapProfiler()
@@ -0,0 +1,207 @@
+import asyncio
+import heapq
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from enum import IntEnum
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class MessagePriority(IntEnum):
+    CONTROL = 0
+    TEXT = 1
+    PREFERENCES = 2
+    AUDIO = 3
+
+
+@dataclass
+class OutboundQueueConfig:
+    max_bytes: int = int(os.getenv("OUTBOUND_MAX_BYTES", str(2 * 1024 * 1024)))
+    max_audio_age: float = float(os.getenv("OUTBOUND_MAX_AUDIO_AGE", "8.0"))
+    drain_timeout: float = float(os.getenv("OUTBOUND_DRAIN_TIMEOUT", "5.0"))
+
+
+@dataclass(order=True)
+class _Entry:
+    priority: int
+    seq: int
+    enqueued_at: float
+    payload: str
+    fallback: Optional[str] = None
+
+    @property
+    def size(self) -> int:
+        return len(self.payload)
+
+
+class OutboundQueue:
+    """
+    Single writer for one websocket connection.
+
+    Messages are serialised once when queued and written in priority order
+    (control > text > preferences > audio), FIFO within a priority. Queued
+    bytes are capped: when the cap is hit the oldest audio is degraded to its
+    text-only fallback, and audio older than max_audio_age is never sent.
+    """
+
+    def __init__(self, websocket, config: Optional[OutboundQueueConfig] = None):
+        self.websocket = websocket
+        self.config = config or OutboundQueueConfig()
+        self._heap: List[_Entry] = []
+        self._bytes = 0
+        self._seq = 0
+        self._wakeup = asyncio.Event()
+        self._empty = asyncio.Event()
+        self._empty.set()
+        self._closed = False
+
+        self.sent = 0
+        self.sent_bytes = 0
+        self.degraded_audio = 0
+        self.dropped_audio = 0
+        self.max_depth = 0
+        self.max_queued_bytes = 0
+
+    def send(self, message: Dict[str, Any], priority: MessagePriority, fallback: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Queue a message for the client.
+
+        Args:
+            message: JSON-serialisable message.
+            priority: Delivery priority of the message.
+            fallback: Smaller message sent instead if an audio message has to be degraded.
+        """
+        if self._closed:
+            return
+        entry = _Entry(
+            priority=int(priority),
+            seq=self._seq,
+            enqueued_at=time.monotonic(),
+            payload=json.dumps(message),
+            fallback=json.dumps(fallback) if fallback is not None else None,
+        )
+        self._seq += 1
+        heapq.heappush(self._heap, entry)
+        self._bytes += entry.size
+        self._enforce_cap()
+
+        self.max_depth = max(self.max_depth, len(self._heap))
+        self.max_queued_bytes = max(self.max_queued_bytes, self._bytes)
+        self._empty.clear()
+        self._wakeup.set()
+
+    def drop_audio(self) -> int:
+        """
+        Drop all queued audio, e.g. when the agent was interrupted.
+
+        Returns:
+            int: Number of audio messages dropped.
+        """
+        kept = [entry for entry in self._heap if entry.priority != MessagePriority.AUDIO]
+        dropped = len(self._heap) - len(kept)
+        if dropped:
+            heapq.heapify(kept)
+            self._heap = kept
+            self._bytes = sum(entry.size for entry in kept)
+            self.dropped_audio += dropped
+            if not self._heap:
+                self._empty.set()
+        return dropped
+
+    def _enforce_cap(self) -> None:
+        """Degrade, then drop, the oldest queued audio until under the byte cap."""
+        if self._bytes <= self.config.max_bytes:
+            return
+        audio = sorted(
+            (entry for entry in self._heap if entry.priority == MessagePriority.AUDIO),
+            key=lambda entry: entry.seq,
+        )
+        for entry in audio:
+            if self._bytes <= self.config.max_bytes:
+                return
+            if entry.fallback is not None:
+                self._bytes -= entry.size - len(entry.fallback)
+                entry.payload, entry.fallback = entry.fallback, None
+                self.degraded_audio += 1
+        if self._bytes <= self.config.max_bytes:
+            return
+        # Fallbacks alone are over the cap, drop audio outright; control and
+        # text messages are always kept.
+        for entry in audio:
+            if self._bytes <= self.config.max_bytes:
+                break
+            self._heap.remove(entry)
+            self._bytes -= entry.size
+            self.dropped_audio += 1
+        heapq.heapify(self._heap)
+        if self._bytes > self.config.max_bytes:
+            logger.warning(f"Outbound queue over cap with non-audio messages: {self._bytes} bytes")
+
+    async def run(self) -> None:
+        """Write queued messages to the websocket until closed."""
+        try:
+            while not self._closed:
+                if not self._heap:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                entry = heapq.heappop(self._heap)
+                self._bytes -= entry.size
+                payload = entry.payload
+                if (
+                    entry.priority == MessagePriority.AUDIO
+                    and time.monotonic() - entry.enqueued_at > self.config.max_audio_age
+                ):
+                    payload = entry.fallback
+                    self.degraded_audio += 1
+                if payload is not None:
+                    await self.websocket.send_text(payload)
+                    self.sent += 1
+                    self.sent_bytes += len(payload)
+                if not self._heap:
+                    self._empty.set()
+        except Exception as e:
+            logger.error(f"Error in outbound queue writer: {e}")
+        finally:
+            self._closed = True
+            self._empty.set()
+
+    async def drain(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every queued message has been written.
+
+        Returns:
+            bool: True if the queue drained before the timeout.
+        """
+        timeout = self.config.drain_timeout if timeout is None else timeout
+        try:
+            await asyncio.wait_for(self._empty.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def close(self) -> None:
+        self._closed = True
+        self._heap.clear()
+        self._bytes = 0
+        self._empty.set()
+        self._wakeup.set()
+
+    def stats(self) -> Dict[str, Any]:
+        depth = {priority.name.lower(): 0 for priority in MessagePriority}
+        for entry in self._heap:
+            depth[MessagePriority(entry.priority).name.lower()] += 1
+        return {
+            "depth": depth,
+            "queued_bytes": self._bytes,
+            "max_depth": self.max_depth,
+            "max_queued_bytes": self.max_queued_bytes,
+            "sent": self.sent,
+            "sent_bytes": self.sent_bytes,
+            "degraded_audio": self.degraded_audio,
+            "dropped_audio": self.dropped_audio,
+        }
@@ -0,0 +1,261 @@
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "50000"))
+# Only trust X-Forwarded-For behind a proxy that sets it, clients connecting directly could forge it
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "false").lower() == "true"
+# Proxies in front of the app, the address is taken this many entries from the right of X-Forwarded-For
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "1"))
+# Supabase's HS256 JWT secret, without it the user of a token cannot be trusted
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET", "")
+
+
+@dataclass
+class RateLimitConfig:
+    rate: float = 1.0
+    burst: float = 10.0
+    enabled: bool = True
+    # An IP address may be shared by many anonymous users, e.g. behind carrier NAT, its bucket is this much larger
+    ip_factor: float = 20.0
+
+    @classmethod
+    def from_env(cls, name: str, **defaults) -> "RateLimitConfig":
+        """
+        Build a config from RATE_LIMIT_<NAME>_* environment variables.
+
+        Args:
+            name: The limit name, e.g. "messages".
+            defaults: Per-limit defaults overriding the class defaults.
+        """
+        config = cls(**defaults)
+        prefix = f"RATE_LIMIT_{name.upper()}_"
+        config.rate = float(os.getenv(prefix + "RATE", config.rate))
+        config.burst = float(os.getenv(prefix + "BURST", config.burst))
+        config.enabled = os.getenv(prefix + "ENABLED", str(config.enabled)).lower() == "true"
+        config.ip_factor = float(os.getenv(prefix + "IP_FACTOR", config.ip_factor))
+        return config
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount tokens are available, 0 if they are now."""
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+
+class RateLimited(Exception):
+    """Raised when a client has used up a rate limit."""
+
+    def __init__(self, limit: str, retry_after: float):
+        super().__init__(f"{limit} rate limited, retry after {retry_after:.1f}s")
+        self.limit = limit
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """
+    Token buckets for one kind of client work, one bucket per client key.
+
+    A client may be identified by several keys, e.g. an anonymous one by
+    its session and its IP, and is only allowed when every one of its buckets
+    has the tokens, so opening new sessions does not get around a limit.
+    IP buckets are ip_factor times larger, they are shared by everyone
+    behind the address. Buckets of the least recently seen keys are dropped
+    beyond max_keys.
+    """
+
+    def __init__(self, name: str, config: RateLimitConfig, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.name = name
+        self.config = config
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self.allowed = 0
+        self.limited = 0
+
+    def _bucket(self, key: str) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            factor = self.config.ip_factor if key.startswith("ip:") else 1.0
+            bucket = self._buckets[key] = TokenBucket(self.config.rate * factor, self.config.burst * factor)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def acquire(self, keys: Iterable[str], amount: float = 1.0) -> float:
+        """
+        Take amount tokens from the buckets of every key, or none if any is short.
+
+        Args:
+            keys: The client's keys, e.g. from client_keys().
+            amount: Tokens to take, e.g. seconds of audio. Capped at the per-client burst size.
+
+        Returns:
+            float: 0 if allowed, otherwise the seconds to wait before retrying.
+        """
+        if not self.config.enabled:
+            return 0.0
+        amount = min(amount, self.config.burst)
+        now = time.monotonic()
+        buckets = [self._bucket(key) for key in keys]
+        for bucket in buckets:
+            bucket.refill(now)
+        retry_after = max((bucket.wait_time(amount) for bucket in buckets), default=0.0)
+        if retry_after > 0:
+            self.limited += 1
+            return retry_after
+        for bucket in buckets:
+            bucket.tokens -= amount
+        self.allowed += 1
+        return 0.0
+
+    def check(self, keys: Iterable[str], amount: float = 1.0) -> None:
+        """
+        Like acquire, raising instead of returning the wait.
+
+        Raises:
+            RateLimited: If the client is over the limit.
+        """
+        retry_after = self.acquire(keys, amount)
+        if retry_after > 0:
+            raise RateLimited(self.name, retry_after)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rate": self.config.rate,
+            "burst": self.config.burst,
+            "enabled": self.config.enabled,
+            "keys": len(self._buckets),
+            "allowed": self.allowed,
+            "limited": self.limited,
+        }
+
+
+_rate_limiters: Dict[str, RateLimiter] = {}
+
+
+def get_rate_limiter(name: str, **defaults) -> RateLimiter:
+    """
+    Get the process-wide rate limiter for a kind of work, creating it on first use.
+
+    Args:
+        name: The limit name.
+        defaults: Config defaults used when the limiter is created.
+    """
+    if name not in _rate_limiters:
+        _rate_limiters[name] = RateLimiter(name, RateLimitConfig.from_env(name, **defaults))
+    return _rate_limiters[name]
+
+
+def rate_limit_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: limiter.stats() for name, limiter in _rate_limiters.items()}
+
+
+def rate_limited_message(error: RateLimited) -> Dict[str, Any]:
+    """The 429 style control message telling a client to slow down."""
+    return {
+        "error": "rate_limited",
+        "status": 429,
+        "limit": error.limit,
+        "retry_after": round(error.retry_after, 1),
+    }
+
+
+def _b64decode(part: str) -> bytes:
+    return base64.urlsafe_b64decode(part + "=" * (-len(part) % 4))
+
+
+def _token_subject(authorization: Optional[str]) -> Tuple[Optional[str], bool]:
+    """
+    The sub claim of a JWT and whether the token was verified.
+
+    With SUPABASE_JWT_SECRET set the HS256 signature and expiry are checked
+    and a token failing them has no subject. Without it the claim is read
+    unverified, it can only group a user's sessions, not vouch for them.
+    """
+    if not authorization:
+        return None, False
+    token = authorization.split()[-1]
+    parts = token.split(".")
+    if len(parts) != 3:
+        return None, False
+    try:
+        header = json.loads(_b64decode(parts[0]))
+        claims = json.loads(_b64decode(parts[1]))
+        signature = _b64decode(parts[2])
+    except (ValueError, TypeError):
+        return None, False
+    if not isinstance(claims, dict):
+        return None, False
+    verified = False
+    if SUPABASE_JWT_SECRET:
+        expected = hmac.new(SUPABASE_JWT_SECRET.encode(), f"{parts[0]}.{parts[1]}".encode(), hashlib.sha256).digest()
+        if not isinstance(header, dict) or header.get("alg") != "HS256" or not hmac.compare_digest(signature, expected):
+            return None, False
+        if isinstance(claims.get("exp"), (int, float)) and claims["exp"] < time.time():
+            return None, False
+        verified = True
+    subject = claims.get("sub")
+    return (str(subject) if subject else None), verified
+
+
+def client_keys(websocket, session_id: str) -> List[str]:
+    """
+    Rate limit keys of a websocket client. A verified user is keyed by the
+    user alone, users sharing an address through a proxy or carrier NAT are
+    not throttled together. Anyone else is keyed by their user, or their
+    session if the user is unknown, and their IP address, so neither new
+    sessions nor forged tokens get around a limit.
+    """
+    subject, verified = _token_subject(websocket.query_params.get("authorization"))
+    if subject and verified:
+        return [f"user:{subject}"]
+    keys = [f"user:{subject}" if subject else f"session:{session_id}"]
+    address = websocket.client.host if websocket.client else None
+    forwarded_for = [part.strip() for part in websocket.headers.get("x-forwarded-for", "").split(",") if part.strip()]
+    if TRUST_FORWARDED_FOR and forwarded_for:
+        # Entries left of the ones our proxies appended are whatever the client sent
+        address = forwarded_for[-min(TRUSTED_PROXY_HOPS, len(forwarded_for))]
+    if address:
+        keys.append(f"ip:{address}")
+    return keys
+
+
+# Keys of the connected sessions, for limits checked away from the websocket such as in tools
+_session_keys: Dict[str, List[str]] = {}
+
+
+def bind_session(session_id: str, keys: List[str]) -> None:
+    _session_keys[session_id] = keys
+
+
+def session_keys(session_id: Optional[str]) -> List[str]:
+    if not session_id:
+        return []
+    return _session_keys.get(session_id) or [f"session:{session_id}"]
+
+
+def unbind_session(session_id: str) -> None:
+    _session_keys.pop(session_id, None)
@@ -0,0 +1,287 @@
+"""Drain mode and session snapshots handed from a stopping process to the next one."""
+
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import secrets
+import signal
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = os.getenv("SESSION_SNAPSHOT_DIR", "session_snapshots")
+# Snapshots not picked up by a reconnect within this many seconds are discarded
+SNAPSHOT_TTL = float(os.getenv("SESSION_SNAPSHOT_TTL", "300"))
+# How long a drain waits for the turns in progress before snapshotting anyway
+DRAIN_DEADLINE = float(os.getenv("DRAIN_DEADLINE", "20"))
+SNAPSHOT_VERSION = 2
+
+
+@dataclass
+class SessionSnapshot:
+    session_id: str
+    user_id: str
+    # Client key of the connection, see rate_limits.client_keys
+    owner: str
+    # SHA-256 of the handover token given to the client, see new_handover_token
+    token_hash: str
+    state: Dict[str, Any]
+    # The compacted history, as Event JSON
+    events: List[Dict[str, Any]]
+    # The result set on the user's screen: search_id, total and cards
+    search: Optional[Dict[str, Any]] = None
+    # Shared reference maps the state points at, by state key
+    references: Dict[str, Any] = field(default_factory=dict)
+    created_at: float = field(default_factory=time.time)
+    version: int = SNAPSHOT_VERSION
+
+
+def new_handover_token() -> str:
+    """A single-use secret handed to the client with the reconnect message, it restores the snapshot."""
+    return secrets.token_urlsafe(24)
+
+
+def _token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def snapshot_session(
+    session,
+    owner: str,
+    token: str,
+    search: Optional[Dict[str, Any]] = None,
+    references: Optional[Dict[str, Any]] = None,
+) -> SessionSnapshot:
+    """
+    Snapshot an ADK session.
+
+    Args:
+        session: The session, its history is already compacted by CustomSessionService.
+        owner: Client key of the connection, only a reconnect with the same key may restore it.
+        token: The handover token the client is given, only its hash is stored.
+        search: The result set on the user's screen.
+        references: Shared maps the state points at.
+    """
+    return SessionSnapshot(
+        session_id=session.id,
+        user_id=session.user_id,
+        owner=owner,
+        token_hash=_token_hash(token),
+        state=json.loads(json.dumps(dict(session.state), default=str)),
+        events=[event.model_dump(mode="json", exclude_none=True) for event in session.events if not event.partial],
+        search=search,
+        references=references or {},
+    )
+
+
+class SnapshotStore:
+    """
+    Session snapshots as JSON files in a local directory shared by the old
+    and the new process. A snapshot is taken at most once, restoring it
+    deletes it. Session ids are not secret, restoring needs the handover
+    token the old process gave its client as well as the same client key.
+    """
+
+    def __init__(self, directory: str = SNAPSHOT_DIR, ttl: float = SNAPSHOT_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        self.saved = 0
+        self.restored = 0
+        self.expired = 0
+        self.rejected = 0
+        self.failed = 0
+
+    def _path(self, session_id: str) -> str:
+        # Session ids come from the URL, keep them from escaping the directory
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", session_id)[:64]
+        digest = hashlib.sha1(session_id.encode()).hexdigest()[:12]
+        return os.path.join(self.directory, f"{name}-{digest}.json")
+
+    def save(self, snapshot: SessionSnapshot) -> bool:
+        """Write a snapshot, replacing an older one of the session. Blocking."""
+        path = self._path(snapshot.session_id)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path + ".tmp", "w") as file:
+                json.dump(asdict(snapshot), file, separators=(",", ":"), default=str)
+            os.replace(path + ".tmp", path)
+        except (OSError, TypeError, ValueError) as e:
+            self.failed += 1
+            logger.error(f"Saving the snapshot of session {snapshot.session_id} failed: {e}")
+            return False
+        self.saved += 1
+        return True
+
+    def take(self, session_id: str, owner: str, token: Optional[str]) -> Optional[SessionSnapshot]:
+        """
+        Remove and return the snapshot of a session, if there is a fresh one. Blocking.
+
+        Args:
+            session_id: The session reconnecting.
+            owner: Client key of the reconnecting connection.
+            token: The handover token the client presented, None for a new connection.
+        """
+        if not token:
+            return None
+        path = self._path(session_id)
+        try:
+            with open(path, "r") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            self.failed += 1
+            logger.error(f"Reading the snapshot of session {session_id} failed: {e}")
+            return None
+
+        if data.get("session_id") != session_id or data.get("version") != SNAPSHOT_VERSION:
+            self.failed += 1
+            return None
+        token_matches = hmac.compare_digest(data.get("token_hash", ""), _token_hash(token))
+        if data.get("owner") != owner or not token_matches:
+            # Someone else's session, the snapshot is left for its owner or to expire
+            self.rejected += 1
+            logger.warning(f"Snapshot of session {session_id} refused, wrong owner or handover token")
+            return None
+        self._remove(path)
+        if time.time() - data.get("created_at", 0) > self.ttl:
+            self.expired += 1
+            return None
+        self.restored += 1
+        return SessionSnapshot(**data)
+
+    def _remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def prune(self) -> int:
+        """Delete the snapshots older than ttl, e.g. of users who never came back."""
+        if not os.path.isdir(self.directory):
+            return 0
+        pruned = 0
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(path) > self.ttl:
+                    os.remove(path)
+                    pruned += 1
+            except OSError:
+                continue
+        self.expired += pruned
+        return pruned
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "directory": self.directory,
+            "saved": self.saved,
+            "restored": self.restored,
+            "expired": self.expired,
+            "rejected": self.rejected,
+            "failed": self.failed,
+        }
+
+
+class Drain:
+    """
+    Drain mode for restarts and rolling deploys.
+
+    install() chains a SIGTERM handler in front of the server's own. On
+    SIGTERM the app stops taking new connections and turns, waits up to
+    deadline for the turns in progress to complete, hands its sessions over
+    with the handoff callback and only then passes the signal on, so the
+    server shuts down after the handoff. A second SIGTERM is passed on
+    straight away.
+    """
+
+    def __init__(self, deadline: float = DRAIN_DEADLINE):
+        self.deadline = deadline
+        self.draining = False
+        self.started_at: Optional[float] = None
+        self.turns_cut_short = 0
+        self._turns: set = set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._task: Optional[asyncio.Task] = None
+
+    def turn_started(self, session_id: str) -> None:
+        self._turns.add(session_id)
+        self._idle.clear()
+
+    def turn_finished(self, session_id: str) -> None:
+        self._turns.discard(session_id)
+        if not self._turns:
+            self._idle.set()
+
+    def install(self, handoff: Callable[[], Awaitable[None]]) -> None:
+        """
+        Chain the SIGTERM handler, call from the running loop at startup.
+
+        Args:
+            handoff: Snapshots the sessions and tells their clients to reconnect.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            previous = signal.getsignal(signal.SIGTERM)
+
+            def on_sigterm(signum, frame) -> None:
+                if self.draining:
+                    _pass_on(previous, signum, frame)
+                    return
+                self.draining = True
+                self.started_at = time.monotonic()
+                loop.call_soon_threadsafe(self._start, handoff, lambda: _pass_on(previous, signum, frame))
+
+            signal.signal(signal.SIGTERM, on_sigterm)
+        except ValueError:
+            # Signal handlers can only be set from the main thread, e.g. not under some test runners
+            logger.warning("Drain mode is unavailable, not running in the main thread")
+
+    def _start(self, handoff: Callable[[], Awaitable[None]], stop: Callable[[], None]) -> None:
+        self._task = asyncio.ensure_future(self._run(handoff, stop))
+
+    async def _run(self, handoff: Callable[[], Awaitable[None]], stop: Callable[[], None]) -> None:
+        logger.info(f"Draining, waiting up to {self.deadline:.0f}s for {len(self._turns)} turns in progress")
+        try:
+            # asyncio.wait rather than wait_for, which can swallow a cancel that races the wake up
+            waiter = asyncio.ensure_future(self._idle.wait())
+            try:
+                await asyncio.wait({waiter}, timeout=self.deadline)
+            finally:
+                waiter.cancel()
+            self.turns_cut_short = len(self._turns)
+            await handoff()
+        except Exception as e:
+            logger.error(f"Drain failed: {e}")
+        finally:
+            logger.info(f"Drained in {time.monotonic() - self.started_at:.1f}s, {self.turns_cut_short} turns cut short")
+            stop()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "draining": self.draining,
+            "seconds": round(time.monotonic() - self.started_at, 1) if self.started_at else None,
+            "deadline": self.deadline,
+            "turns_in_progress": len(self._turns),
+            "turns_cut_short": self.turns_cut_short,
+        }
+
+
+def _pass_on(previous, signum, frame) -> None:
+    """Hand a signal to the handler that was installed before ours."""
+    if callable(previous):
+        previous(signum, frame)
+    elif previous == signal.SIG_DFL:
+        signal.signal(signum, signal.SIG_DFL)
+        signal.raise_signal(signum)
+
+
+snapshot_store = SnapshotStore()
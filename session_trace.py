@@ -0,0 +1,168 @@
+"""Opt-in per-session traces, replayed offline with replay_trace.py."""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Traces are only written when TRACE_DIR is set
+TRACE_DIR = os.getenv("TRACE_DIR", "")
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(16 * 1024 * 1024)))
+TRACE_VERSION = 1
+# A tool call that never reaches the after-tool callback, e.g. the tool raised, is forgotten after this long
+TOOL_CALL_MAX_AGE = 600.0
+
+
+class TraceRecorder:
+    """
+    Appends the timeline of one session to a JSONL file.
+
+    Every line is {"t": seconds since the session started, "kind": ..., ...}.
+    Kinds written by the app are "session", "inbound", "stage", "agent_event",
+    "tool_call" and "upstream". Lines are buffered and flushed on close,
+    records beyond max_bytes are counted and dropped.
+    """
+
+    def __init__(self, session_id: str, path: str, max_bytes: int = TRACE_MAX_BYTES):
+        self.session_id = session_id
+        self.path = path
+        self.max_bytes = max_bytes
+        self.written = 0
+        self.dropped = 0
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+        self._file = open(path, "a", buffering=64 * 1024)
+
+    def record(self, kind: str, **fields) -> None:
+        """
+        Append a record, safe to call from worker threads.
+
+        Args:
+            kind: The record kind.
+            fields: JSON serialisable fields of the record.
+        """
+        line = json.dumps(
+            {"t": round(time.monotonic() - self._started, 4), "kind": kind, **fields},
+            separators=(",", ":"),
+            default=str,
+        )
+        with self._lock:
+            if self._file is None:
+                return
+            if self.written + len(line) + 1 > self.max_bytes:
+                self.dropped += 1
+                return
+            self._file.write(line + "\n")
+            self.written += len(line) + 1
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is None:
+                return
+            if self.dropped:
+                self._file.write(json.dumps({"t": round(time.monotonic() - self._started, 4), "kind": "truncated", "dropped": self.dropped}) + "\n")
+            self._file.close()
+            self._file = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"path": self.path, "bytes": self.written, "dropped": self.dropped}
+
+
+_recorders: Dict[str, TraceRecorder] = {}
+_tool_calls: Dict[str, Dict[str, Any]] = {}
+
+
+def start_trace(session_id: str, **fields) -> Optional[TraceRecorder]:
+    """
+    Start tracing a session if TRACE_DIR is set.
+
+    Args:
+        session_id: The session to trace.
+        fields: Extra fields of the opening "session" record, e.g. negotiated codecs.
+
+    Returns:
+        The recorder, or None when tracing is disabled.
+    """
+    if not TRACE_DIR:
+        return None
+    end_trace(session_id)
+    os.makedirs(TRACE_DIR, exist_ok=True)
+    # Session ids come from the URL, keep them from escaping TRACE_DIR
+    name = re.sub(r"[^A-Za-z0-9_.-]", "_", session_id)[:64]
+    path = os.path.join(TRACE_DIR, f"{name}-{int(time.time())}.jsonl")
+    recorder = TraceRecorder(session_id, path)
+    _recorders[session_id] = recorder
+    recorder.record("session", version=TRACE_VERSION, session_id=session_id, started_at=time.time(), **fields)
+    logger.info(f"Tracing session {session_id} to {path}")
+    return recorder
+
+
+def record(session_id: Optional[str], kind: str, **fields) -> None:
+    """Append a record to the session's trace, a no-op when it is not traced."""
+    recorder = _recorders.get(session_id) if session_id else None
+    if recorder is not None:
+        recorder.record(kind, **fields)
+
+
+def is_tracing(session_id: Optional[str]) -> bool:
+    return bool(session_id) and session_id in _recorders
+
+
+def end_trace(session_id: str) -> None:
+    recorder = _recorders.pop(session_id, None)
+    if recorder is not None:
+        recorder.close()
+    for call_id in [call_id for call_id, call in _tool_calls.items() if call["session_id"] == session_id]:
+        del _tool_calls[call_id]
+
+
+def trace_stats() -> Dict[str, Dict[str, Any]]:
+    return {session_id: recorder.stats() for session_id, recorder in _recorders.items()}
+
+
+def _state_snapshot(state: Any) -> Dict[str, Any]:
+    """The scalar values of a session state, enough to replay a tool call."""
+    values = state.to_dict() if hasattr(state, "to_dict") else dict(state)
+    return {key: value for key, value in values.items() if value is None or isinstance(value, (str, int, float, bool))}
+
+
+def trace_before_tool(tool, args: Dict[str, Any], tool_context) -> None:
+    """Agent before_tool_callback, notes the start time and state of a traced tool call."""
+    session_id = tool_context._invocation_context.session.id
+    if is_tracing(session_id):
+        now = time.monotonic()
+        # ADK 1.0 has no tool error callback, calls whose tool raised are only dropped by age
+        for call_id in [call_id for call_id, call in _tool_calls.items() if now - call["started"] > TOOL_CALL_MAX_AGE]:
+            del _tool_calls[call_id]
+        _tool_calls[tool_context.function_call_id] = {
+            "session_id": session_id,
+            "started": now,
+            "state": _state_snapshot(tool_context.state),
+        }
+    return None
+
+
+def trace_after_tool(tool, args: Dict[str, Any], tool_context, tool_response: Any) -> None:
+    """Agent after_tool_callback, records a traced tool call with its latency and response."""
+    call = _tool_calls.pop(tool_context.function_call_id, None)
+    if call is None:
+        return None
+    status = tool_response.get("status") if isinstance(tool_response, dict) else None
+    response = json.dumps(tool_response, default=str)
+    record(
+        tool_context._invocation_context.session.id,
+        "tool_call",
+        tool=tool.name,
+        args=args,
+        state=call["state"],
+        latency=round(time.monotonic() - call["started"], 4),
+        status=status,
+        response=json.loads(response),
+        response_bytes=len(response),
+    )
+    return None
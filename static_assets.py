@@ -0,0 +1,104 @@
+import gzip
+import hashlib
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+
+@dataclass
+class StaticAsset:
+    body: bytes
+    media_type: str
+    etag: str
+    cache_control: str
+    gzip_body: Optional[bytes] = None
+    br_body: Optional[bytes] = None
+
+
+def _accepts(accept_encoding: str, encoding: str) -> bool:
+    """Whether an Accept-Encoding header allows encoding with a non-zero q value."""
+    for token in accept_encoding.split(","):
+        name, _, params = token.partition(";")
+        if name.strip().lower() != encoding:
+            continue
+        params = params.strip().lower()
+        if params.startswith("q="):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+class StaticAssets:
+    """
+    Small assets loaded and compressed once, served from memory with strong
+    ETags so repeat page loads are answered with 304 Not Modified.
+    """
+
+    def __init__(self):
+        self._assets: Dict[str, StaticAsset] = {}
+
+    def add(self, path: str, body: bytes, media_type: str, cache_control: str = "no-cache") -> StaticAsset:
+        """
+        Register an asset, precompressing it.
+
+        Args:
+            path: The URL path the asset is served at.
+            body: The asset content.
+            media_type: The content type.
+            cache_control: The Cache-Control header, "no-cache" makes clients revalidate with the ETag.
+        """
+        asset = StaticAsset(
+            body=body,
+            media_type=media_type,
+            etag=hashlib.sha256(body).hexdigest()[:32],
+            cache_control=cache_control,
+        )
+        compressed = gzip.compress(body, compresslevel=9, mtime=0)
+        if len(compressed) < len(body):
+            asset.gzip_body = compressed
+        if brotli is not None:
+            compressed = brotli.compress(body, quality=11)
+            if len(compressed) < len(body):
+                asset.br_body = compressed
+        self._assets[path] = asset
+        return asset
+
+    def add_file(self, path: str, file_path: str, media_type: str, cache_control: str = "no-cache") -> StaticAsset:
+        with open(file_path, "rb") as file:
+            return self.add(path, file.read(), media_type, cache_control)
+
+    def response(self, path: str, request: Request) -> Response:
+        asset = self._assets.get(path)
+        if asset is None:
+            return Response(status_code=404)
+
+        accept_encoding = request.headers.get("accept-encoding", "")
+        body, encoding = asset.body, None
+        if asset.br_body is not None and _accepts(accept_encoding, "br"):
+            body, encoding = asset.br_body, "br"
+        elif asset.gzip_body is not None and _accepts(accept_encoding, "gzip"):
+            body, encoding = asset.gzip_body, "gzip"
+
+        # Each encoding is a different representation and gets its own strong ETag
+        etag = f'"{asset.etag}-{encoding}"' if encoding else f'"{asset.etag}"'
+        headers = {
+            "ETag": etag,
+            "Cache-Control": asset.cache_control,
+            "Vary": "Accept-Encoding",
+        }
+        if_none_match = request.headers.get("if-none-match", "")
+        if if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(content=body, media_type=asset.media_type, headers=headers)
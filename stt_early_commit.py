@@ -0,0 +1,208 @@
+import asyncio
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+from google_transcriber import GoogleTranscriber, Transcription
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+_UNITS = ("zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine")
+_TEENS = ("ten", "eleven", "twelve", "thirteen", "fourteen", "fifteen", "sixteen", "seventeen", "eighteen", "nineteen")
+_TENS = ("twenty", "thirty", "forty", "fifty", "sixty", "seventy", "eighty", "ninety")
+_ORDINALS = (
+    "first", "second", "third", "fourth", "fifth", "sixth", "seventh", "eighth", "ninth",
+    "tenth", "eleventh", "twelfth", "thirteenth", "fourteenth", "fifteenth", "sixteenth",
+    "seventeenth", "eighteenth", "nineteenth", "twentieth", "thirtieth", "fortieth", "fiftieth",
+    "sixtieth", "seventieth", "eightieth", "ninetieth", "hundredth", "thousandth",
+)
+# Compounds such as "twenty-fifth" are split into their words by _words
+NUMBER_WORDS = {*_UNITS, *_TEENS, *_TENS, *_ORDINALS, "hundred", "thousand", "lakh", "dozen", "half", "double"}
+# 1st, 2nd, 25th, read as the number itself
+_ORDINAL_SUFFIX = re.compile(r"^(\d+)(st|nd|rd|th)$")
+
+
+@dataclass
+class EarlyCommitConfig:
+    enabled: bool = os.getenv("STT_EARLY_COMMIT_ENABLED", "true").lower() == "true"
+    # Lowest interim stability that may be committed
+    min_stability: float = float(os.getenv("STT_EARLY_COMMIT_STABILITY", "0.8"))
+    # Trailing silence after the hypothesis, or time without a newer hypothesis, before committing
+    silence: float = float(os.getenv("STT_EARLY_COMMIT_SILENCE", "0.3"))
+    min_words: int = int(os.getenv("STT_EARLY_COMMIT_MIN_WORDS", "2"))
+    # Word error rate between the committed and final transcript above which the commit is retracted
+    max_word_error: float = float(os.getenv("STT_EARLY_COMMIT_MAX_WORD_ERROR", "0.2"))
+
+
+@dataclass
+class TurnTranscript:
+    final: str
+    committed: Optional[str] = None
+    retracted: bool = False
+    # The recognizer failed after the early commit, final is the committed text
+    failed: bool = False
+
+
+@dataclass
+class EarlyCommitStats:
+    turns: int = 0
+    early_commits: int = 0
+    confirmed: int = 0
+    retracted: int = 0
+    failed_after_commit: int = 0
+    # Time from the early commit to the final transcript, what the agent turn started sooner by
+    seconds_saved: float = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            **vars(self),
+            "seconds_saved": round(self.seconds_saved, 3),
+            "retraction_rate": round(self.retracted / self.early_commits, 3) if self.early_commits else 0.0,
+        }
+
+
+early_commit_stats = EarlyCommitStats()
+
+
+def _words(text: str) -> List[str]:
+    return [_ORDINAL_SUFFIX.sub(r"\1", word) for word in re.findall(r"[a-z0-9']+", text.lower())]
+
+
+def word_error(reference: List[str], hypothesis: List[str]) -> float:
+    """Word level edit distance between two transcripts, relative to the longer one."""
+    previous = list(range(len(hypothesis) + 1))
+    for i, word in enumerate(reference, 1):
+        current = [i]
+        for j, other in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (word != other)))
+        previous = current
+    return previous[-1] / max(len(reference), len(hypothesis), 1)
+
+
+def materially_different(committed: str, final: str, max_word_error: float) -> bool:
+    """
+    Whether the final transcript changes the meaning of the committed one.
+    Numbers carry dates and passenger counts, any change to them is material.
+    """
+    committed_words, final_words = _words(committed), _words(final)
+    numbers = lambda words: [word for word in words if word.isdigit() or word in NUMBER_WORDS]
+    if numbers(committed_words) != numbers(final_words):
+        return True
+    return word_error(committed_words, final_words) > max_word_error
+
+
+async def _hypotheses(transcriber: GoogleTranscriber, audio_bytes: bytes, results: asyncio.Queue) -> None:
+    """Run the blocking recognizer in a worker thread, handing its hypotheses to the loop."""
+    loop = asyncio.get_running_loop()
+
+    def put(item) -> None:
+        try:
+            loop.call_soon_threadsafe(results.put_nowait, item)
+        except RuntimeError:
+            # The loop is gone, nobody is waiting for the result any more
+            pass
+
+    def pump() -> None:
+        try:
+            for transcription in transcriber.stream_hypotheses(iter([audio_bytes])):
+                put(transcription)
+        except Exception as e:
+            put(e)
+        finally:
+            put(_DONE)
+
+    await asyncio.to_thread(pump)
+
+
+async def transcribe_turn(
+    audio_bytes: bytes,
+    transcriber: GoogleTranscriber,
+    on_early_commit: Optional[Callable[[str], None]] = None,
+    audio_seconds: Optional[float] = None,
+    config: Optional[EarlyCommitConfig] = None,
+) -> TurnTranscript:
+    """
+    Transcribe one utterance, committing a stable interim hypothesis early.
+
+    Once an interim hypothesis is at least min_stability stable and is
+    followed by silence, either trailing silence in the audio or no newer
+    hypothesis for that long, it is passed to on_early_commit while the
+    recognizer is still finalising.
+
+    Args:
+        audio_bytes: The utterance in the transcriber's encoding.
+        transcriber: The transcriber.
+        on_early_commit: Called at most once with the committed text, None disables early commit.
+        audio_seconds: Duration of the audio, used to measure trailing silence.
+        config: Early commit thresholds.
+
+    Returns:
+        TurnTranscript: The final transcript, what was committed early and whether the final one differs materially.
+            If the recognizer fails after an early commit the committed text stands, the agent is already answering it.
+
+    Raises:
+        Exception: The recognizer's error, when nothing was committed early.
+    """
+    config = config or EarlyCommitConfig()
+    early = on_early_commit is not None and config.enabled
+    results: asyncio.Queue = asyncio.Queue()
+    worker = asyncio.ensure_future(_hypotheses(transcriber, audio_bytes, results))
+    early_commit_stats.turns += 1
+
+    committed: Optional[str] = None
+    committed_at = 0.0
+    candidate: Optional[Transcription] = None
+    final = ""
+
+    def commit(text: str) -> None:
+        nonlocal committed, committed_at
+        committed, committed_at = text, time.monotonic()
+        early_commit_stats.early_commits += 1
+        logger.info(f"[EARLY COMMIT]: {text}")
+        on_early_commit(text)
+
+    try:
+        while True:
+            timeout = config.silence if early and committed is None and candidate is not None else None
+            try:
+                item = await asyncio.wait_for(results.get(), timeout)
+            except asyncio.TimeoutError:
+                # No newer hypothesis for a while, the speaker has paused
+                commit(candidate.message)
+                continue
+            if item is _DONE:
+                break
+            if isinstance(item, Exception):
+                if committed is None:
+                    raise item
+                logger.error(f"[EARLY COMMIT] recognizer failed after the commit: {item}")
+                early_commit_stats.failed_after_commit += 1
+                return TurnTranscript(final=committed, committed=committed, failed=True)
+            if item.is_final:
+                final = item.message
+                break
+            if not early or committed is not None:
+                continue
+            stable = item.stability >= config.min_stability and len(_words(item.message)) >= config.min_words
+            candidate = item if stable else None
+            if stable and audio_seconds is not None and item.end_time is not None and audio_seconds - item.end_time >= config.silence:
+                commit(item.message)
+    finally:
+        if not worker.done():
+            # The recognizer thread cannot be interrupted, let it finish in the background
+            worker.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+    transcript = TurnTranscript(final=final or committed or "", committed=committed)
+    if committed is not None:
+        early_commit_stats.seconds_saved += time.monotonic() - committed_at
+        if final and materially_different(committed, final, config.max_word_error):
+            transcript.retracted = True
+            early_commit_stats.retracted += 1
+            logger.info(f"[EARLY COMMIT RETRACTED]: {committed} -> {final}")
+        else:
+            early_commit_stats.confirmed += 1
+    return transcript
@@ -0,0 +1,325 @@
+import asyncio
+import inspect
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TURN_BUDGET = float(os.getenv("TURN_LATENCY_BUDGET", "60"))
+
+
+@dataclass
+class UpstreamLimiterConfig:
+    max_concurrency: int = 8
+    max_queue: int = 64
+    max_queue_per_key: int = 8
+    timeout: float = 30.0
+    failure_threshold: int = 5
+    recovery_time: float = 30.0
+    fallback_message: str = "This service is temporarily unavailable, please try again in a little while."
+
+    @classmethod
+    def from_env(cls, name: str, **defaults) -> "UpstreamLimiterConfig":
+        """
+        Build a config from UPSTREAM_<NAME>_* environment variables.
+
+        Args:
+            name: The upstream name, e.g. "zoozle".
+            defaults: Per-upstream defaults overriding the class defaults.
+        """
+        config = cls(**defaults)
+        prefix = f"UPSTREAM_{name.upper()}_"
+        config.max_concurrency = int(os.getenv(prefix + "CONCURRENCY", config.max_concurrency))
+        config.max_queue = int(os.getenv(prefix + "QUEUE", config.max_queue))
+        config.max_queue_per_key = int(os.getenv(prefix + "QUEUE_PER_KEY", config.max_queue_per_key))
+        config.timeout = float(os.getenv(prefix + "TIMEOUT", config.timeout))
+        config.failure_threshold = int(os.getenv(prefix + "FAILURE_THRESHOLD", config.failure_threshold))
+        config.recovery_time = float(os.getenv(prefix + "RECOVERY_TIME", config.recovery_time))
+        return config
+
+
+class UpstreamUnavailable(Exception):
+    """Raised when a call is refused or abandoned by an upstream limiter."""
+
+    def __init__(self, upstream: str, reason: str, message: str):
+        super().__init__(f"{upstream} unavailable: {reason}")
+        self.upstream = upstream
+        self.reason = reason
+        self.message = message
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a single half-open probe."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, recovery_time: float):
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.recovery_time:
+            # Let one probe through, everything else keeps failing fast
+            self.state = self.HALF_OPEN
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.trips += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def abandon_probe(self) -> None:
+        """The probe ended without an answer from the upstream, e.g. it was cancelled, wait for the next one."""
+        if self.state == self.HALF_OPEN:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class UpstreamLimiter:
+    """
+    Concurrency limiter and circuit breaker for one upstream.
+
+    Calls beyond max_concurrency wait in per-session queues that are served
+    round robin, so one busy session cannot starve the others. Sessions of
+    the same user share a queue (see set_fair_key) and each queue holds at
+    most max_queue_per_key calls. Synchronous callables are run in a worker
+    thread to keep the event loop free. A thread cannot be stopped, when its
+    call times out or is cancelled it keeps its slot until it returns.
+    """
+
+    def __init__(self, name: str, config: UpstreamLimiterConfig):
+        self.name = name
+        self.config = config
+        self.breaker = CircuitBreaker(config.failure_threshold, config.recovery_time)
+        self._in_flight = 0
+        self._waiters: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        self._waiting = 0
+        # Worker threads still running after their call was given up
+        self._abandoned = 0
+
+        self.calls = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.rejected_open = 0
+        self.rejected_queue_full = 0
+        self.rejected_key_queue_full = 0
+        self.deadline_exceeded = 0
+        self.max_waiting = 0
+
+    async def call(
+        self,
+        fn: Callable[..., Any],
+        *args,
+        session_key: Optional[str] = None,
+        deadline: Optional[float] = None,
+        **kwargs,
+    ) -> Any:
+        """
+        Run fn under the limiter.
+
+        Args:
+            fn: Sync or async callable making the upstream request.
+            session_key: Key used for fair queueing, usually the session id.
+            deadline: Absolute time.monotonic() deadline, e.g. from turn_deadline().
+
+        Raises:
+            UpstreamUnavailable: If the breaker is open, the queue is full or the deadline passed.
+        """
+        self.calls += 1
+        if not self.breaker.allow():
+            self.rejected_open += 1
+            raise UpstreamUnavailable(self.name, "circuit_open", self.config.fallback_message)
+        # Only the half-open probe gets past an open breaker, it must resolve it on every way out
+        probe = self.breaker.state == self.breaker.HALF_OPEN
+        try:
+            return await self._call(fn, args, kwargs, session_key, deadline)
+        finally:
+            if probe:
+                self.breaker.abandon_probe()
+
+    async def _call(self, fn: Callable[..., Any], args, kwargs, session_key: Optional[str], deadline: Optional[float]) -> Any:
+        timeout = self._remaining(deadline)
+        await self._acquire(_fair_keys.get(session_key, session_key) if session_key else "", timeout)
+        worker: Optional[asyncio.Future] = None
+        try:
+            timeout = self._remaining(deadline)
+            if inspect.iscoroutinefunction(fn):
+                result = await asyncio.wait_for(fn(*args, **kwargs), timeout)
+            else:
+                # Not wait_for, cancelling the wrapper would not stop the thread, it is left running instead
+                worker = asyncio.ensure_future(asyncio.to_thread(fn, *args, **kwargs))
+                done, _ = await asyncio.wait({worker}, timeout=timeout)
+                if not done:
+                    raise asyncio.TimeoutError()
+                result = worker.result()
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            self.breaker.record_failure()
+            raise UpstreamUnavailable(self.name, "timeout", self.config.fallback_message)
+        except (asyncio.CancelledError, UpstreamUnavailable):
+            raise
+        except Exception:
+            self.failed += 1
+            self.breaker.record_failure()
+            raise
+        finally:
+            if worker is not None and not worker.done():
+                self._abandoned += 1
+                worker.add_done_callback(self._thread_returned)
+            else:
+                self._release()
+        self.succeeded += 1
+        self.breaker.record_success()
+        return result
+
+    def _thread_returned(self, worker: asyncio.Future) -> None:
+        if not worker.cancelled():
+            worker.exception()
+        self._abandoned -= 1
+        self._release()
+
+    def _remaining(self, deadline: Optional[float]) -> float:
+        timeout = self.config.timeout
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+        if timeout <= 0:
+            self.deadline_exceeded += 1
+            raise UpstreamUnavailable(self.name, "deadline_exceeded", self.config.fallback_message)
+        return timeout
+
+    async def _acquire(self, session_key: str, timeout: float) -> None:
+        if self._in_flight < self.config.max_concurrency and not self._waiting:
+            self._in_flight += 1
+            return
+        if self._waiting >= self.config.max_queue:
+            self.rejected_queue_full += 1
+            raise UpstreamUnavailable(self.name, "queue_full", self.config.fallback_message)
+        if len(self._waiters.get(session_key, ())) >= self.config.max_queue_per_key:
+            # One client's backlog must not take the whole queue
+            self.rejected_key_queue_full += 1
+            raise UpstreamUnavailable(self.name, "queue_full", self.config.fallback_message)
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(session_key, deque()).append(future)
+        self._waiting += 1
+        self.max_waiting = max(self.max_waiting, self._waiting)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # The slot was granted while we were giving up, hand it on
+                self._release()
+            else:
+                future.cancel()
+                self._discard(session_key, future)
+            if isinstance(e, asyncio.TimeoutError):
+                self.deadline_exceeded += 1
+                raise UpstreamUnavailable(self.name, "deadline_exceeded", self.config.fallback_message)
+            raise
+
+    def _discard(self, session_key: str, future: asyncio.Future) -> None:
+        queue = self._waiters.get(session_key)
+        if queue and future in queue:
+            queue.remove(future)
+            self._waiting -= 1
+            if not queue:
+                del self._waiters[session_key]
+
+    def _release(self) -> None:
+        self._in_flight -= 1
+        while self._waiters and self._in_flight < self.config.max_concurrency:
+            # Serve sessions round robin: take the head session's oldest waiter
+            # and move that session to the back of the line.
+            session_key, queue = next(iter(self._waiters.items()))
+            future = queue.popleft()
+            self._waiting -= 1
+            if queue:
+                self._waiters.move_to_end(session_key)
+            else:
+                del self._waiters[session_key]
+            if not future.done():
+                self._in_flight += 1
+                future.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self._in_flight,
+            "abandoned_threads": self._abandoned,
+            "waiting": self._waiting,
+            "max_waiting": self.max_waiting,
+            "calls": self.calls,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "timed_out": self.timed_out,
+            "rejected_open": self.rejected_open,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_key_queue_full": self.rejected_key_queue_full,
+            "deadline_exceeded": self.deadline_exceeded,
+            "breaker_state": self.breaker.state,
+            "breaker_trips": self.breaker.trips,
+        }
+
+
+_limiters: Dict[str, UpstreamLimiter] = {}
+
+
+def get_limiter(name: str, **defaults) -> UpstreamLimiter:
+    """
+    Get the process-wide limiter for an upstream, creating it on first use.
+
+    Args:
+        name: The upstream name.
+        defaults: Config defaults used when the limiter is created.
+    """
+    if name not in _limiters:
+        _limiters[name] = UpstreamLimiter(name, UpstreamLimiterConfig.from_env(name, **defaults))
+    return _limiters[name]
+
+
+def limiter_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: limiter.stats() for name, limiter in _limiters.items()}
+
+
+_turn_deadlines: Dict[str, float] = {}
+_fair_keys: Dict[str, str] = {}
+
+
+def set_fair_key(session_id: str, key: str) -> None:
+    """Queue the session's upstream calls under key, e.g. its user, instead of the session id."""
+    _fair_keys[session_id] = key
+
+
+def start_turn(session_id: str, budget: Optional[float] = None) -> None:
+    """Start the latency budget of a new user turn."""
+    _turn_deadlines[session_id] = time.monotonic() + (budget or DEFAULT_TURN_BUDGET)
+
+
+def turn_deadline(session_id: Optional[str]) -> Optional[float]:
+    """The absolute deadline of the session's current turn, if any."""
+    return _turn_deadlines.get(session_id) if session_id else None
+
+
+def end_session(session_id: str) -> None:
+    _turn_deadlines.pop(session_id, None)
+    _fair_keys.pop(session_id, None)